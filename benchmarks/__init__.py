@@ -0,0 +1,3 @@
+"""
+Benchmarks for the converter. See run.py
+"""
@@ -0,0 +1,65 @@
+"""
+Synthetic preset corpus for benchmarking
+
+Presets start from the Init Patch with every parameter randomized, so runs are repeatable for a given seed
+"""
+from oneconverter.bank import Bank, init_patch_data
+from oneconverter.preset import Preset, process_fxp
+from oneconverter.schema import PARAMETER_SCHEMA
+from typing import Dict, List
+import random
+import string
+
+NAME_CHARACTERS = string.ascii_letters + string.digits + ' -_()&<>'
+
+
+def random_preset(rng: random.Random, number: int = 0) -> 'Preset':
+    """
+    The Init Patch with every parameter set to something random (but legal)
+    :param rng:
+    :param number: Goes into the name
+    :return:
+    """
+    preset = process_fxp(init_patch_data())
+    suffix = ''.join(rng.choice(NAME_CHARACTERS) for _ in range(rng.randint(0, 14)))
+    preset.name = f'Bench {number:04} {suffix}'.strip()
+    for spec in PARAMETER_SCHEMA:
+        if spec.param_type == 'boolean':
+            value = float(rng.randint(0, 1))
+        elif spec.steps != -1:
+            value = rng.randint(0, spec.steps - 1) / (spec.steps - 1)
+        else:
+            value = rng.random()
+        preset.values[spec.index] = value
+    return preset
+
+
+class Corpus:
+    """
+    The same random presets in every format, plus full banks of them
+    """
+    def __init__(self, preset_count: int = 200, bank_count: int = 4, seed: int = 1014) -> None:
+        """
+        Generate the corpus
+        :param preset_count: Number of individual presets
+        :param bank_count: Number of 100 program banks
+        :param seed:
+        """
+        rng = random.Random(seed)
+        # Round trip through FXP so the values are what they'd be after reading any real file
+        self.presets: List[Preset] = [process_fxp(random_preset(rng, i).return_fxp_data())
+                                      for i in range(preset_count)]
+        self.fxp: List[bytes] = [bytes(p.return_fxp_data()) for p in self.presets]
+        self.aup: List[bytes] = [p.return_au_data() for p in self.presets]
+        self.res: List[bytes] = [p.return_reason_data() for p in self.presets]
+
+        self.banks: List[Bank] = [Bank([process_fxp(random_preset(rng, b * 100 + i).return_fxp_data())
+                                        for i in range(100)]) for b in range(bank_count)]
+        self.fxb: List[bytes] = [bytes(b.return_bank_data()) for b in self.banks]
+
+    def sizes(self) -> Dict[str, int]:
+        """
+        Total bytes of each format
+        :return:
+        """
+        return {fmt: sum(len(d) for d in getattr(self, fmt)) for fmt in ('fxp', 'aup', 'res', 'fxb')}
@@ -0,0 +1,222 @@
+"""
+Parse and serialize throughput, and peak memory for bank sized work
+
+    python -m benchmarks.run --save before.json
+    ... make changes ...
+    python -m benchmarks.run --compare before.json
+
+Comparing exits non zero if anything got slower (or hungrier) than the thresholds allow.
+Timings are only comparable on the same machine, so save the baseline where you compare
+"""
+from .corpus import Corpus
+from oneconverter import process_au, process_fxb, process_fxp, process_re, LazyBank
+from oneconverter.bank import Bank, BankEditor
+from oneconverter.library import Library, pack_library
+
+try:
+    from oneconverter.columnar import render_reason_batch
+except ImportError:  # No numpy, no batch benchmarks
+    render_reason_batch = None
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Tuple, Union
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+# Name: (function to run once per item, items, bytes per item)
+Benchmark = Tuple[Callable, List, List[int]]
+
+
+def throughput_benchmarks(corpus: Corpus) -> Dict[str, Benchmark]:
+    def sizes(data: List[bytes]) -> List[int]:
+        return [len(d) for d in data]
+
+    res_files = [(data, f'{preset.name}.repatch') for data, preset in zip(corpus.res, corpus.presets)]
+    libraries = [bytes(pack_library(corpus.presets))]
+    benchmarks = {
+        'parse.process_fxp': (process_fxp, corpus.fxp, sizes(corpus.fxp)),
+        'parse.process_au': (process_au, corpus.aup, sizes(corpus.aup)),
+        'parse.process_re': (lambda item: process_re(item[0], file_name=item[1]), res_files, sizes(corpus.res)),
+        'parse.process_fxb': (process_fxb, corpus.fxb, sizes(corpus.fxb)),
+        'serialize.return_fxp_data': (lambda p: p.return_fxp_data(), corpus.presets, sizes(corpus.fxp)),
+        'serialize.return_au_data': (lambda p: p.return_au_data(), corpus.presets, sizes(corpus.aup)),
+        'serialize.return_reason_data': (lambda p: p.return_reason_data(), corpus.presets, sizes(corpus.res)),
+        'serialize.return_bank_data': (lambda b: b.return_bank_data(), corpus.banks, sizes(corpus.fxb)),
+        'parse.library_walk': (lambda data: list(Library(data)), libraries, sizes(libraries)),
+        'serialize.pack_library': (pack_library, [corpus.presets], sizes(libraries)),
+        # One program swapped in a bank, the way a librarian would. Per bank, so comparable with return_bank_data
+        'edit.bank_program': (lambda data: BankEditor(bytearray(data)).__setitem__(50, corpus.presets[0]), corpus.fxb,
+                              sizes(corpus.fxb)),
+    }
+    if render_reason_batch is not None:
+        # The whole corpus as one matrix, so one op is every preset
+        matrix = Library(libraries[0]).matrix()
+        benchmarks['serialize.render_reason_batch'] = (render_reason_batch, [matrix], [sum(sizes(corpus.res))])
+    return benchmarks
+
+
+def memory_benchmarks(corpus: Corpus) -> Dict[str, Callable[[], object]]:
+    def lazy_bank_walk() -> None:
+        for data in corpus.fxb:
+            with LazyBank(data) as bank:
+                for preset in bank:
+                    preset.return_fxp_data()
+
+    return {
+        'memory.process_fxb': lambda: [process_fxb(data) for data in corpus.fxb],
+        'memory.return_bank_data': lambda: [bank.return_bank_data() for bank in corpus.banks],
+        'memory.lazy_bank_walk': lazy_bank_walk,
+        'memory.bank_round_trip': lambda: [Bank(process_fxb(data).presets).return_bank_data() for data in corpus.fxb],
+    }
+
+
+def time_benchmark(benchmark: Benchmark, repeat: int, min_time: float) -> Dict[str, float]:
+    """
+    Run over every item until at least min_time has gone by, repeat times, and keep the best run
+    :param benchmark:
+    :param repeat:
+    :param min_time:
+    :return:
+    """
+    fn, items, item_sizes = benchmark
+    best = None
+    for _ in range(repeat):
+        ops = 0
+        started = time.perf_counter()
+        while True:
+            for item in items:
+                fn(item)
+            ops += len(items)
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        per_op = elapsed / ops
+        best = per_op if best is None else min(best, per_op)
+
+    mean_size = sum(item_sizes) / len(item_sizes)
+    return {
+        'seconds_per_op': best,
+        'ops_per_second': 1 / best,
+        'mb_per_second': mean_size / best / 1048576,
+    }
+
+
+def peak_memory(fn: Callable[[], object]) -> int:
+    """
+    Peak bytes allocated while running fn, counting whatever it returns
+    :param fn:
+    :return:
+    """
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        del result
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def run(repeat: int = 5, min_time: float = 0.2, only: Union[str, None] = None) -> Dict:
+    corpus = Corpus()
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'corpus': corpus.sizes(),
+        'throughput': {},
+        'memory': {},
+    }
+
+    # Bank writing likes to tell you about padding. Not what we're here to measure
+    with redirect_stdout(io.StringIO()):
+        for name, benchmark in throughput_benchmarks(corpus).items():
+            if only is None or only in name:
+                results['throughput'][name] = time_benchmark(benchmark, repeat, min_time)
+        for name, fn in memory_benchmarks(corpus).items():
+            if only is None or only in name:
+                results['memory'][name] = peak_memory(fn)
+    return results
+
+
+def compare(baseline: Dict, results: Dict, time_threshold: float, memory_threshold: float) -> List[str]:
+    """
+    Find everything that's regressed past its threshold
+    :param baseline:
+    :param results:
+    :param time_threshold: Fraction slower that's allowed
+    :param memory_threshold: Fraction more peak memory that's allowed
+    :return: Descriptions of the regressions
+    """
+    regressions = []
+    for name, result in results['throughput'].items():
+        old = baseline.get('throughput', {}).get(name)
+        if old is not None:
+            change = result['seconds_per_op'] / old['seconds_per_op'] - 1
+            if change > time_threshold:
+                regressions.append(f'{name} is {change:.0%} slower')
+    for name, peak in results['memory'].items():
+        old = baseline.get('memory', {}).get(name)
+        if old:
+            change = peak / old - 1
+            if change > memory_threshold:
+                regressions.append(f'{name} uses {change:.0%} more memory')
+    return regressions
+
+
+def print_results(results: Dict, baseline: Union[Dict, None] = None) -> None:
+    baseline = baseline or {}
+    for name, result in results['throughput'].items():
+        line = (f'{name:<32} {result["seconds_per_op"] * 1e6:>10.1f} us/op {result["ops_per_second"]:>10.0f} ops/s '
+                f'{result["mb_per_second"]:>8.2f} MB/s')
+        old = baseline.get('throughput', {}).get(name)
+        if old is not None:
+            line += f' {result["seconds_per_op"] / old["seconds_per_op"] - 1:>+7.1%}'
+        print(line)
+    for name, peak in results['memory'].items():
+        line = f'{name:<32} {peak / 1024:>10.0f} KiB peak'
+        old = baseline.get('memory', {}).get(name)
+        if old:
+            line += f' {peak / old - 1:>+7.1%}'
+        print(line)
+
+
+def main(argv: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description='Benchmark the converter')
+    parser.add_argument('--save', metavar='FILE', help='Save the results, to compare against later')
+    parser.add_argument('--compare', metavar='FILE', help='Fail if results regressed from these saved ones')
+    parser.add_argument('--time-threshold', type=float, default=0.25,
+                        help='Fraction slower allowed before failing (default: 0.25)')
+    parser.add_argument('--memory-threshold', type=float, default=0.10,
+                        help='Fraction more peak memory allowed before failing (default: 0.10)')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each benchmark, keeping the best')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Minimum seconds per run')
+    parser.add_argument('-k', dest='only', help='Only run benchmarks with this in their name')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = run(repeat=args.repeat, min_time=args.min_time, only=args.only)
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(baseline, results, args.time_threshold, args.memory_threshold)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,171 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from io import BytesIO
-from flask import Flask, render_template, request, send_file
+from flask import Flask, Request, Response, abort, current_app, redirect, render_template, request, send_file, \
+    url_for
+from oneconverter.batch import convert_archive, convert_files, explode_bank
+from oneconverter.cache import KEY_PATTERN, ConversionCache, cache_key
+from oneconverter.convert import COLLECTION_FORMATS, FORMATS, ConversionError, convert_preset_timed, warmup
+from oneconverter.metrics import count_conversion, count_parse_failure, observe_stage, render_metrics
+from oneconverter.pool import BoundedPool, ConversionTimeout, PoolFull
+from oneconverter.preset import PARSE_ERRORS
+from oneconverter.sniff import sniff
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Tuple, Union
+from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
-import oneconverter
+import os
+import tempfile
+import time
+import zipfile
+
+
+class SpoolingRequest(Request):
+    """
+    Uploads that fit in UPLOAD_SPOOL_BYTES are kept in memory. Bigger ones (or ones of unknown size) are written
+    straight to a temp file, so a worker's memory doesn't grow with how big, or how many, the uploads are
+    """
+    def _get_file_stream(self, total_content_length: Union[int, None], content_type: Union[str, None],
+                         filename: Union[str, None] = None, content_length: Union[int, None] = None) -> BinaryIO:
+        if total_content_length is not None and total_content_length <= current_app.config['UPLOAD_SPOOL_BYTES']:
+            return BytesIO()
+        # Named, so conversion workers can map it themselves rather than having it copied over to them
+        return tempfile.NamedTemporaryFile('w+b', suffix='.upload', dir=current_app.config['UPLOAD_SPOOL_DIR'])
+
+
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024  # 1 Meg
-# 'process_fxp', 'process_au', 'process_re', 'process_fxb']
-format_dict = {
-    'fxp': ('process_fxp', 'return_fxp_data', 'fxp'),
-    'aup': ('process_au', 'return_au_data', 'aupreset'),
-    'res': ('process_re', 'return_reason_data', 'repatch'),
-    'fxb': ('process_fxb', 'put_something_here', 'fxb'),
-}
+app.request_class = SpoolingRequest
+app.config['PRESET_MAX_CONTENT_LENGTH'] = int(os.environ.get('PRESET_MAX_CONTENT_LENGTH', 1024 * 1024))  # 1 Meg
+app.config['BATCH_MAX_CONTENT_LENGTH'] = int(os.environ.get('BATCH_MAX_CONTENT_LENGTH', 64 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = max(app.config['PRESET_MAX_CONTENT_LENGTH'], app.config['BATCH_MAX_CONTENT_LENGTH'])
+app.config['UPLOAD_SPOOL_BYTES'] = int(os.environ.get('UPLOAD_SPOOL_BYTES', 512 * 1024))  # Per request
+app.config['UPLOAD_SPOOL_DIR'] = os.environ.get('UPLOAD_SPOOL_DIR')  # The system temp dir if not set
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+app.config['CONVERSION_CACHE_BYTES'] = int(os.environ.get('CONVERSION_CACHE_BYTES', 64 * 1024 * 1024))
+app.config['CONVERSION_CACHE_DIR'] = os.environ.get('CONVERSION_CACHE_DIR')  # Shared between workers if set
+app.config['CONVERSION_CACHE_DISK_BYTES'] = int(os.environ.get('CONVERSION_CACHE_DISK_BYTES', 1024 * 1024 * 1024))
+app.config['CONVERSION_WORKERS'] = int(os.environ.get('CONVERSION_WORKERS', os.cpu_count() or 1))
+app.config['CONVERSION_QUEUE_DEPTH'] = int(os.environ.get('CONVERSION_QUEUE_DEPTH', 16))
+# Keep this under gunicorn's --timeout so a stuck conversion doesn't take the web worker down with it
+app.config['CONVERSION_TIMEOUT'] = float(os.environ.get('CONVERSION_TIMEOUT', 10))
+# Converted files never change (see /converted), so they can be cached for as long as anything will keep them
+app.config['CONVERTED_MAX_AGE'] = int(os.environ.get('CONVERTED_MAX_AGE', 365 * 24 * 60 * 60))  # Seconds
+app.config['CONVERSION_RETRY_AFTER'] = int(os.environ.get('CONVERSION_RETRY_AFTER', 2))  # Seconds
+format_dict = FORMATS
+
+conversion_cache = ConversionCache(app.config['CONVERSION_CACHE_BYTES'], app.config['CONVERSION_CACHE_DIR'],
+                                   app.config['CONVERSION_CACHE_DISK_BYTES'])
+conversion_pool = BoundedPool(app.config['CONVERSION_WORKERS'], app.config['CONVERSION_QUEUE_DEPTH'],
+                              app.config['CONVERSION_TIMEOUT'])
+_batch_pool = None
+
+
+def batch_pool() -> ProcessPoolExecutor:
+    """
+    Created on first use, so each gunicorn worker gets its own after forking
+    :return:
+    """
+    global _batch_pool
+    if _batch_pool is None:
+        _batch_pool = ProcessPoolExecutor(max_workers=app.config['BATCH_WORKERS'])
+    return _batch_pool
+
+
+def upload_data(upload: FileStorage) -> Union[bytes, Path]:
+    """
+    An upload as something that can be handed to a conversion worker without reading it all into memory:
+    the bytes if it was small enough to keep in memory anyway, otherwise the path of the file it was spooled to
+    :param upload:
+    :return:
+    """
+    stream = upload.stream
+    if isinstance(stream, BytesIO):
+        return stream.getvalue()  # Shares the buffer rather than copying it
+    stream.flush()
+    return Path(stream.name)
+
+
+def take_upload(upload: FileStorage) -> BinaryIO:
+    """
+    Take an upload's file away from the request. Tearing the request down closes (and so deletes) the files it still
+    has, which is too soon for a streamed response that's still reading them
+    :param upload:
+    :return: The file. Close it when done with it
+    """
+    stream = upload.stream
+    upload.stream = BytesIO()
+    return stream
+
+
+def closing(results: Iterable[bytes], streams: List[BinaryIO]) -> Iterator[bytes]:
+    """
+    Pass a streamed response through, closing the uploads it was made from once it's done (or abandoned)
+    :param results:
+    :param streams:
+    :return:
+    """
+    try:
+        yield from results
+    finally:
+        for stream in streams:
+            stream.close()
+
+
+def stream_size(stream: BinaryIO) -> int:
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def read_stream(stream: BinaryIO) -> bytes:
+    stream.seek(0)
+    return stream.read()
+
+
+def cache_forever(response: Response, key: str) -> Response:
+    """
+    Mark a response as the never changing result of a conversion. The cache key is already a hash of everything the
+    result depends on, so it's the ETag as is
+    :param response:
+    :param key:
+    :return:
+    """
+    response.set_etag(key)
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['CONVERTED_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
+
+
+def send_converted(converted_data: bytes, file_name: str, from_fmt: str = '', to_fmt: str = '',
+                   started: Union[float, None] = None, key: Union[str, None] = None):
+    """
+    Send converted data as a download. Given a start time, also records how long sending and the whole request took
+    :param converted_data:
+    :param file_name:
+    :param from_fmt:
+    :param to_fmt:
+    :param started: perf_counter() when the request started
+    :param key: The conversion's cache key, to make the response cacheable
+    :return:
+    """
+    response = send_file(BytesIO(converted_data), as_attachment=True, download_name=file_name)
+    if key is not None:
+        cache_forever(response, key)
+        response.headers['Content-Location'] = url_for('converted', key=key)
+    if started is not None:
+        sending = time.perf_counter()
+
+        def sent() -> None:
+            finished = time.perf_counter()
+            observe_stage('send', from_fmt, to_fmt, finished - sending)
+            observe_stage('total', from_fmt, to_fmt, finished - started)
+
+        response.call_on_close(sent)
+        response.direct_passthrough = False  # Passed through responses never get closed, so never call sent
+    return response
 
 
 @app.route('/')
@@ -20,24 +175,190 @@ def index():
 
 @app.route('/convert', methods=['POST'])
 def convert():
-    from_fmt = request.form['from_fmt']
-    to_fmt = request.form['to_fmt']
-    parse_method = format_dict[from_fmt][0]
-    export_method = format_dict[to_fmt][1]
+    if (request.content_length or 0) > app.config['PRESET_MAX_CONTENT_LENGTH']:
+        abort(413)
+
+    started = time.perf_counter()
+    from_fmt = request.form.get('from_fmt', 'auto')
+    to_fmt = request.form.get('to_fmt')
+    if to_fmt not in FORMATS:
+        # Not counted, so the metrics' labels stay the formats there are
+        return 'Can not convert to that format.', 400
     uploaded_preset = request.files['preset_file']
-    preset_file_data = uploaded_preset.read()
+    preset_file_data = upload_data(uploaded_preset)
     upload_file_name = secure_filename(uploaded_preset.filename)
 
-    if parse_method != 'process_fxb':
-        parsed_preset: oneconverter.preset.Preset = getattr(oneconverter, parse_method)(preset_file_data,
-                                                                                        file_name=upload_file_name)
-        parsed_preset_name = f'{parsed_preset.name}.{format_dict[to_fmt][2]}'
-        converted_data_stream = BytesIO(getattr(parsed_preset, export_method)())
+    # What the file says it is beats what the form says. The form only matters if the file isn't telling
+    sniffed = sniff(preset_file_data)
+    if sniffed.fmt is not None or from_fmt == 'auto':
+        from_fmt = sniffed.fmt or 'auto'
+    observe_stage('read', from_fmt, to_fmt, time.perf_counter() - started)
+
+    if sniffed.error is not None and (sniffed.fmt is not None or from_fmt == 'auto'):
+        # Never going to convert, so don't bother a worker with it
+        return conversion_failed(upload_file_name, from_fmt, to_fmt, sniffed.error, PARSE_ERRORS[sniffed.error])
+
+    # Reason presets, and the zips banks and libraries explode into, are named after the file,
+    # so that's part of what the output depends on
+    named_after_file = from_fmt == 'res' or from_fmt in COLLECTION_FORMATS
+    key = cache_key(preset_file_data, from_fmt, to_fmt, upload_file_name if named_after_file else '')
+    cached = conversion_cache.get(key)
+    if cached is not None:
+        count_conversion(from_fmt, to_fmt, 'cached')
+        return converted_response(cached, key, from_fmt, to_fmt, started, conversion_cache.on_disk(key))
+
+    submitted = time.perf_counter()
+    try:
+        if from_fmt in COLLECTION_FORMATS:
+            # Explode the bank (or library) into a zip of its programs
+            converted_data = conversion_pool.run(explode_bank, preset_file_data, to_fmt, upload_file_name, from_fmt)
+            converted_name = f'{upload_file_name.rpartition(".")[0] or COLLECTION_FORMATS[from_fmt][1]}.zip'
+            observe_stage('convert', from_fmt, to_fmt, time.perf_counter() - submitted)
+        else:
+            converted_data, converted_name, timings = conversion_pool.run(
+                convert_preset_timed, preset_file_data, from_fmt, to_fmt, file_name=upload_file_name)
+            for stage, seconds in timings.items():
+                observe_stage(stage, from_fmt, to_fmt, seconds)
+            observe_stage('queue', from_fmt, to_fmt, time.perf_counter() - submitted - sum(timings.values()))
+    except PoolFull:
+        count_conversion(from_fmt, to_fmt, 'busy')
+        return Response('Too many conversions going on right now. Try again in a moment.', 503,
+                        headers={'Retry-After': str(app.config['CONVERSION_RETRY_AFTER'])})
+    except ConversionTimeout:
+        count_conversion(from_fmt, to_fmt, 'timeout')
+        print(f'Conversion of {upload_file_name} timed out')
+        return 'That preset took too long to convert. Sorry :( Hit us up on Discord.', 504
+    except ConversionError as e:
+        return conversion_failed(upload_file_name, from_fmt, to_fmt, e.reason, PARSE_ERRORS.get(e.reason, str(e)))
+
+    count_conversion(from_fmt, to_fmt, 'ok')
+    on_disk = conversion_cache.put(key, converted_data, converted_name)
+    return converted_response((converted_data, converted_name), key, from_fmt, to_fmt, started, on_disk)
+
+
+def conversion_failed(file_name: str, from_fmt: str, to_fmt: str, reason: str, message: str) -> Response:
+    """
+    Respond to a file that can't be converted. A 400 if converting between those formats isn't a thing,
+    otherwise a 422. The reason code goes along too, in the text and the X-Conversion-Error header
+    :param file_name:
+    :param from_fmt:
+    :param to_fmt:
+    :param reason: The reason code, one of PARSE_ERRORS' or a ConversionError's
+    :param message: What to tell the user
+    :return:
+    """
+    count_conversion(from_fmt, to_fmt, 'failed')
+    count_parse_failure(from_fmt, reason)
+    print(f'Could not convert {file_name}: {message} ({reason})')
+    status = 400 if reason == 'unsupported_format' else 422
+    return Response(f'Can not convert that file. {message.rstrip(".")}. (Error code: {reason})', status,
+                    headers={'X-Conversion-Error': reason})
+
+
+def converted_response(converted: Tuple[bytes, str], key: str, from_fmt: str, to_fmt: str, started: float,
+                       on_disk: bool):
+    """
+    Respond to a conversion. Redirects to where the result always lives when every worker can see it there (it's in
+    the on disk cache), so it's a plain GET that browsers and CDNs can cache. Otherwise sends it straight back
+    :param converted: The converted data and its file name
+    :param key:
+    :param from_fmt:
+    :param to_fmt:
+    :param started: perf_counter() when the request started
+    :param on_disk: Whether the result is in the on disk cache
+    :return:
+    """
+    if not on_disk:
+        return send_converted(*converted, from_fmt, to_fmt, started, key=key)
+
+    observe_stage('total', from_fmt, to_fmt, time.perf_counter() - started)
+    return redirect(url_for('converted', key=key), 303)
+
+
+@app.route('/converted/<key>')
+def converted(key: str):
+    """
+    A conversion's result, by cache key (the input's hash and the format it was converted to). The key covers
+    everything the result depends on, so it never changes: clients that have it get a 304, as long as it's still around
+    :param key:
+    :return:
+    """
+    if not KEY_PATTERN.fullmatch(key):
+        abort(404)
+    cached = conversion_cache.get(key)
+    if cached is None:
+        return 'That conversion is not around any more. Convert the file again.', 404
+
+    # Checked after looking it up, as If-None-Match: * matches anything that exists
+    if request.if_none_match.contains_weak(key):
+        return cache_forever(Response(status=304), key)
+    return send_converted(*cached, key=key)
+
+
+@app.route('/metrics')
+def metrics():
+    rendered = render_metrics()
+    if rendered is None:
+        return 'Metrics need prometheus_client installed', 501
+    data, content_type = rendered
+    return Response(data, content_type=content_type)
+
+
+@app.route('/convert/batch', methods=['POST'])
+def convert_batch():
+    """
+    Convert a zip of presets (any mix of formats, going by extension) to one format
+    Streams back a zip of the results, with a manifest.json saying what happened to each file
+    :return:
+    """
+    to_fmt = request.form['to_fmt']
+    if to_fmt not in format_dict:
+        abort(400)
+
+    archive = request.files['batch_file'].stream
+    if not zipfile.is_zipfile(archive):
+        return 'That does not look like a zip file.', 400
+
+    # The archive stays wherever it was spooled to, and only gets read a member at a time
+    archive = take_upload(request.files['batch_file'])
+    workers = app.config['BATCH_WORKERS']
+    results = convert_archive(archive, to_fmt, executor=batch_pool(), max_in_flight=workers * 2,
+                              max_file_size=app.config['PRESET_MAX_CONTENT_LENGTH'])
+    return Response(closing(results, [archive]), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename=converted_{to_fmt}.zip'})
+
+
+@app.route('/convert/pack', methods=['POST'])
+def convert_pack():
+    """
+    Pack a bunch of uploaded presets (and banks) into 100 program banks, optionally leaving out duplicates
+    Streams back a zip of the banks, with a manifest.json saying what happened to each file
+    :return:
+    """
+    uploads = request.files.getlist('preset_files')
+    names = [secure_filename(uploaded_preset.filename) for uploaded_preset in uploads]
+    streams = [take_upload(uploaded_preset) for uploaded_preset in uploads]
+    # Each one is only read when it's about to be converted
+    entries = [(name, stream_size(stream), partial(read_stream, stream)) for name, stream in zip(names, streams)]
+
+    dedupe = None
+    if request.form.get('dedupe'):
+        try:
+            dedupe = max(float(request.form.get('dedupe_tolerance') or 0), 0.0)
+        except ValueError:
+            for stream in streams:
+                stream.close()
+            return 'The duplicate tolerance has to be a number.', 400
 
-        return send_file(converted_data_stream, as_attachment=True, attachment_filename=parsed_preset_name)
+    workers = app.config['BATCH_WORKERS']
+    results = convert_files(entries, 'fxb', executor=batch_pool(), max_in_flight=workers * 2,
+                            max_file_size=app.config['PRESET_MAX_CONTENT_LENGTH'], dedupe=dedupe)
+    return Response(closing(results, streams), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=banks.zip'})
 
-    return 'Something happened. Sorry :( Hit us up on Discord.'
 
+# With gunicorn's preload_app this runs once in the master, and every worker (and its pools) shares the result
+warmup(freeze=True)
 
 if __name__ == '__main__':
     app.run()
@@ -5,7 +5,10 @@ Original ActionScript code courtesy of Kilohearts
 Python version started by Jason Gillman Jr.
 """
 
-from .preset import process_fxp, process_au, process_re
-from .bank import process_fxb
+from .preset import process_fxp, process_au, process_re, process_re_batch
+from .bank import process_fxb, LazyBank, BankEditor
+from .library import process_library, Library
+from .convert import warmup
 
-__all__ = ['process_fxp', 'process_au', 'process_re', 'process_fxb']
+__all__ = ['process_fxp', 'process_au', 'process_re', 'process_re_batch', 'process_fxb', 'LazyBank', 'BankEditor',
+           'process_library', 'Library', 'warmup']
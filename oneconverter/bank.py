@@ -1,33 +1,52 @@
 """
 Bank stuff
 """
-from .utils import convert_magic, read_b_uint, range_pop, write_uint_b, CURRENT_VERSION
-from .preset import Preset, process_fxp
-from pathlib import Path
-from typing import List, Union
+from .binary import ByteReader, ByteWriter, BufferInput, FXB_HEADER, BANK_CHUNK_HEADER, BANK_PROGRAM_HEADER, \
+    PARAM_CHUNK_SIZE, PROGRAM_SLOT_SIZE, CHUNK_MAGIC, FXB_MAGIC, KHS_ONE_ID, BANK_NAME_SIZE, as_view, fxb_header, \
+    name_field
+from .utils import CURRENT_VERSION
+from .preset import Preset, parse_failed, process_fxp
+from array import array
+from functools import lru_cache
+from typing import BinaryIO, Iterable, Iterator, List, Tuple, Union
 import base64
+import mmap
+import os
+import struct
 
+NAME_FIELD = struct.Struct(f'{BANK_NAME_SIZE}s')
+FXB_SIZE_FIELD = struct.Struct('>I')
+FXB_SIZE_OFFSET = 4  # After chunkMagic
+FXB_PROGRAM_CHUNK_SIZE_OFFSET = FXB_HEADER.size - FXB_SIZE_FIELD.size  # The last thing in the header
 
-def return_bank_presets(bank_prog_data: bytearray, prog_count: int = 100, **kwargs) -> List['Preset']:
+
+def return_bank_presets(bank_prog_data: BufferInput, prog_count: int = 100, errors: Union[List[str], None] = None,
+                        **kwargs) -> Union[List['Preset'], None]:
     """
     Get the programs from the bank
     :param bank_prog_data:
     :param prog_count:
+    :param errors: Gets the reason code (see PARSE_ERRORS) added if it's not usable
     :return:
     """
-    version = read_b_uint(bank_prog_data, False)
+    reader = ByteReader(bank_prog_data)
+    if reader.remaining < BANK_CHUNK_HEADER.size:
+        return parse_failed('bank_truncated', errors)
+    version, = reader.unpack(BANK_CHUNK_HEADER)
 
     preset_list = []
 
     for i in range(0, prog_count, 1):
+        if reader.remaining < BANK_PROGRAM_HEADER.size:
+            print(f'Bank program data is truncated after {i} programs')
+            break
+
+        name, param_chunk_size = reader.unpack(BANK_PROGRAM_HEADER)
         preset = Preset()
         preset.version = version
-        preset.name = range_pop(bank_prog_data, 0, 24).decode('utf-8').rstrip('\x00')  # Could still be padded...
+        preset.name = name.decode('utf-8', errors='replace').rstrip('\x00')  # Could still be padded...
 
-        param_chunk_size = read_b_uint(bank_prog_data, False)
-        param_chunk_data = range_pop(bank_prog_data, 0, param_chunk_size)
-
-        if not preset.insert_param_chunk_into_fxp_preset(param_chunk_data):
+        if not preset.insert_param_chunk_into_fxp_preset(reader.read(param_chunk_size)):
             print(f'Preset chunk data load failure for bank program: {preset.name}')
             continue  # I think we can get away with skipping the preset
 
@@ -36,6 +55,47 @@ def return_bank_presets(bank_prog_data: bytearray, prog_count: int = 100, **kwar
     return preset_list
 
 
+@lru_cache(maxsize=None)
+def init_patch_data() -> bytes:
+    """
+    The Init Patch FXP. Only read from disk once per process
+    :return:
+    """
+    with open(os.path.join(os.path.dirname(__file__), 'init_patch.b64')) as f:
+        return base64.b64decode(f.read())
+
+
+def write_program_slot(preset: 'Preset', writer: ByteWriter) -> None:
+    """
+    Write a preset as a bank program slot: 24 byte name, param chunk size and the param chunk
+    :param preset:
+    :param writer:
+    :return:
+    """
+    writer.pack(BANK_PROGRAM_HEADER, name_field(preset.name, BANK_NAME_SIZE), PARAM_CHUNK_SIZE)
+    preset.write_fxp_param_chunk(writer)
+
+
+def return_program_slot(preset: 'Preset') -> bytearray:
+    """
+    Return a preset as a bank program slot
+    :param preset:
+    :return:
+    """
+    writer = ByteWriter(PROGRAM_SLOT_SIZE)
+    write_program_slot(preset, writer)
+    return writer.buffer
+
+
+@lru_cache(maxsize=None)
+def init_patch_slot() -> bytes:
+    """
+    The Init Patch as a bank program slot, for padding out short banks
+    :return:
+    """
+    return bytes(return_program_slot(process_fxp(init_patch_data())))
+
+
 class Bank:
     """
     A VST Bank (FXB)
@@ -61,103 +121,352 @@ class Bank:
         self.presets.append(preset)
         return None
 
-    def return_bank_data(self) -> bytes:
+    def return_bank_data(self) -> bytearray:
         """
         Return data representing an FXB file
         :return:
         """
-        bank_bytes = bytes()
-
-        bank_bytes += write_uint_b(convert_magic('FBCh'))
-        bank_bytes += write_uint_b(1)
-        bank_bytes += write_uint_b(convert_magic('kHs1'))
-        bank_bytes += write_uint_b(CURRENT_VERSION)
+        presets = self._bank_presets()
+        program_chunk_size = BANK_CHUNK_HEADER.size + 100 * PROGRAM_SLOT_SIZE
 
-        bank_bytes += write_uint_b(100)
-        for i in range(0, 128, 1):
-            bank_bytes += b'\x00'
+        writer = ByteWriter(FXB_HEADER.size + program_chunk_size)
+        writer.pack(FXB_HEADER, *fxb_header(program_chunk_size))
+        writer.pack(BANK_CHUNK_HEADER, CURRENT_VERSION)
+        for p in presets:
+            write_program_slot(p, writer)
+        writer.write(init_patch_slot() * (100 - len(presets)))
 
-        preset_data = self._build_bank_chunk()
+        return writer.buffer
 
-        bank_bytes += write_uint_b(len(preset_data))
-        bank_bytes += preset_data
+    def write_to(self, fileobj: BinaryIO) -> int:
+        """
+        Stream the FXB data to a file, socket file, etc. one program at a time
+        :param fileobj:
+        :return: The number of bytes written
+        """
+        presets = self._bank_presets()
+        program_chunk_size = BANK_CHUNK_HEADER.size + 100 * PROGRAM_SLOT_SIZE
 
-        r_data = write_uint_b(convert_magic('CcnK'))
-        r_data += write_uint_b(len(bank_bytes))
-        r_data += bank_bytes
+        fileobj.write(FXB_HEADER.pack(*fxb_header(program_chunk_size)) + BANK_CHUNK_HEADER.pack(CURRENT_VERSION))
+        for p in presets:
+            fileobj.write(return_program_slot(p))
+        fileobj.write(init_patch_slot() * (100 - len(presets)))
 
-        return r_data
+        return FXB_HEADER.size + program_chunk_size
 
-    def _build_bank_chunk(self) -> bytes:
+    def _bank_presets(self) -> List['Preset']:
         """
-        Returns the preset data
+        Returns the presets that will actually go into the bank
         :return:
         """
         preset_list_len = len(self.presets)
         if preset_list_len > 100:
             print('Preset count greater than 100. Only using the first 100.')
-            presets = self.presets[:100]
+            return self.presets[:100]
         elif preset_list_len < 100:
             print('Preset count less than 100. Padding with the Init Patch.')
-            presets = self.presets[:]
-            init_preset_data = base64.b64decode(Path(__file__).parent.joinpath('init_patch.b64').read_text())
-            for i in range(0, 100 - preset_list_len, 1):
-                presets.append(process_fxp(init_preset_data))
-        else:
-            presets = self.presets[:]
 
-        chunk_data = bytes()
-        chunk_data += write_uint_b(CURRENT_VERSION, False)
+        return self.presets[:]
 
-        for p in presets:
-            cropped_name = p.name[0:24] if len(p.name) >= 24 else p.name
-            chunk_data += cropped_name.encode('utf-8')
-            for x in range(0, 24 - len(cropped_name)):
-                chunk_data += b'\x00'
-            p_data = p.return_fxp_param_chunk()
-            chunk_data += write_uint_b(len(p_data), False)
-            chunk_data += p_data
 
-        return chunk_data
+def pack_banks(presets: Iterable['Preset']) -> Iterator[Bank]:
+    """
+    Pack presets into as many banks as it takes, 100 at a time
+    :param presets:
+    :return:
+    """
+    bank_presets = []
+    for preset in presets:
+        bank_presets.append(preset)
+        if len(bank_presets) == 100:
+            yield Bank(bank_presets)
+            bank_presets = []
+
+    if bank_presets:
+        yield Bank(bank_presets)
 
 
-def process_fxb(bank_file: Path) -> Union[Bank, None]:
+def read_fxb_header(reader: ByteReader, errors: Union[List[str], None] = None) -> Union[Tuple[int, int], None]:
     """
-    Parse an FXB Bank
-    :param bank_file:
-    :return:
+    Read and validate an FXB header, leaving the reader at the start of the program chunk
+    :param reader:
+    :param errors: Gets the reason code (see PARSE_ERRORS) added if it's not usable
+    :return: The program count and program chunk size, or None if it's not a usable bank
     """
+    if reader.remaining < FXB_HEADER.size:
+        return parse_failed('bank_truncated', errors)
 
-    data = bytearray(bank_file.read_bytes())
+    chunk_magic, _, fx_magic, _, fx_id, version, num_programs, program_chunk_size = reader.unpack(FXB_HEADER)
 
-    chunk_magic = read_b_uint(data)
-    read_b_uint(data)  # size = read_b_uint(data)
-    fx_magic = read_b_uint(data)
-    read_b_uint(data)  # format_version = read_b_uint(data)
-    fx_id = read_b_uint(data)
-    version = read_b_uint(data)
-    num_programs = read_b_uint(data)
+    if chunk_magic != CHUNK_MAGIC:
+        return parse_failed('bad_chunk_magic', errors)
 
-    range_pop(data, 0, 128)
+    if fx_magic != FXB_MAGIC:
+        return parse_failed('bad_fx_magic', errors)
 
-    program_chunk_size = read_b_uint(data)
-    program_chunk_data = range_pop(data, 0, program_chunk_size)
+    if fx_id != KHS_ONE_ID:
+        return parse_failed('wrong_fx_id', errors)
 
-    if chunk_magic != convert_magic('CcnK'):
-        print('Invalid chunkMagic')
-        return None
+    if version < CURRENT_VERSION:
+        return parse_failed('old_version', errors)
 
-    if fx_magic != convert_magic('FBCh'):
-        print('Unsupported fxMagic')
-        return None
+    return num_programs, program_chunk_size
+
+
+class LazyBank:
+    """
+    A read only FXB bank that only decodes programs when asked for them
+    Opening one just scans the program slots for an offset table
+    """
+    def __init__(self, bank_data: BufferInput, errors: Union[List[str], None] = None) -> None:
+        """
+        Construct the bank object. Paths get memory mapped
+        :param bank_data:
+        :param errors: Gets the reason code (see PARSE_ERRORS) added if it's not usable
+        """
+        reader = ByteReader(bank_data)
+        header = read_fxb_header(reader, errors)
+        if header is None:
+            raise ValueError('Not a usable kHs ONE bank')
+        num_programs, program_chunk_size = header
+
+        self._scan(reader.read(program_chunk_size), num_programs, errors)
+
+    def _scan(self, program_chunk: memoryview, num_programs: int, errors: Union[List[str], None] = None) -> None:
+        """
+        Build the offset table
+        :param program_chunk:
+        :param num_programs:
+        :param errors: Gets the reason code (see PARSE_ERRORS) added if it's not usable
+        :return:
+        """
+        chunk = ByteReader(program_chunk)
+        if chunk.remaining < BANK_CHUNK_HEADER.size:
+            parse_failed('bank_truncated', errors)
+            raise ValueError('Not a usable kHs ONE bank')
+        self.version, = chunk.unpack(BANK_CHUNK_HEADER)
+        self._view = chunk.view
+        self._offsets = array('L')  # Where each program's name starts
+        self._sizes = array('L')  # Size of each program's param chunk
+
+        for i in range(0, num_programs, 1):
+            if chunk.remaining < BANK_PROGRAM_HEADER.size:
+                print(f'Bank program data is truncated after {i} programs')
+                break
+            self._offsets.append(chunk.offset)
+            _, param_chunk_size = chunk.unpack(BANK_PROGRAM_HEADER)
+            self._sizes.append(param_chunk_size)
+            chunk.skip(param_chunk_size)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __enter__(self) -> 'LazyBank':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Let go of the underlying data (and the mmap, if we made one)
+        :return:
+        """
+        self._view = None
+
+    def name(self, index: int) -> str:
+        offset = self._offsets[index]
+        return bytes(self._view[offset:offset + BANK_NAME_SIZE]).decode('utf-8', errors='replace').rstrip('\x00')
 
-    if fx_id != convert_magic('kHs1'):
-        print('Preset does not seem to be for kHs ONE')
+    def names(self) -> List[str]:
+        return [self.name(i) for i in range(len(self))]
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Preset, None, List[Union[Preset, None]]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        preset = Preset(self.name(index), self.version)
+        chunk_start = self._offsets[index] + BANK_PROGRAM_HEADER.size
+        if not preset.insert_param_chunk_into_fxp_preset(self._view[chunk_start:chunk_start + self._sizes[index]]):
+            print(f'Preset chunk data load failure for bank program: {preset.name}')
+            return None
+
+        return preset
+
+    def __iter__(self) -> Iterator[Preset]:
+        for i in range(len(self)):
+            preset = self[i]
+            if preset is not None:
+                yield preset
+
+    def to_bank(self) -> Bank:
+        return Bank(list(self))
+
+
+class BankEditor(LazyBank):
+    """
+    An FXB bank that gets edited where it is. Paths are memory mapped read write, and bytearrays are changed in place
+    A program that keeps its size is just overwritten. One that doesn't moves everything after it, and nothing before
+    """
+    def __init__(self, bank_data: Union[os.PathLike, str, bytearray], errors: Union[List[str], None] = None) -> None:
+        """
+        Open the bank for editing
+        :param bank_data: Path to the FXB, or its data as a bytearray
+        :param errors: Gets the reason code (see PARSE_ERRORS) added if it's not usable
+        """
+        self._file = None
+        if isinstance(bank_data, (os.PathLike, str)):
+            self._file = open(bank_data, 'r+b')
+            self._data = None
+        else:
+            self._data = bank_data
+        self._view = self._whole = None
+
+        try:
+            self._map()
+            reader = ByteReader(self._whole)
+            header = read_fxb_header(reader, errors)
+            if header is None:
+                raise ValueError('Not a usable kHs ONE bank')
+            num_programs, program_chunk_size = header
+            self._scan(reader.read(program_chunk_size), num_programs, errors)
+        except (ValueError, struct.error):
+            self.close()
+            raise
+
+    def _map(self) -> None:
+        """
+        (Re)make the views onto the bank after its size has changed
+        :return:
+        """
+        if self._file is not None:
+            try:
+                self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_WRITE)
+            except ValueError:  # Can't map an empty file
+                self._data = bytearray()
+        self._whole = memoryview(self._data)
+
+    def _unmap(self) -> None:
+        """
+        Let go of every view onto the bank, so it can change size (or be closed)
+        :return:
+        """
+        if self._view is not None:
+            self._view.release()
+        if self._whole is not None:
+            self._whole.release()
+        self._view = self._whole = None
+        if self._file is not None and isinstance(self._data, mmap.mmap):
+            self._data.close()
+            self._data = None
+
+    def flush(self) -> None:
+        """
+        Make sure the edits are on disk
+        :return:
+        """
+        if isinstance(self._data, mmap.mmap):
+            self._data.flush()
+
+    def close(self) -> None:
+        """
+        Flush the edits and let go of the file
+        :return:
+        """
+        self.flush()
+        self._unmap()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _slot_start(self, index: int) -> int:
+        """
+        Where a program's slot starts in the file
+        :param index:
+        :return:
+        """
+        return FXB_HEADER.size + self._offsets[index]
+
+    def rename(self, index: int, name: str) -> None:
+        """
+        Change a program's name. Always done in place
+        :param index:
+        :param name: Cut down to 24 bytes, same as when a bank gets written
+        :return:
+        """
+        NAME_FIELD.pack_into(self._whole, self._slot_start(index), name_field(name, BANK_NAME_SIZE))
+
+    def __setitem__(self, index: int, preset: 'Preset') -> None:
+        """
+        Replace a program with a preset, name and all
+        :param index:
+        :param preset:
+        :return:
+        """
+        self.replace_slot(index, return_program_slot(preset))
+
+    def replace_slot(self, index: int, slot: BufferInput) -> None:
+        """
+        Replace a program's whole slot: name, param chunk size and param chunk
+        :param index:
+        :param slot:
+        :return:
+        """
+        slot = as_view(slot)
+        start = self._slot_start(index)
+        end = start + BANK_PROGRAM_HEADER.size + self._sizes[index]
+        _, param_chunk_size = BANK_PROGRAM_HEADER.unpack_from(slot)
+        if BANK_PROGRAM_HEADER.size + param_chunk_size != len(slot):
+            raise ValueError('Program slot size does not match its param chunk size')
+
+        delta = len(slot) - (end - start)
+        if delta == 0:
+            self._whole[start:end] = slot
+            return None
+
+        # Everything after the program moves, so it has to be written again. Nothing before it does
+        tail = bytes(self._whole[end:])
+        _, size, *_, num_programs, program_chunk_size = FXB_HEADER.unpack_from(self._whole)
+        self._unmap()
+        if self._file is not None:
+            self._file.seek(start)
+            self._file.write(slot)
+            self._file.write(tail)
+            self._file.truncate()
+            self._file.flush()
+        else:
+            self._data[start:] = slot.tobytes() + tail
+        self._map()
+
+        FXB_SIZE_FIELD.pack_into(self._whole, FXB_SIZE_OFFSET, size + delta)
+        FXB_SIZE_FIELD.pack_into(self._whole, FXB_PROGRAM_CHUNK_SIZE_OFFSET, program_chunk_size + delta)
+        self._view = self._whole[FXB_HEADER.size:FXB_HEADER.size + program_chunk_size + delta]
+        self._sizes[index] = param_chunk_size
+        for i in range(index + 1, len(self._offsets)):
+            self._offsets[i] += delta
         return None
 
-    if version < CURRENT_VERSION:
-        print('Presets saved with a version of kHs ONE earlier than 1.014 are not supported')
+
+def process_fxb(bank_data: BufferInput, columnar: bool = False, errors: Union[List[str], None] = None,
+                **kwargs) -> Union[Bank, 'ColumnarBank', None]:
+    """
+    Parse an FXB Bank
+    :param bank_data:
+    :param columnar: Return a NumPy backed ColumnarBank instead (requires numpy)
+    :param errors: Gets the reason code (see PARSE_ERRORS) added if it's not usable
+    :return:
+    """
+    reader = ByteReader(bank_data)
+    header = read_fxb_header(reader, errors)
+    if header is None:
         return None
+    num_programs, program_chunk_size = header
+
+    if columnar:
+        from .columnar import ColumnarBank
+        return ColumnarBank.from_program_chunk(reader.read(program_chunk_size), prog_count=num_programs, errors=errors)
 
-    bank_presets = return_bank_presets(program_chunk_data, prog_count=num_programs)
+    bank_presets = return_bank_presets(reader.read(program_chunk_size), prog_count=num_programs, errors=errors)
+    if bank_presets is None:
+        return None
     return Bank(bank_presets)
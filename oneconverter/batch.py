@@ -0,0 +1,286 @@
+"""
+Converting lots of presets (and banks) at once
+"""
+from .bank import pack_banks
+from .binary import BufferInput
+from .convert import ConversionError, convert_file, format_for_file_name
+from .library import pack_library
+from .preset import Preset, process_fxp
+from concurrent.futures import Executor, FIRST_COMPLETED, Future, wait
+from functools import partial
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Set, Tuple, Union
+import io
+import json
+import posixpath
+import zipfile
+
+MANIFEST_NAME = 'manifest.json'
+LIBRARY_NAME = 'library.onelib'
+
+# Every entry gets the same timestamp, so converting the same thing always makes the same zip
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# File name, size and something to call to get the data
+BatchEntry = Tuple[str, int, Callable[[], bytes]]
+
+
+class _ChunkSink:
+    """
+    Unseekable file for ZipFile to write into, so the archive can be handed out as it's built
+    """
+    def __init__(self) -> None:
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _zip_entry(name: str) -> zipfile.ZipInfo:
+    """
+    A zip entry that doesn't depend on when it was written
+    :param name:
+    :return:
+    """
+    info = zipfile.ZipInfo(name, ZIP_DATE_TIME)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o600 << 16  # What writestr gives entries named with a str
+    return info
+
+
+def _unique_name(name: str, used: Set[str]) -> str:
+    """
+    Presets in different files can have the same name. Number the duplicates
+    :param name:
+    :param used:
+    :return:
+    """
+    candidate = name
+    stem, dot, ext = name.rpartition('.')
+    n = 2
+    while candidate in used:
+        candidate = f'{stem} ({n}){dot}{ext}'
+        n += 1
+    used.add(candidate)
+    return candidate
+
+
+def _output_dir(file_name: str) -> str:
+    """
+    Where a file's outputs go in the zip: the directory it came from, minus anything that would put them outside it
+    Member names come from whoever made the zip, and can be anything, like ../../x.fxp or /x.fxp
+    :param file_name:
+    :return:
+    """
+    parts = posixpath.normpath(file_name).split('/')[:-1]
+    return '/'.join(part for part in parts if part not in ('', '.', '..'))
+
+
+def convert_files(entries: Iterable[BatchEntry], to_fmt: str, executor: Union[Executor, None] = None,
+                  max_in_flight: int = 8, max_file_size: int = 1024 * 1024, max_files: int = 5000,
+                  dedupe: Union[float, None] = None) -> Iterator[bytes]:
+    """
+    Convert a bunch of presets and banks, yielding a zip of the results a piece at a time
+    Each input's format comes from its extension and banks get exploded into their programs.
+    Converting to fxb packs everything into as many 100 program banks as it takes instead, and converting to lib
+    packs everything into one library.
+    The output ends with a manifest of what happened to every file
+    :param entries:
+    :param to_fmt:
+    :param executor: Where to run the conversions. None to do them here
+    :param max_in_flight: Most conversions to have submitted at once
+    :param max_file_size: Largest (uncompressed) file to bother with
+    :param max_files: Most files to look at
+    :param dedupe: When packing (to fxb or lib), leave out presets at most this far from one already packed (0 for exact
+        duplicates, needs numpy). None packs everything
+    :return:
+    """
+    packing = to_fmt in ('fxb', 'lib')
+    manifest: List[Dict[str, Union[str, List[str]]]] = []
+    packed: List[Tuple[int, str, List[Tuple[bytes, str]]]] = []  # Input order, file name, FXP data
+    used_names: Set[str] = set()
+    sink = _ChunkSink()
+
+    queue = []
+    for file_name, file_size, read in entries:
+        base_name = posixpath.basename(file_name)
+        if file_name.startswith('__MACOSX/') or base_name.startswith('.') or not base_name:
+            continue
+        from_fmt = format_for_file_name(base_name)
+        if len(queue) >= max_files:
+            manifest.append({'file': file_name, 'status': 'error', 'error': 'Too many files'})
+        elif from_fmt is None:
+            manifest.append({'file': file_name, 'status': 'error', 'error': 'Unrecognised file type'})
+        elif file_size > max_file_size:
+            manifest.append({'file': file_name, 'status': 'error', 'error': 'File is too large'})
+        else:
+            queue.append((len(queue), file_name, from_fmt, read))
+
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as out_zip:
+        def record(order: int, file_name: str, result: Union[List[Tuple[bytes, str]], Exception]) -> None:
+            if isinstance(result, Exception):
+                message = str(result) if isinstance(result, ConversionError) else f'Conversion failed: {result}'
+                manifest.append({'file': file_name, 'status': 'error', 'error': message})
+                return
+
+            if packing:
+                packed.append((order, file_name, result))
+                return
+
+            outputs = []
+            for converted_data, converted_name in result:
+                converted_name = converted_name.replace('/', '_').replace('\\', '_')
+                out_name = _unique_name(posixpath.join(_output_dir(file_name), converted_name), used_names)
+                out_zip.writestr(_zip_entry(out_name), converted_data)
+                outputs.append(out_name)
+            manifest.append({'file': file_name, 'status': 'ok', 'outputs': outputs})
+
+        pending: Dict[Future, Tuple[int, str]] = {}
+        items = iter(queue)
+        try:
+            while True:
+                while len(pending) < max(max_in_flight, 1):
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    order, file_name, from_fmt, read = item
+                    args = (read(), from_fmt, 'fxp' if packing else to_fmt, posixpath.basename(file_name))
+                    if executor is None:
+                        try:
+                            record(order, file_name, convert_file(*args))
+                        except Exception as e:
+                            record(order, file_name, e)
+                        yield sink.take()
+                    else:
+                        pending[executor.submit(convert_file, *args)] = (order, file_name)
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    order, file_name = pending.pop(future)
+                    try:
+                        record(order, file_name, future.result())
+                    except Exception as e:
+                        record(order, file_name, e)
+                yield sink.take()
+        finally:
+            for future in pending:
+                future.cancel()  # Nobody's going to read the rest if we got closed early
+
+        if packing:
+            yield from _write_packed(sorted(packed), to_fmt, out_zip, manifest, sink, dedupe)
+
+        out_zip.writestr(_zip_entry(MANIFEST_NAME), json.dumps(manifest, indent=2))
+
+    yield sink.take()
+
+
+def _write_packed(packed: List[Tuple[int, str, List[Tuple[bytes, str]]]], to_fmt: str, out_zip: zipfile.ZipFile,
+                  manifest: List[Dict], sink: _ChunkSink, dedupe: Union[float, None] = None) -> Iterator[bytes]:
+    """
+    Pack converted presets (as FXP data, in input order) into banks, or one library
+    :param packed:
+    :param to_fmt: fxb or lib
+    :param out_zip:
+    :param manifest:
+    :param sink:
+    :param dedupe: Tolerance for leaving out duplicate presets, or None to pack everything
+    :return:
+    """
+    def read(fxp_data: bytes, converted_name: str) -> Preset:
+        preset = process_fxp(fxp_data)
+        if to_fmt == 'lib':
+            preset.name = converted_name.rpartition('.')[0]  # Libraries don't cut names down to 24 bytes
+        return preset
+
+    if dedupe is None:
+        presets = (read(*result) for _, _, results in packed for result in results)
+        counts = [len(results) for _, _, results in packed]
+        duplicates = [0] * len(packed)
+    else:
+        from .similarity import unique_presets
+
+        owners = [(n, read(*result)) for n, (_, _, results) in enumerate(packed) for result in results]
+        kept = {id(preset) for preset in unique_presets((preset for _, preset in owners), tolerance=dedupe)}
+        presets = [preset for _, preset in owners if id(preset) in kept]
+        counts = [0] * len(packed)
+        for n, preset in owners:
+            counts[n] += id(preset) in kept
+        duplicates = [len(results) - count for (_, _, results), count in zip(packed, counts)]
+
+    bank_names = []
+    file_banks = []
+    position = 0
+    for (_, file_name, _), count, duplicate_count in zip(packed, counts, duplicates):
+        file_bank_numbers = sorted({(position + i) // 100 for i in range(count)})
+        file_banks.append((file_name, file_bank_numbers, duplicate_count))
+        position += count
+
+    if to_fmt == 'lib':
+        presets = list(presets)
+        if presets:
+            out_zip.writestr(_zip_entry(LIBRARY_NAME), pack_library(presets))
+            bank_names.append(LIBRARY_NAME)
+            file_banks = [(file_name, [0] if bank_numbers else [], duplicate_count)
+                          for file_name, bank_numbers, duplicate_count in file_banks]
+        yield sink.take()
+    else:
+        for bank_number, bank in enumerate(pack_banks(presets), 1):
+            bank_name = f'bank_{bank_number:03}.fxb'
+            with out_zip.open(_zip_entry(bank_name), 'w') as bank_file:
+                bank.write_to(bank_file)
+            bank_names.append(bank_name)
+            yield sink.take()
+
+    for file_name, bank_numbers, duplicate_count in file_banks:
+        entry = {'file': file_name, 'status': 'ok', 'outputs': [bank_names[n] for n in bank_numbers]}
+        if dedupe is not None:
+            entry['duplicates'] = duplicate_count
+        manifest.append(entry)
+
+
+def explode_bank(bank_data: BufferInput, to_fmt: str, file_name: str = 'bank.fxb', from_fmt: str = 'fxb') -> bytes:
+    """
+    Convert every program in a bank (or library), returning a zip of them (with a manifest)
+    Raises ConversionError if the bank can't be read at all
+    :param bank_data:
+    :param to_fmt:
+    :param file_name:
+    :param from_fmt: fxb or lib
+    :return:
+    """
+    converted = convert_file(bank_data, from_fmt, to_fmt, file_name=file_name)
+    used_names: Set[str] = set()
+    outputs = []
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as out_zip:
+        for converted_data, converted_name in converted:
+            out_name = _unique_name(converted_name.replace('/', '_').replace('\\', '_'), used_names)
+            out_zip.writestr(_zip_entry(out_name), converted_data)
+            outputs.append(out_name)
+        manifest = [{'file': file_name, 'status': 'ok', 'outputs': outputs}]
+        out_zip.writestr(_zip_entry(MANIFEST_NAME), json.dumps(manifest, indent=2))
+    return archive.getvalue()
+
+
+def convert_archive(archive: BinaryIO, to_fmt: str, **kwargs) -> Iterator[bytes]:
+    """
+    Convert everything in a zip file. See convert_files
+    :param archive: A seekable file containing the zip
+    :param to_fmt:
+    :return:
+    """
+    with zipfile.ZipFile(archive) as in_zip:
+        entries = ((info.filename, info.file_size, partial(in_zip.read, info))
+                   for info in in_zip.infolist() if not info.is_dir())
+        yield from convert_files(entries, to_fmt, **kwargs)
@@ -0,0 +1,196 @@
+"""
+Binary (FXP/FXB) reading and writing helpers
+
+Reads go through a cursor over a memoryview, so nothing gets copied or shifted around while parsing.
+Writes go into a buffer that's allocated once at its final size
+"""
+from .utils import convert_magic, CURRENT_VERSION, PARAM_COUNT
+from typing import BinaryIO, Tuple, Union
+import io
+import mmap
+import os
+import struct
+import sys
+
+# Paths are anything os.PathLike (pathlib isn't imported here, it's slow to import)
+BufferInput = Union[os.PathLike, bytes, bytearray, memoryview, mmap.mmap, BinaryIO]
+
+CHUNK_MAGIC = convert_magic('CcnK')
+FXP_MAGIC = convert_magic('FPCh')
+FXB_MAGIC = convert_magic('FBCh')
+KHS_ONE_ID = convert_magic('kHs1')
+
+# chunkMagic, size, fxMagic, format_version, fx_id, version, num_params, name, chunk_size
+FXP_HEADER = struct.Struct('>7I28sI')
+# chunkMagic, size, fxMagic, format_version, fx_id, version, num_programs, (128 reserved), chunk_size
+FXB_HEADER = struct.Struct('>7I128xI')
+# version, param_count
+PARAM_CHUNK_HEADER = struct.Struct('<2I')
+PARAM_VALUES = struct.Struct(f'<{PARAM_COUNT}f')
+# version
+BANK_CHUNK_HEADER = struct.Struct('<I')
+# name, param_chunk_size
+BANK_PROGRAM_HEADER = struct.Struct('<24sI')
+
+PARAM_CHUNK_SIZE = PARAM_CHUNK_HEADER.size + PARAM_VALUES.size
+PROGRAM_SLOT_SIZE = BANK_PROGRAM_HEADER.size + PARAM_CHUNK_SIZE
+CHUNK_PREAMBLE_SIZE = 8  # chunkMagic and size aren't counted in size
+FXP_NAME_SIZE = 28
+BANK_NAME_SIZE = 24
+
+
+def name_field(name: str, size: int) -> bytes:
+    """
+    Encode a preset name for a fixed size name field. Names are cut down to 24 characters, then to whatever fits in
+    the field without splitting a character, so they can always be read back
+    :param name:
+    :param size: Size of the field in bytes
+    :return:
+    """
+    return name[0:24].encode('utf-8')[:size].decode('utf-8', 'ignore').encode('utf-8')
+
+
+def fxp_header(version: int, name: bytes, chunk_size: int = PARAM_CHUNK_SIZE) -> Tuple:
+    """
+    Values for FXP_HEADER
+    :param version:
+    :param name:
+    :param chunk_size:
+    :return:
+    """
+    size = FXP_HEADER.size - CHUNK_PREAMBLE_SIZE + chunk_size
+    return CHUNK_MAGIC, size, FXP_MAGIC, 1, KHS_ONE_ID, version, PARAM_COUNT, name, chunk_size
+
+
+def fxb_header(program_chunk_size: int, num_programs: int = 100, version: int = CURRENT_VERSION) -> Tuple:
+    """
+    Values for FXB_HEADER
+    :param program_chunk_size:
+    :param num_programs:
+    :param version:
+    :return:
+    """
+    size = FXB_HEADER.size - CHUNK_PREAMBLE_SIZE + program_chunk_size
+    return CHUNK_MAGIC, size, FXB_MAGIC, 1, KHS_ONE_ID, version, num_programs, program_chunk_size
+
+
+def map_file(file_path: Union[os.PathLike, str]) -> memoryview:
+    """
+    Memory map a file read only
+    The map gets closed once the last view into it goes away
+    :param file_path:
+    :return:
+    """
+    with open(file_path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Can't map an empty file
+            return memoryview(b'')
+    return memoryview(mapped)
+
+
+def file_view(fileobj: BinaryIO) -> memoryview:
+    """
+    Get a byte view of a whole file object's data, copying it only if there's no other way
+    In memory files are shared, real files get memory mapped, and anything else (pipes, sockets) gets read
+    :param fileobj:
+    :return:
+    """
+    # Only look inside a spooled file if tempfile's been imported (it's slow to import), as there can't be one if not.
+    # Its fileno() would roll it over to disk
+    tempfile = sys.modules.get('tempfile')
+    if tempfile is not None and isinstance(fileobj, tempfile.SpooledTemporaryFile):
+        fileobj = fileobj._file
+
+    if isinstance(fileobj, io.BytesIO):
+        return fileobj.getbuffer()
+
+    try:
+        fileobj.flush()
+        return memoryview(mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ))
+    except (AttributeError, OSError, ValueError):  # Not a real file, or an empty one. io.UnsupportedOperation is both
+        pass
+    if fileobj.seekable():
+        fileobj.seek(0)
+    return memoryview(fileobj.read())
+
+
+def as_view(data: BufferInput) -> memoryview:
+    """
+    Get a byte view of whatever we were handed without copying it
+    :param data:
+    :return:
+    """
+    if isinstance(data, os.PathLike):
+        return map_file(data)
+    if hasattr(data, 'read'):
+        return file_view(data)
+    view = memoryview(data)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+
+class ByteReader:
+    """
+    A read cursor over some preset/bank data
+    """
+    __slots__ = ('view', 'offset')
+
+    def __init__(self, data: BufferInput) -> None:
+        self.view = as_view(data)
+        self.offset = 0
+
+    @property
+    def remaining(self) -> int:
+        return len(self.view) - self.offset
+
+    def unpack(self, st: struct.Struct) -> Tuple:
+        """
+        Unpack a precompiled struct at the cursor and move past it
+        Raises struct.error if there isn't enough data left
+        :param st:
+        :return:
+        """
+        values = st.unpack_from(self.view, self.offset)
+        self.offset += st.size
+        return values
+
+    def read(self, size: int) -> memoryview:
+        """
+        Return a view of the next size bytes (or whatever is left, if that's less)
+        :param size:
+        :return:
+        """
+        chunk = self.view[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+
+    def skip(self, size: int) -> None:
+        self.offset = min(self.offset + size, len(self.view))
+
+
+class ByteWriter:
+    """
+    A write cursor over a buffer that's allocated up front
+    """
+    __slots__ = ('buffer', 'offset')
+
+    def __init__(self, size: int) -> None:
+        self.buffer = bytearray(size)
+        self.offset = 0
+
+    def pack(self, st: struct.Struct, *values) -> None:
+        """
+        Pack a precompiled struct at the cursor and move past it
+        :param st:
+        :param values:
+        :return:
+        """
+        st.pack_into(self.buffer, self.offset, *values)
+        self.offset += st.size
+
+    def write(self, data: Union[bytes, bytearray, memoryview]) -> None:
+        end = self.offset + len(data)
+        self.buffer[self.offset:end] = data
+        self.offset = end
@@ -0,0 +1,258 @@
+"""
+Content addressed conversion cache
+
+Converted output only depends on the input bytes and the format pair, so it can be keyed on those.
+Keys are the same for every worker and every restart, so they double as URLs and ETags
+"""
+from .binary import BufferInput, as_view
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Tuple, Union
+import hashlib
+import os
+import re
+import struct
+import tempfile
+import threading
+
+_NAME_LENGTH = struct.Struct('>I')
+
+# Bump whenever a conversion's output changes for the same input, so nothing keeps serving (or caching) the old one
+CACHE_VERSION = 1
+KEY_PATTERN = re.compile(r'[0-9a-f]{64}\.[a-z]+')
+
+
+def cache_key(data: BufferInput, from_fmt: str, to_fmt: str, file_name: str = '') -> str:
+    """
+    Key for a conversion: SHA-256 of the input and where it's from, then the format it's going to
+    :param data:
+    :param from_fmt:
+    :param to_fmt:
+    :param file_name: Only needed when the output depends on it (Reason presets get named after the file)
+    :return:
+    """
+    digest = hashlib.sha256(as_view(data))
+    digest.update(f'\x00{from_fmt}\x00{CACHE_VERSION}'.encode('utf-8'))
+    if file_name:
+        digest.update(b'\x00' + file_name.encode('utf-8'))
+    return f'{digest.hexdigest()}.{to_fmt}'
+
+
+class ConversionCache:
+    """
+    In memory LRU of converted data and file names, with an optional on disk tier
+    The disk tier is what gets shared between worker processes. It's kept to its own budget by removing the entries
+    that were least recently used (reading an entry touches it), checked every time a worker has written another tenth
+    of the budget. So with several workers it can go over by about a tenth of the budget per worker
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, cache_dir: Union[Path, str, None] = None,
+                 max_disk_bytes: Union[int, None] = 1024 * 1024 * 1024) -> None:
+        """
+        Construct the cache
+        :param max_bytes: Budget for the in memory tier
+        :param cache_dir: Where to keep the on disk tier. None to not have one
+        :param max_disk_bytes: Budget for the on disk tier. None for no limit
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.current_bytes = 0
+        self.disk_write_failures = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self._written_since_prune = 0
+
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.prune()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'disk_write_failures': self.disk_write_failures,
+        }
+
+    def get(self, key: str) -> Union[Tuple[bytes, str], None]:
+        """
+        Get the converted data and file name for a key
+        :param key:
+        :return:
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, data: bytes, file_name: str) -> bool:
+        """
+        Cache the converted data and file name for a key
+        :param key:
+        :param data:
+        :param file_name:
+        :return: Whether it's on disk (so every worker can get it). Always False without a disk tier
+        """
+        entry = (bytes(data), file_name)
+        with self._lock:
+            self._remember(key, entry)
+        return self._write_disk(key, entry)
+
+    def on_disk(self, key: str) -> bool:
+        """
+        Whether a key's entry is in the disk tier, so every worker can get it
+        :param key:
+        :return:
+        """
+        if self.cache_dir is None:
+            return False
+        try:
+            os.utime(self._disk_path(key))  # Going to be read, so recently used
+        except OSError:
+            return False
+        return True
+
+    def prune(self) -> int:
+        """
+        Get the disk tier back under budget, removing the least recently used entries
+        Frees a bit more than it has to, so it isn't needed again straight away
+        :return: Bytes freed
+        """
+        if self.cache_dir is None or self.max_disk_bytes is None:
+            return 0
+        if not self._prune_lock.acquire(blocking=False):
+            return 0  # Another thread's already at it
+        try:
+            self._written_since_prune = 0
+            entries = []
+            total = 0
+            for shard in os.scandir(self.cache_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.startswith('.tmp-'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_disk_bytes:
+                return 0
+
+            freed = 0
+            target = total - self.max_disk_bytes * 9 // 10
+            for _, size, path in sorted(entries):
+                if freed >= target:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                freed += size
+            return freed
+        finally:
+            self._prune_lock.release()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _remember(self, key: str, entry: Tuple[bytes, str]) -> None:
+        """
+        Add to the in memory tier, evicting the least recently used entries to stay in budget. Lock must be held
+        :param key:
+        :param entry:
+        :return:
+        """
+        size = len(entry[0]) + len(entry[1])
+        if size > self.max_bytes:
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.current_bytes -= len(old[0]) + len(old[1])
+
+        while self._entries and self.current_bytes + size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted[0]) + len(evicted[1])
+
+        self._entries[key] = entry
+        self.current_bytes += size
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir.joinpath(key[:2], key)
+
+    def _read_disk(self, key: str) -> Union[Tuple[bytes, str], None]:
+        """
+        Entries on disk are the file name's length, the file name, then the data
+        :param key:
+        :return:
+        """
+        if self.cache_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            raw = path.read_bytes()
+            os.utime(path)  # Recently used, as far as pruning goes
+        except OSError:
+            return None
+        if len(raw) < _NAME_LENGTH.size:
+            return None
+        name_end = _NAME_LENGTH.size + _NAME_LENGTH.unpack_from(raw)[0]
+        return raw[name_end:], raw[_NAME_LENGTH.size:name_end].decode('utf-8')
+
+    def _write_disk(self, key: str, entry: Tuple[bytes, str]) -> bool:
+        """
+        Write an entry to the disk tier
+        :param key:
+        :param entry:
+        :return: Whether it got written
+        """
+        if self.cache_dir is None:
+            return False
+        path = self._disk_path(key)
+        tmp_name = None
+        try:
+            path.parent.mkdir(exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                file_name = entry[1].encode('utf-8')
+                f.write(_NAME_LENGTH.pack(len(file_name)) + file_name)
+                f.write(entry[0])
+            os.replace(tmp_name, path)  # So other workers never see a partial entry
+        except OSError as e:
+            print(f'Could not write {key} to the conversion cache: {e}')
+            with self._lock:
+                self.disk_write_failures += 1
+            if tmp_name is not None:
+                try:
+                    os.unlink(tmp_name)
+                except OSError:
+                    pass
+            return False
+
+        with self._lock:
+            self._written_since_prune += _NAME_LENGTH.size + len(file_name) + len(entry[0])
+            due = self.max_disk_bytes is not None and self._written_since_prune > self.max_disk_bytes // 10
+        if due:
+            self.prune()
+        return True
@@ -0,0 +1,503 @@
+"""
+Command line converter
+
+    python -m oneconverter convert SRC DST --to repatch -j 8
+    python -m oneconverter pack SRC library.onelib -j 8
+    python -m oneconverter inventory SRC
+
+convert walks SRC, converting every preset and bank it finds into the same layout under DST. A manifest of
+content hashes is kept in DST so that re-runs only convert what's new or changed. Sources that would make the same
+output (a.fxp and a.aupreset) keep their extensions in their outputs' names (a.fxp.repatch, a.aupreset.repatch).
+pack walks SRC and packs every preset it finds into one library file.
+inventory sorts every file under SRC by what its header says it is, without reading the rest of it
+"""
+from .convert import COLLECTION_FORMATS, ConversionError, FORMATS, EXTENSION_FORMATS, convert_file, \
+    format_for_file_name, parse_file, warmup
+from .library import pack_library
+from .preset import PARSE_ERRORS, Preset
+from .sniff import sniff_file
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Set, Tuple, Union
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+MANIFEST_NAME = '.oneconverter-manifest.json'
+MANIFEST_VERSION = 1
+
+# Relative source path, size, mtime (ns), hash from the last run, where its outputs go (see output_base)
+ConvertTask = Tuple[str, int, int, Union[str, None], str]
+# Relative source path, hash, outputs (None if unchanged), error
+ConvertResult = Tuple[str, Union[str, None], Union[List[str], None], Union[str, None]]
+
+
+def atomic_write(path: Path, data: bytes) -> None:
+    """
+    Write a file so nothing ever sees it half written
+    :param path:
+    :param data:
+    :return:
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+def load_manifest(dst: Path, to_fmt: str) -> Dict[str, Dict]:
+    """
+    What was converted last time. Nothing counts if it was converted to a different format
+    :param dst:
+    :param to_fmt:
+    :return:
+    """
+    try:
+        manifest = json.loads(dst.joinpath(MANIFEST_NAME).read_text('utf-8'))
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('to') != to_fmt:
+        return {}
+    return manifest.get('files', {})
+
+
+def save_manifest(dst: Path, files: Dict[str, Dict], to_fmt: str) -> None:
+    manifest = {'version': MANIFEST_VERSION, 'to': to_fmt, 'files': files}
+    atomic_write(dst.joinpath(MANIFEST_NAME), json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+
+
+def find_sources(src: Path) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Find every file under src that looks like something we can convert
+    :param src:
+    :return: Paths relative to src (with forward slashes) and their stats
+    """
+    for dir_path, dir_names, file_names in os.walk(src):
+        dir_names[:] = sorted(d for d in dir_names if not d.startswith('.') and d != '__MACOSX')
+        for file_name in sorted(file_names):
+            if file_name.startswith('.') or format_for_file_name(file_name) is None:
+                continue
+            path = os.path.join(dir_path, file_name)
+            yield Path(os.path.relpath(path, src)).as_posix(), os.stat(path)
+
+
+def output_base(rel_path: str, to_fmt: str, keep_extension: bool = False) -> str:
+    """
+    Where a source file's outputs go: the output file for a preset, the directory of its programs for a bank or
+    library
+    :param rel_path:
+    :param to_fmt:
+    :param keep_extension: Keep the source's extension in the name (a.fxp.repatch), for when two sources would
+        otherwise end up in the same place
+    :return:
+    """
+    rel = Path(rel_path)
+    stem = (rel if keep_extension else rel.with_suffix('')).as_posix()
+    if format_for_file_name(rel.name) in COLLECTION_FORMATS:
+        return stem
+    return f'{stem}.{FORMATS[to_fmt][2]}'
+
+
+def _colliding(bases: Dict[str, str]) -> List[str]:
+    """
+    Sources whose outputs would land on another's: the same output, or a bank or library whose directory of programs
+    other outputs are already in (it's the bank that moves, not them)
+    :param bases: Output base by source
+    :return:
+    """
+    counts: Dict[str, int] = {}
+    for base in bases.values():
+        counts[base] = counts.get(base, 0) + 1
+    ancestors = {parent.as_posix() for base in counts for parent in Path(base).parents}
+    return [rel_path for rel_path, base in bases.items() if counts[base] > 1 or base in ancestors]
+
+
+def plan_outputs(rel_paths: Iterable[str], to_fmt: str) -> Dict[str, Union[str, None]]:
+    """
+    Where every source's outputs go. Sources that would overwrite each other's (a.fxp and a.aupreset both making
+    a.repatch, or a bank exploding into a directory that other outputs are already in) keep their extensions in
+    their names instead. Depends only on what the sources are, so it comes out the same every run
+    :param rel_paths: Every source, including ones that haven't changed
+    :param to_fmt:
+    :return: Output base by source, or None for ones that collide even so
+    """
+    bases = {rel_path: output_base(rel_path, to_fmt) for rel_path in rel_paths}
+    for rel_path in _colliding(bases):
+        bases[rel_path] = output_base(rel_path, to_fmt, keep_extension=True)
+    planned: Dict[str, Union[str, None]] = dict(bases)
+    for rel_path in _colliding(bases):
+        if bases[rel_path] != output_base(rel_path, to_fmt):
+            planned[rel_path] = None  # Ones still on their usual names keep them
+    return planned
+
+
+def output_paths(rel_path: str, base: str, converted: Sequence[Tuple[bytes, str]]) -> List[str]:
+    """
+    Where a source file's outputs go. Presets go to their base, banks and libraries get a directory of their programs
+    :param rel_path:
+    :param base: See output_base
+    :param converted: The converted data and preset file names
+    :return:
+    """
+    if format_for_file_name(os.path.basename(rel_path)) not in COLLECTION_FORMATS:
+        return [base]
+
+    used = set()
+    paths = []
+    for _, converted_name in converted:
+        converted_name = converted_name.replace('/', '_').replace('\\', '_')
+        candidate = converted_name
+        stem, dot, ext = converted_name.rpartition('.')
+        n = 2
+        while candidate in used:
+            candidate = f'{stem} ({n}){dot}{ext}'
+            n += 1
+        used.add(candidate)
+        paths.append(f'{base}/{candidate}')
+    return paths
+
+
+def convert_one(src: str, dst: str, to_fmt: str, task: ConvertTask) -> ConvertResult:
+    """
+    Convert one file, unless its contents haven't changed since the last run. Runs in a worker process
+    :param src:
+    :param dst:
+    :param to_fmt:
+    :param task:
+    :return:
+    """
+    rel_path, _, _, old_hash, base = task
+    try:
+        file_data = Path(src, rel_path).read_bytes()
+    except OSError as e:
+        return rel_path, None, [], f'Could not read the file: {e}'
+
+    file_hash = hashlib.sha256(file_data).hexdigest()
+    if file_hash == old_hash:
+        return rel_path, file_hash, None, None  # Touched but not changed
+
+    file_name = os.path.basename(rel_path)
+    try:
+        converted = convert_file(file_data, format_for_file_name(file_name), to_fmt, file_name=file_name)
+    except ConversionError as e:
+        return rel_path, file_hash, [], str(e)
+    except Exception as e:
+        return rel_path, file_hash, [], f'Conversion failed: {e}'
+
+    outputs = output_paths(rel_path, base, converted)
+    for (converted_data, _), out_path in zip(converted, outputs):
+        atomic_write(Path(dst, out_path), converted_data)
+    return rel_path, file_hash, outputs, None
+
+
+def remove_outputs(dst: Path, outputs: Iterable[str], live_outputs: Set[str]) -> None:
+    """
+    Delete old outputs, apart from any that something still makes
+    :param dst:
+    :param outputs:
+    :param live_outputs:
+    :return:
+    """
+    for out_path in outputs:
+        if out_path not in live_outputs:
+            try:
+                dst.joinpath(out_path).unlink()
+            except OSError:
+                pass
+
+
+def convert_tree(src: Union[Path, str], dst: Union[Path, str], to_fmt: str, jobs: int = 1,
+                 force: bool = False, prune: bool = False, verbose: bool = False) -> Dict[str, int]:
+    """
+    Convert everything under src into dst
+    :param src:
+    :param dst:
+    :param to_fmt:
+    :param jobs: Number of worker processes
+    :param force: Convert everything, even if it hasn't changed
+    :param prune: Remove outputs of source files that have gone away
+    :param verbose: Print every file converted
+    :return: Counts of what happened
+    """
+    src, dst = Path(src), Path(dst)
+    started = time.perf_counter()
+    old_files = load_manifest(dst, to_fmt)  # Even when forced, so outputs that aren't made any more can be removed
+    files: Dict[str, Dict] = {}
+    counts = {'converted': 0, 'unchanged': 0, 'failed': 0, 'removed': 0, 'bytes': 0}
+
+    sources = list(find_sources(src))
+    bases = plan_outputs((rel_path for rel_path, _ in sources), to_fmt)
+    tasks: List[ConvertTask] = []
+    for rel_path, stat in sources:
+        old = old_files.get(rel_path)
+        base = bases[rel_path]
+        if base is None:
+            print(f'{rel_path}: Its output would overwrite another file\'s', file=sys.stderr)
+            counts['failed'] += 1
+            continue
+        # Outputs somewhere else now (another source turned up with the same name) means converting again
+        moved = old is not None and old.get('base', output_base(rel_path, to_fmt)) != base
+        if old is not None and not force and not moved \
+                and old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+            files[rel_path] = old  # Same size and time. Not even worth hashing
+            counts['unchanged'] += 1
+            continue
+        old_hash = old['hash'] if old is not None and not force and not moved else None
+        tasks.append((rel_path, stat.st_size, stat.st_mtime_ns, old_hash, base))
+
+    if tasks:
+        dst.mkdir(parents=True, exist_ok=True)
+        task_info = {task[0]: task for task in tasks}
+        if jobs > 1 and len(tasks) > 1:
+            # Set up before forking so the workers don't each have to
+            warmup(xml=any(format_for_file_name(task[0]) in ('aup', 'res') for task in tasks))
+            executor = ProcessPoolExecutor(max_workers=jobs)
+            results = executor.map(partial(convert_one, str(src), str(dst), to_fmt), tasks,
+                                   chunksize=max(1, min(64, len(tasks) // (jobs * 4))))
+        else:
+            executor = None
+            results = (convert_one(str(src), str(dst), to_fmt, t) for t in tasks)
+
+        last_save = time.perf_counter()
+        try:
+            for rel_path, file_hash, outputs, error in results:
+                _, size, mtime_ns, _, base = task_info[rel_path]
+                if error is not None:
+                    print(f'{rel_path}: {error}', file=sys.stderr)
+                    counts['failed'] += 1
+                    if rel_path in old_files:
+                        files[rel_path] = old_files[rel_path]  # Outputs from the last good version stay
+                    continue
+
+                if outputs is None:
+                    files[rel_path] = dict(old_files[rel_path], size=size, mtime_ns=mtime_ns)
+                    counts['unchanged'] += 1
+                    continue
+
+                files[rel_path] = {'hash': file_hash, 'size': size, 'mtime_ns': mtime_ns, 'outputs': outputs,
+                                   'base': base}
+                counts['converted'] += 1
+                counts['bytes'] += size
+                if verbose:
+                    print(f'{rel_path} -> {", ".join(outputs)}')
+
+                if time.perf_counter() - last_save > 30:
+                    # Keep what's been done so far if this gets interrupted
+                    save_manifest(dst, {**old_files, **files}, to_fmt)
+                    last_save = time.perf_counter()
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    live_outputs = {out_path for f in files.values() for out_path in f['outputs']}
+    # Re-converted files can make fewer outputs (or have them somewhere else) than last time
+    for rel_path, f in files.items():
+        old = old_files.get(rel_path)
+        if old is not None and old is not f:
+            remove_outputs(dst, old['outputs'], live_outputs)
+
+    gone = [rel_path for rel_path in old_files if rel_path not in files]
+    if prune:
+        for rel_path in gone:
+            remove_outputs(dst, old_files[rel_path]['outputs'], live_outputs)
+            counts['removed'] += 1
+    else:
+        # Keep track of files that went missing, so their outputs can still be pruned later
+        files.update((rel_path, old_files[rel_path]) for rel_path in gone)
+
+    if tasks or gone:
+        dst.mkdir(parents=True, exist_ok=True)
+        save_manifest(dst, files, to_fmt)
+
+    counts['seconds'] = time.perf_counter() - started
+    return counts
+
+
+def read_one(src: str, rel_path: str) -> Tuple[str, List[Preset], Union[str, None]]:
+    """
+    Read every preset in one file. Runs in a worker process
+    :param src:
+    :param rel_path:
+    :return: The relative path, its presets and an error
+    """
+    file_name = os.path.basename(rel_path)
+    try:
+        file_data = Path(src, rel_path).read_bytes()
+        return rel_path, parse_file(file_data, format_for_file_name(file_name), file_name=file_name), None
+    except OSError as e:
+        return rel_path, [], f'Could not read the file: {e}'
+    except ConversionError as e:
+        return rel_path, [], str(e)
+    except Exception as e:
+        return rel_path, [], f'Conversion failed: {e}'
+
+
+def pack_tree(src: Union[Path, str], out: Union[Path, str], jobs: int = 1, verbose: bool = False) -> Dict[str, int]:
+    """
+    Pack every preset under src into one library, in path order
+    :param src:
+    :param out: The library file to write
+    :param jobs: Number of worker processes
+    :param verbose: Print every file read
+    :return: Counts of what happened
+    """
+    src, out = Path(src), Path(out)
+    started = time.perf_counter()
+    counts = {'files': 0, 'presets': 0, 'failed': 0, 'bytes': 0}
+    rel_paths = [rel_path for rel_path, _ in find_sources(src)]
+
+    if jobs > 1 and len(rel_paths) > 1:
+        warmup(xml=any(format_for_file_name(rel_path) in ('aup', 'res') for rel_path in rel_paths))
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = executor.map(partial(read_one, str(src)), rel_paths,
+                               chunksize=max(1, min(64, len(rel_paths) // (jobs * 4))))
+    else:
+        executor = None
+        results = (read_one(str(src), rel_path) for rel_path in rel_paths)
+
+    presets: List[Preset] = []
+    try:
+        for rel_path, file_presets, error in results:
+            if error is not None:
+                print(f'{rel_path}: {error}', file=sys.stderr)
+                counts['failed'] += 1
+                continue
+            presets.extend(file_presets)
+            counts['files'] += 1
+            if verbose:
+                print(f'{rel_path}: {len(file_presets)} presets')
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    library_data = pack_library(presets)
+    atomic_write(out, library_data)
+    counts['presets'] = len(presets)
+    counts['bytes'] = len(library_data)
+    counts['seconds'] = time.perf_counter() - started
+    return counts
+
+
+def inventory(src: Union[Path, str], verbose: bool = False) -> Dict[str, Dict[str, int]]:
+    """
+    Classify every file under src by what's in it, whatever it's called
+    :param src:
+    :param verbose: Print what every file is
+    :return: Counts of each format, of the reasons files won't convert, and of files named like something they
+        aren't
+    """
+    counts: Dict[str, Dict[str, int]] = {'formats': {}, 'errors': {}, 'misnamed': {}}
+    for dir_path, dir_names, file_names in os.walk(src):
+        dir_names[:] = sorted(d for d in dir_names if not d.startswith('.') and d != '__MACOSX')
+        for file_name in sorted(file_names):
+            if file_name.startswith('.'):
+                continue
+            path = os.path.join(dir_path, file_name)
+            rel_path = Path(os.path.relpath(path, src)).as_posix()
+            try:
+                sniffed = sniff_file(path)
+            except OSError as e:
+                print(f'{rel_path}: Could not read the file: {e}', file=sys.stderr)
+                continue
+
+            fmt = sniffed.fmt or 'unknown'
+            counts['formats'][fmt] = counts['formats'].get(fmt, 0) + 1
+            if sniffed.error is not None:
+                counts['errors'][sniffed.error] = counts['errors'].get(sniffed.error, 0) + 1
+            named_fmt = format_for_file_name(file_name)
+            if sniffed.fmt is not None and named_fmt is not None and named_fmt != sniffed.fmt:
+                counts['misnamed'][sniffed.fmt] = counts['misnamed'].get(sniffed.fmt, 0) + 1
+
+            if verbose:
+                line = f'{rel_path}: {fmt}'
+                if sniffed.error is not None:
+                    line += f' ({PARSE_ERRORS[sniffed.error]})'
+                if sniffed.fmt is not None and named_fmt is not None and named_fmt != sniffed.fmt:
+                    line += f' named like {named_fmt}'
+                print(line)
+    return counts
+
+
+def format_for_option(value: str) -> str:
+    """
+    Formats on the command line can be given as the format name or the file extension
+    :param value:
+    :return:
+    """
+    value = value.lower().lstrip('.')
+    to_fmt = EXTENSION_FORMATS.get(value, value)
+    if to_fmt not in FORMATS or to_fmt in ('fxb', 'lib'):
+        raise argparse.ArgumentTypeError(f'Can not convert to {value}')
+    return to_fmt
+
+
+def main(argv: Union[Sequence[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m oneconverter', description='Convert kHs ONE presets')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    convert = commands.add_parser('convert', help='Convert a directory tree of presets and banks')
+    convert.add_argument('src', type=Path, help='Directory to convert')
+    convert.add_argument('dst', type=Path, help='Where the converted presets go')
+    convert.add_argument('--to', dest='to_fmt', type=format_for_option, required=True,
+                         help='Format to convert to: fxp, aupreset or repatch')
+    convert.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                         help='Number of worker processes (default: number of CPUs)')
+    convert.add_argument('--force', action='store_true', help='Convert everything, even if unchanged')
+    convert.add_argument('--prune', action='store_true',
+                         help='Delete outputs whose source files have gone away')
+    convert.add_argument('-v', '--verbose', action='store_true', help='List every file converted')
+
+    pack = commands.add_parser('pack', help='Pack a directory tree of presets and banks into one library')
+    pack.add_argument('src', type=Path, help='Directory to pack')
+    pack.add_argument('out', type=Path, help='Library file to write (.onelib)')
+    pack.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                      help='Number of worker processes (default: number of CPUs)')
+    pack.add_argument('-v', '--verbose', action='store_true', help='List every file read')
+
+    inventory_command = commands.add_parser('inventory', help='Work out what every file in a directory tree is')
+    inventory_command.add_argument('src', type=Path, help='Directory to look through')
+    inventory_command.add_argument('--json', action='store_true', help='Print the counts as JSON')
+    inventory_command.add_argument('-v', '--verbose', action='store_true', help='List every file')
+
+    args = parser.parse_args(argv)
+    if not args.src.is_dir():
+        parser.error(f'{args.src} is not a directory')
+
+    if args.command == 'inventory':
+        counts = inventory(args.src, verbose=args.verbose and not args.json)
+        if args.json:
+            print(json.dumps(counts, indent=1, sort_keys=True))
+            return 0
+        for section, title in (('formats', 'Formats'), ('errors', 'Will not convert'), ('misnamed', 'Misnamed')):
+            if counts[section]:
+                print(f'{title}: ' + ', '.join(f'{key} {n}' for key, n in sorted(counts[section].items())))
+        return 0
+
+    if args.command == 'pack':
+        counts = pack_tree(args.src, args.out, jobs=max(args.jobs, 1), verbose=args.verbose)
+        print(f'Packed {counts["presets"]} presets from {counts["files"]} files into {args.out} '
+              f'({counts["bytes"] / 1048576:.2f} MB), failed {counts["failed"]} in {counts["seconds"]:.2f}s')
+        return 1 if counts['failed'] else 0
+
+    counts = convert_tree(args.src, args.dst, args.to_fmt, jobs=max(args.jobs, 1), force=args.force,
+                          prune=args.prune, verbose=args.verbose)
+
+    seconds = counts['seconds']
+    rate = counts['converted'] / seconds if seconds else 0
+    mb_rate = counts['bytes'] / 1048576 / seconds if seconds else 0
+    print(f'Converted {counts["converted"]}, unchanged {counts["unchanged"]}, failed {counts["failed"]}, '
+          f'removed {counts["removed"]} in {seconds:.2f}s ({rate:.1f} files/s, {mb_rate:.2f} MB/s)')
+    return 1 if counts['failed'] else 0
@@ -0,0 +1,317 @@
+"""
+Columnar (NumPy) bank stuff
+
+Optional. Only needed if you want to treat a bank as a matrix, so NumPy isn't a hard requirement.
+Also has whole matrix versions of Parameter's logical/formatted value conversions, and of the Reason export
+"""
+from .binary import BufferInput, FXB_HEADER, BANK_CHUNK_HEADER, BANK_NAME_SIZE, PARAM_CHUNK_SIZE, fxb_header, name_field
+from .bank import init_patch_slot, return_bank_presets
+from .preset import Preset
+from .render import REASON_HEAD, REASON_TAIL, REASON_VALUE_FIELDS, REASON_DERIVED_FIELDS
+from .schema import ParameterSpec, PARAMETER_SCHEMA, PARAMETER_INDEX, REASON_SCHEMA, RE_EXCLUDE_PARAMS
+from .utils import CURRENT_VERSION, PARAM_COUNT
+from array import array
+from functools import lru_cache
+from itertools import repeat
+from typing import BinaryIO, List, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError as e:  # pragma: no cover
+    raise ImportError('The columnar bank backend requires numpy. Install it with: pip install numpy') from e
+
+# One program slot in an FXB program chunk: name, param chunk size, then the param chunk itself
+PROGRAM_DTYPE = np.dtype([
+    ('name', 'S24'),
+    ('chunk_size', '<u4'),
+    ('version', '<u4'),
+    ('param_count', '<u4'),
+    ('values', '<f4', (PARAM_COUNT,)),
+])
+
+# The schema as vectors, so a whole (N, 108) matrix converts in one go
+STEPS = np.array([spec.steps for spec in PARAMETER_SCHEMA], dtype=np.int64)
+STEPPED = STEPS != -1
+BOOLEAN = np.array([spec.param_type == 'boolean' for spec in PARAMETER_SCHEMA])
+TOP_STEPS = np.where(STEPPED, STEPS - 1, 1).astype(np.float64)
+
+_DELAY_TIME = PARAMETER_INDEX['DELAY_TIME'].index
+_LFO_2_RATE = PARAMETER_INDEX['LFO_2_RATE'].index
+_REASON_INDICES = [index for _, _, index in REASON_VALUE_FIELDS]
+_REASON_SPECS = [spec for spec in PARAMETER_SCHEMA if spec.name not in RE_EXCLUDE_PARAMS] + list(REASON_SCHEMA)
+# render_reason's output with a hole for each value, so a whole patch is one % away
+_REASON_TEMPLATE = REASON_HEAD.replace('%', '%%') + ''.join(f'{prefix}%s</Value>\n' for prefix, _, _ in
+                                                            REASON_VALUE_FIELDS + REASON_DERIVED_FIELDS) + REASON_TAIL
+
+
+def logical_values(values: np.ndarray) -> np.ndarray:
+    """
+    Parameter.get_logical_value for a whole matrix. Stepped parameters become their step number
+    :param values: (N, 108) normalized values
+    :return: (N, 108) float64
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(STEPPED, np.round(values * TOP_STEPS), values)
+
+
+def normalized_values(logical: np.ndarray) -> np.ndarray:
+    """
+    Parameter.set_logical_value for a whole matrix
+    :param logical: (N, 108) logical values
+    :return: (N, 108) float32, like a preset stores them
+    """
+    logical = np.asarray(logical, dtype=np.float64)
+    return np.where(STEPPED, logical / TOP_STEPS, logical).astype(np.float32)
+
+
+def _format_column(spec: ParameterSpec, column: np.ndarray) -> List[str]:
+    """
+    value_formatter for a whole column
+    Numbers still go through str(), which is what decides their text (and is most of the time spent). Each
+    distinct value only goes through it once though, and libraries repeat values a lot
+    :param spec:
+    :param column: Normalized values
+    :return:
+    """
+    if spec.param_type == 'boolean':
+        return np.where(column > 0.5, 'true', 'false').tolist()
+    if spec.steps != -1:
+        column = np.round(column * (spec.steps - 1)).astype(np.int64)
+
+    distinct, inverse = np.unique(column, return_inverse=True)
+    texts = list(map(str, distinct.tolist()))
+    if spec.steps == -1:
+        for i in np.flatnonzero(distinct % 1 == 0).tolist():
+            texts[i] = str(int(distinct[i]))
+    return np.array(texts, dtype=object)[inverse].tolist()
+
+
+def _formatted_rows(specs: Sequence[ParameterSpec], values: np.ndarray) -> List[Tuple[str, ...]]:
+    values = np.asarray(values, dtype=np.float64)
+    return list(zip(*(_format_column(spec, column) for spec, column in zip(specs, values.T))))
+
+
+def formatted_values(values: np.ndarray) -> List[Tuple[str, ...]]:
+    """
+    The text Reason gets for each parameter (value_formatter, or Parameter.get_xml's text) for a whole matrix
+    :param values: (N, 108) normalized values
+    :return: N rows of 108 strings
+    """
+    return _formatted_rows(PARAMETER_SCHEMA, values)
+
+
+def values_from_formatted(rows: Sequence[Sequence[str]]) -> np.ndarray:
+    """
+    Parameter.set_formatted_value for a whole matrix
+    :param rows: N rows of 108 strings
+    :return: (N, 108) float32 normalized values
+    """
+    logical = np.empty((len(rows), PARAM_COUNT), dtype=np.float64)
+    for index, texts in enumerate(zip(*rows)):
+        if BOOLEAN[index]:
+            logical[:, index] = [text == 'true' for text in texts]
+        else:
+            logical[:, index] = np.fromiter(map(float, texts), dtype=np.float64, count=len(rows))
+    return normalized_values(logical)
+
+
+def _pow(column: np.ndarray, exponent: float) -> np.ndarray:
+    """
+    Python's pow over a column, like the single preset code uses
+    np.power can come out an ulp different, which is enough to change the text Reason gets
+    :param column:
+    :param exponent:
+    :return:
+    """
+    return np.fromiter(map(pow, column.tolist(), repeat(exponent, len(column))), dtype=np.float64, count=len(column))
+
+
+def reason_derived_values(values: np.ndarray) -> np.ndarray:
+    """
+    The Reason only properties for a whole matrix, derived like render_reason does
+    DELAY_TIME_MS is DELAY_TIME ** 0.25. The rest are DELAY_TIME and LFO_2_RATE as is, stepped when formatted
+    :param values: (N, 108) normalized values
+    :return: (N, 4) float64, in REASON_SCHEMA order
+    """
+    values = np.asarray(values, dtype=np.float64)
+    delay_time = values[:, _DELAY_TIME]
+    lfo2_rate = values[:, _LFO_2_RATE]
+    return np.column_stack((_pow(delay_time, 0.25), delay_time, lfo2_rate, lfo2_rate))
+
+
+def reason_source_values(values: np.ndarray, sources: np.ndarray,
+                         synced: Union[np.ndarray, None] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Work DELAY_TIME and LFO_2_RATE back out of the Reason only properties for a whole matrix, like process_re does
+    :param values: (N, 108) normalized values
+    :param sources: (N, 4) DELAY_TIME_16TH, DELAY_TIME_MS, LFO_2_RATE_SYNC and LFO_2_RATE_FREE, as read
+    :param synced: (N, 2) whether the delay and LFO 2 are synced. process_re goes by the formatted sync values,
+        which are never empty, so it always takes the synced branch. That's the default here too
+    :return: The values with DELAY_TIME and LFO_2_RATE filled in, and the (N, 4) Reason only values in
+        REASON_SCHEMA order
+    """
+    sources = np.asarray(sources, dtype=np.float64)
+    if synced is None:
+        synced = np.ones((len(sources), 2), dtype=bool)
+    delay_synced, lfo2_synced = np.asarray(synced, dtype=bool).T
+    delay_time_16th, delay_time_ms, lfo2_rate_sync, lfo2_rate_free = sources.T
+    zero = np.zeros(len(sources))
+
+    values = np.array(values, dtype=np.float32)
+    values[:, _DELAY_TIME] = np.where(delay_synced, delay_time_16th, _pow(delay_time_ms, 4.0))
+    values[:, _LFO_2_RATE] = np.where(lfo2_synced, lfo2_rate_sync, lfo2_rate_free)
+    reason_values = np.column_stack((
+        np.where(delay_synced, zero, delay_time_ms),
+        np.where(delay_synced, delay_time_16th / (REASON_SCHEMA[1].steps - 1), zero),
+        np.where(lfo2_synced, zero, lfo2_rate_free),
+        np.where(lfo2_synced, lfo2_rate_sync / (REASON_SCHEMA[3].steps - 1), zero),
+    )).astype(np.float32)
+    return values, reason_values
+
+
+def render_reason_batch(values: np.ndarray) -> List[bytes]:
+    """
+    render_reason for every row of a matrix
+    :param values: (N, 108) normalized values
+    :return: A Reason patch per row
+    """
+    values = np.asarray(values, dtype=np.float64)
+    columns = np.concatenate((values[:, _REASON_INDICES], reason_derived_values(values)), axis=1)
+    return [(_REASON_TEMPLATE % row).encode('utf-8') for row in _formatted_rows(_REASON_SPECS, columns)]
+
+
+@lru_cache(maxsize=None)
+def _init_record() -> np.ndarray:
+    """
+    The Init Patch as a program record, used to pad out short banks
+    :return:
+    """
+    return np.frombuffer(init_patch_slot(), dtype=PROGRAM_DTYPE)
+
+
+class ColumnarBank:
+    """
+    A VST Bank (FXB) held as an (N, 108) float32 matrix plus a fixed width name array
+    """
+    def __init__(self, records: Union[np.ndarray, None] = None) -> None:
+        """
+        Construct the bank object
+        :param records: Structured array of PROGRAM_DTYPE
+        """
+        self.records = records if records is not None else np.zeros(0, dtype=PROGRAM_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        (N, 108) normalized values. A view, so writes go straight into the bank
+        :return:
+        """
+        return self.records['values']
+
+    @property
+    def names(self) -> np.ndarray:
+        return self.records['name']
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        All programs' values for one parameter. Also a view
+        :param name:
+        :return:
+        """
+        return self.records['values'][:, PARAMETER_INDEX[name].index]
+
+    def name_list(self) -> List[str]:
+        return [n.decode('utf-8', errors='replace') for n in self.records['name']]
+
+    @classmethod
+    def from_presets(cls, presets: List['Preset']) -> 'ColumnarBank':
+        records = np.zeros(len(presets), dtype=PROGRAM_DTYPE)
+        records['chunk_size'] = PARAM_CHUNK_SIZE
+        records['param_count'] = PARAM_COUNT
+        for i, p in enumerate(presets):
+            records['name'][i] = name_field(p.name, BANK_NAME_SIZE)
+            records['version'][i] = p.version
+            records['values'][i] = np.frombuffer(p.fxp_values(), dtype=np.float32)
+        return cls(records)
+
+    @classmethod
+    def from_program_chunk(cls, bank_prog_data: BufferInput, prog_count: int = 100,
+                           errors: Union[List[str], None] = None) -> Union['ColumnarBank', None]:
+        """
+        Read a bank's program chunk in one go
+        Falls back to the per preset path if the programs aren't all the standard size
+        :param bank_prog_data:
+        :param prog_count:
+        :param errors: Gets the reason code (see PARSE_ERRORS) added if it's not usable
+        :return:
+        """
+        try:
+            records = np.frombuffer(bank_prog_data, dtype=PROGRAM_DTYPE, count=prog_count,
+                                    offset=BANK_CHUNK_HEADER.size)
+        except ValueError:
+            records = None
+
+        if records is None or np.any(records['chunk_size'] != PARAM_CHUNK_SIZE):
+            presets = return_bank_presets(bank_prog_data, prog_count=prog_count, errors=errors)
+            if presets is None:
+                return None
+            return cls.from_presets(presets)
+
+        return cls(records.copy())
+
+    def to_presets(self) -> List['Preset']:
+        presets = []
+        for record in self.records:
+            preset = Preset(record['name'].decode('utf-8', errors='replace'), int(record['version']))
+            values = array('f')
+            values.frombytes(record['values'].astype('=f4').tobytes())
+            preset.values[:PARAM_COUNT] = values
+            presets.append(preset)
+        return presets
+
+    def return_reason_data(self) -> List[bytes]:
+        """
+        Every program as a Reason patch
+        :return:
+        """
+        return render_reason_batch(self.values)
+
+    def _bank_records(self) -> np.ndarray:
+        """
+        Returns the records that will actually go into the bank
+        :return:
+        """
+        records = self.records
+        if len(records) > 100:
+            print('Preset count greater than 100. Only using the first 100.')
+            return records[:100]
+        elif len(records) < 100:
+            print('Preset count less than 100. Padding with the Init Patch.')
+            return np.concatenate((records, np.repeat(_init_record(), 100 - len(records))))
+
+        return np.ascontiguousarray(records)
+
+    def return_bank_data(self) -> bytes:
+        """
+        Return data representing an FXB file
+        :return:
+        """
+        records = self._bank_records()
+        program_chunk_size = BANK_CHUNK_HEADER.size + records.nbytes
+        header = FXB_HEADER.pack(*fxb_header(program_chunk_size)) + BANK_CHUNK_HEADER.pack(CURRENT_VERSION)
+        return header + records.tobytes()
+
+    def write_to(self, fileobj: BinaryIO) -> int:
+        """
+        Stream the FXB data to a file, socket file, etc. straight out of the record array
+        :param fileobj:
+        :return: The number of bytes written
+        """
+        records = self._bank_records()
+        program_chunk_size = BANK_CHUNK_HEADER.size + records.nbytes
+        fileobj.write(FXB_HEADER.pack(*fxb_header(program_chunk_size)) + BANK_CHUNK_HEADER.pack(CURRENT_VERSION))
+        fileobj.write(memoryview(records).cast('B'))
+        return FXB_HEADER.size + program_chunk_size
@@ -0,0 +1,253 @@
+"""
+Converting presets between formats
+"""
+from .bank import Bank, LazyBank, init_patch_slot, pack_banks
+from .binary import BufferInput
+from .library import Library, pack_library
+from .preset import PARSE_ERRORS, Preset, etree, process_fxp, process_au, process_re
+from .render import xml_compatible
+from .transcode import TRANSCODERS
+from typing import Dict, List, Tuple, Union
+import gc
+import time
+
+# Format: (parse function name, export method name, file extension)
+FORMATS = {
+    'fxp': ('process_fxp', 'return_fxp_data', 'fxp'),
+    'aup': ('process_au', 'return_au_data', 'aupreset'),
+    'res': ('process_re', 'return_reason_data', 'repatch'),
+    'fxb': ('process_fxb', 'return_bank_data', 'fxb'),
+    'lib': ('process_library', 'pack_library', 'onelib'),
+}
+# Formats holding any number of presets
+COLLECTION_FORMATS = {
+    'fxb': (LazyBank, 'bank'),
+    'lib': (Library, 'library'),
+}
+EXTENSION_FORMATS = {ext: fmt for fmt, (_, _, ext) in FORMATS.items()}
+
+_PARSERS = {
+    'fxp': process_fxp,
+    'aup': process_au,
+    'res': process_re,
+}
+
+
+class ConversionError(Exception):
+    """
+    A preset couldn't be converted. The message is meant for the user, the reason for metrics and the like
+    """
+    def __init__(self, message: str, reason: str = 'unknown') -> None:
+        super().__init__(message)
+        self.reason = reason
+
+    def __reduce__(self):
+        # So the reason survives coming back from a worker process
+        return type(self), (str(self), self.reason)
+
+
+def format_for_file_name(file_name: str) -> Union[str, None]:
+    """
+    Guess the format from a file's extension
+    :param file_name:
+    :return:
+    """
+    _, dot, ext = file_name.rpartition('.')
+    return EXTENSION_FORMATS.get(ext.lower()) if dot else None
+
+
+def export_preset(preset: 'Preset', to_fmt: str) -> Tuple[bytes, str]:
+    """
+    Export a preset. Going to fxb or lib gets you a bank or library with just the preset in it
+    :param preset:
+    :param to_fmt:
+    :return: The exported data and a file name for it
+    """
+    if to_fmt not in FORMATS:
+        raise ConversionError(f'Converting to {to_fmt} is not supported', 'unsupported_format')
+    if to_fmt == 'aup' and not xml_compatible(preset.name):
+        raise ConversionError(PARSE_ERRORS['invalid_name'], 'invalid_name')
+
+    if to_fmt == 'fxb':
+        converted_data = Bank([preset]).return_bank_data()
+    elif to_fmt == 'lib':
+        converted_data = pack_library([preset])
+    else:
+        converted_data = getattr(preset, FORMATS[to_fmt][1])()
+    return bytes(converted_data), f'{preset.name}.{FORMATS[to_fmt][2]}'
+
+
+def parse_preset(preset_data: BufferInput, from_fmt: str, file_name: str = 'fake.reapatch') -> 'Preset':
+    """
+    Read a single preset, raising ConversionError if it can't be
+    :param preset_data:
+    :param from_fmt:
+    :param file_name: Name of the uploaded file. Reason presets get named after it
+    :return:
+    """
+    if from_fmt not in _PARSERS:
+        raise ConversionError(f'Converting from {from_fmt} is not supported', 'unsupported_format')
+
+    errors = []
+    try:
+        preset = _PARSERS[from_fmt](preset_data, file_name=file_name, errors=errors)
+    except Exception as e:
+        raise ConversionError(f'Could not read the file as {FORMATS[from_fmt][2]}: {e}', 'unreadable') from e
+
+    if preset is None:
+        raise ConversionError(f'Could not read the file as a kHs ONE {FORMATS[from_fmt][2]} preset',
+                              errors[-1] if errors else 'unknown')
+    return preset
+
+
+def transcode_preset(preset_data: BufferInput, from_fmt: str, to_fmt: str) -> Union[Tuple[bytes, str], None]:
+    """
+    Convert a single preset without decoding it, for the format pairs that can be (see transcode.TRANSCODERS)
+    :param preset_data:
+    :param from_fmt:
+    :param to_fmt:
+    :return: The converted data and a file name for it, or None if the pair needs a real conversion
+    """
+    transcoder = TRANSCODERS.get((from_fmt, to_fmt))
+    if transcoder is None:
+        return None
+
+    errors = []
+    try:
+        transcoded = transcoder(preset_data, errors=errors)
+    except Exception as e:
+        raise ConversionError(f'Could not read the file as {FORMATS[from_fmt][2]}: {e}', 'unreadable') from e
+
+    if transcoded is None:
+        raise ConversionError(f'Could not read the file as a kHs ONE {FORMATS[from_fmt][2]} preset',
+                              errors[-1] if errors else 'unknown')
+    converted_data, name = transcoded
+    return bytes(converted_data), f'{name}.{FORMATS[to_fmt][2]}'
+
+
+def convert_preset(preset_data: BufferInput, from_fmt: str, to_fmt: str,
+                   file_name: str = 'fake.reapatch') -> Tuple[bytes, str]:
+    """
+    Convert a single preset
+    :param preset_data:
+    :param from_fmt:
+    :param to_fmt:
+    :param file_name: Name of the uploaded file. Reason presets get named after it
+    :return: The converted data and a file name for it
+    """
+    if to_fmt not in FORMATS:
+        raise ConversionError(f'Converting to {to_fmt} is not supported', 'unsupported_format')
+
+    transcoded = transcode_preset(preset_data, from_fmt, to_fmt)
+    if transcoded is not None:
+        return transcoded
+    return export_preset(parse_preset(preset_data, from_fmt, file_name=file_name), to_fmt)
+
+
+def convert_preset_timed(preset_data: BufferInput, from_fmt: str, to_fmt: str,
+                         file_name: str = 'fake.reapatch') -> Tuple[bytes, str, Dict[str, float]]:
+    """
+    convert_preset, also returning how long parsing and serializing took (in seconds)
+    :param preset_data:
+    :param from_fmt:
+    :param to_fmt:
+    :param file_name:
+    :return: The converted data, a file name for it and the stage timings
+    """
+    started = time.perf_counter()
+    transcoded = transcode_preset(preset_data, from_fmt, to_fmt)
+    if transcoded is not None:
+        return transcoded + ({'convert': time.perf_counter() - started},)
+
+    preset = parse_preset(preset_data, from_fmt, file_name=file_name)
+    parsed = time.perf_counter()
+    converted_data, converted_name = export_preset(preset, to_fmt)
+    return converted_data, converted_name, {'parse': parsed - started, 'serialize': time.perf_counter() - parsed}
+
+
+def open_collection(file_data: BufferInput, from_fmt: str) -> Union[LazyBank, Library]:
+    """
+    Open a bank or library, raising ConversionError if it can't be
+    :param file_data:
+    :param from_fmt: One of COLLECTION_FORMATS
+    :return:
+    """
+    collection_class, description = COLLECTION_FORMATS[from_fmt]
+    errors = []
+    try:
+        return collection_class(file_data, errors)
+    except Exception as e:
+        raise ConversionError(f'Could not read the file as a kHs ONE {FORMATS[from_fmt][2]} {description}',
+                              errors[-1] if errors else 'unreadable') from e
+
+
+def parse_file(file_data: BufferInput, from_fmt: str, file_name: str = 'fake.reapatch') -> List['Preset']:
+    """
+    Read every preset in a preset, bank or library file, raising ConversionError if it can't be
+    :param file_data:
+    :param from_fmt:
+    :param file_name:
+    :return:
+    """
+    if from_fmt not in COLLECTION_FORMATS:
+        return [parse_preset(file_data, from_fmt, file_name=file_name)]
+
+    with open_collection(file_data, from_fmt) as collection:
+        return list(collection)
+
+
+def _library_to_reason(library: Library) -> Union[List[Tuple[bytes, str]], None]:
+    """
+    Render a whole library as Reason patches in one go
+    :param library:
+    :return: The patches and their file names, or None if numpy isn't there to do it
+    """
+    try:
+        from .columnar import render_reason_batch
+    except ImportError:
+        return None
+    ext = FORMATS['res'][2]
+    return [(data, f'{name}.{ext}') for data, name in zip(render_reason_batch(library.matrix()), library.names())]
+
+
+def convert_file(file_data: BufferInput, from_fmt: str, to_fmt: str,
+                 file_name: str = 'fake.reapatch') -> List[Tuple[bytes, str]]:
+    """
+    Convert a preset, bank or library. Banks and libraries get exploded into their programs,
+    except that going to lib packs them all into one library and going from lib to fxb packs them into banks of 100
+    :param file_data:
+    :param from_fmt:
+    :param to_fmt:
+    :param file_name:
+    :return: The converted data and a file name for each preset (or bank, or library)
+    """
+    if from_fmt not in COLLECTION_FORMATS:
+        return [convert_preset(file_data, from_fmt, to_fmt, file_name=file_name)]
+
+    stem = file_name.rpartition('.')[0] or COLLECTION_FORMATS[from_fmt][1]
+    with open_collection(file_data, from_fmt) as collection:
+        if to_fmt == 'lib':
+            return [(bytes(pack_library(collection)), f'{stem}.{FORMATS[to_fmt][2]}')]
+        if from_fmt == 'lib' and to_fmt == 'fxb':
+            return [(bytes(bank.return_bank_data()), f'{stem}_{n:03}.{FORMATS[to_fmt][2]}')
+                    for n, bank in enumerate(pack_banks(collection), 1)]
+        if from_fmt == 'lib' and to_fmt == 'res':
+            converted = _library_to_reason(collection)
+            if converted is not None:
+                return converted
+        return [export_preset(preset, to_fmt) for preset in collection]
+
+
+def warmup(xml: bool = True, freeze: bool = False) -> None:
+    """
+    Do the one off setup up front instead of on the first request. Call it before forking (gunicorn's preload_app,
+    before starting a process pool) and the workers all share it copy on write
+    :param xml: Also import lxml, which the AU and Reason readers need
+    :param freeze: gc.freeze() afterwards, so the collector doesn't write to (and so copy) the shared pages
+    :return:
+    """
+    init_patch_slot()  # Reads and decodes the Init Patch too
+    if xml:
+        etree()
+    if freeze:
+        gc.freeze()
@@ -0,0 +1,326 @@
+"""
+Preset libraries: lots of presets packed into one memory mappable file
+
+Everything is little endian and every section starts on an 8 byte boundary:
+
+    header        LIBRARY_HEADER.size bytes
+    values        N x 108 float32, one row per preset, exactly as they'd be in an FXP param chunk
+    versions      N uint32
+    name offsets  N + 1 uint32, into the name data
+    name data     UTF-8 names, back to back (not cut down to 24 bytes like FXP/FXB names)
+    hash keys     N uint64, sorted (optional)
+    hash rows     N uint32, the row each hash key belongs to (optional)
+
+Opening a library only reads the header, so it takes the same time whether it holds ten presets or a million.
+Presets are decoded when asked for, and the values can be had as one NumPy matrix without copying
+"""
+from .bank import Bank, pack_banks
+from .binary import BufferInput, ByteWriter, as_view
+from .preset import Preset, parse_failed
+from .schema import SCHEMA_VERSION
+from .utils import PARAM_COUNT
+from array import array
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Sequence, Tuple, Union
+import hashlib
+import struct
+import sys
+
+if TYPE_CHECKING:
+    import numpy as np
+
+LIBRARY_MAGIC = b'kHsL'
+LIBRARY_VERSION = 1  # Of the container layout. SCHEMA_VERSION covers the parameters
+HAS_HASH_INDEX = 0x1
+
+# magic, library version, flags, schema version, param count, preset count,
+# then where the values, versions, name offsets, name data, hash keys and hash rows start, and where it all ends
+LIBRARY_HEADER = struct.Struct('<4sHHIII4x7Q48x')
+ROW_SIZE = PARAM_COUNT * 4
+
+_NATIVE_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _little_endian(values: array) -> bytes:
+    """
+    An array's bytes, little endian whatever the machine is
+    :param values:
+    :return:
+    """
+    if not _NATIVE_LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _section(view: memoryview, offset: int, count: int, typecode: str) -> Sequence:
+    """
+    A typed view of part of the library. Only copies on big endian machines
+    :param view:
+    :param offset:
+    :param count:
+    :param typecode: array/memoryview typecode
+    :return:
+    """
+    section = view[offset:offset + count * array(typecode).itemsize]
+    if _NATIVE_LITTLE_ENDIAN:
+        return section.cast(typecode)
+    values = array(typecode, section.tobytes())
+    values.byteswap()
+    return values
+
+
+def row_hash(row: Union[bytes, memoryview]) -> int:
+    """
+    Hash index key for a preset's values
+    :param row: The 108 values as little endian float32
+    :return:
+    """
+    return int.from_bytes(hashlib.blake2b(row, digest_size=8).digest(), 'little')
+
+
+def _preset_row(preset: 'Preset') -> bytes:
+    return _little_endian(preset.fxp_values())
+
+
+def _layout(count: int, name_data_size: int, hash_index: bool) -> Tuple[int, ...]:
+    """
+    Where every section starts, and where the library ends
+    :param count:
+    :param name_data_size:
+    :param hash_index:
+    :return:
+    """
+    values = LIBRARY_HEADER.size
+    versions = _align(values + count * ROW_SIZE)
+    name_offsets = _align(versions + count * 4)
+    names = _align(name_offsets + (count + 1) * 4)
+    hash_keys = _align(names + name_data_size)
+    hash_rows = hash_keys + count * 8 if hash_index else hash_keys
+    end = _align(hash_rows + count * 4) if hash_index else hash_keys
+    return values, versions, name_offsets, names, hash_keys, hash_rows, end
+
+
+def pack_library(presets: Iterable['Preset'], hash_index: bool = True) -> bytearray:
+    """
+    Return the data for a library of presets
+    :param presets:
+    :param hash_index: Include the hash index, for looking presets up by their values
+    :return:
+    """
+    presets = [preset for preset in presets if preset is not None]
+    names = [(preset.name or '').encode('utf-8') for preset in presets]
+    name_offsets = array('I', [0])
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+
+    layout = _layout(len(presets), name_offsets[-1], hash_index)
+    values_start, versions_start, name_offsets_start, names_start, hash_keys_start, hash_rows_start, end = layout
+    writer = ByteWriter(end)
+    writer.pack(LIBRARY_HEADER, LIBRARY_MAGIC, LIBRARY_VERSION, HAS_HASH_INDEX if hash_index else 0, SCHEMA_VERSION,
+                PARAM_COUNT, len(presets), *layout)
+
+    rows = [_preset_row(preset) for preset in presets]
+    writer.write(b''.join(rows))
+    writer.offset = versions_start
+    writer.write(_little_endian(array('I', (preset.version for preset in presets))))
+    writer.offset = name_offsets_start
+    writer.write(_little_endian(name_offsets))
+    writer.offset = names_start
+    writer.write(b''.join(names))
+
+    if hash_index:
+        keyed = sorted((row_hash(row), i) for i, row in enumerate(rows))
+        writer.offset = hash_keys_start
+        writer.write(_little_endian(array('Q', (key for key, _ in keyed))))
+        writer.offset = hash_rows_start
+        writer.write(_little_endian(array('I', (i for _, i in keyed))))
+
+    return writer.buffer
+
+
+def read_library_header(view: memoryview, errors: Union[List[str], None] = None) -> Union[Tuple[int, ...], None]:
+    """
+    Check a library's header
+    :param view:
+    :param errors: Gets the reason code (see PARSE_ERRORS) added if it's not usable
+    :return: The flags, preset count and section offsets (see _layout), or None if it's not usable
+    """
+    if len(view) < LIBRARY_HEADER.size:
+        return parse_failed('library_truncated', errors)
+
+    magic, version, flags, schema_version, param_count, count, *layout = LIBRARY_HEADER.unpack_from(view)
+    if magic != LIBRARY_MAGIC:
+        return parse_failed('bad_library_magic', errors)
+    if version > LIBRARY_VERSION:
+        return parse_failed('library_version', errors)
+    if schema_version != SCHEMA_VERSION or param_count != PARAM_COUNT:
+        return parse_failed('library_schema', errors)
+
+    # The name data's size is whatever's between it and the hash keys. Everything else follows from the count
+    names_start, hash_keys_start, end = layout[3], layout[4], layout[6]
+    if end > len(view) or hash_keys_start < names_start \
+            or tuple(layout) != _layout(count, hash_keys_start - names_start, bool(flags & HAS_HASH_INDEX)):
+        return parse_failed('library_truncated', errors)
+    name_data_size, = struct.unpack_from('<I', view, layout[2] + count * 4)
+    if name_data_size > hash_keys_start - names_start:
+        return parse_failed('library_truncated', errors)
+
+    return (flags, count, *layout)
+
+
+class Library:
+    """
+    A read only preset library. Paths get memory mapped, and nothing is decoded until it's asked for
+    """
+    def __init__(self, library_data: BufferInput, errors: Union[List[str], None] = None) -> None:
+        """
+        Open the library
+        :param library_data:
+        :param errors: Gets the reason code (see PARSE_ERRORS) added if it's not usable
+        """
+        view = as_view(library_data)
+        header = read_library_header(view, errors)
+        if header is None:
+            raise ValueError('Not a usable kHs ONE library')
+        flags, count, values_start, versions_start, name_offsets_start, names_start, hash_keys_start, \
+            hash_rows_start, _ = header
+
+        self._view = view
+        self._count = count
+        self._values_start = values_start
+        self._names_start = names_start
+        self._versions = _section(view, versions_start, count, 'I')
+        self._name_offsets = _section(view, name_offsets_start, count + 1, 'I')
+        self._hash_keys = self._hash_rows = None
+        if flags & HAS_HASH_INDEX:
+            self._hash_keys = _section(view, hash_keys_start, count, 'Q')
+            self._hash_rows = _section(view, hash_rows_start, count, 'I')
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self) -> 'Library':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Let go of the underlying data (and the mmap, if we made one)
+        :return:
+        """
+        self._view = self._versions = self._name_offsets = self._hash_keys = self._hash_rows = None
+
+    def _index(self, index: int) -> int:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('library index out of range')
+        return index
+
+    def _row(self, index: int) -> memoryview:
+        """
+        A preset's values, as the little endian bytes in the file
+        :param index:
+        :return:
+        """
+        start = self._values_start + self._index(index) * ROW_SIZE
+        return self._view[start:start + ROW_SIZE]
+
+    def name(self, index: int) -> str:
+        index = self._index(index)
+        start = self._names_start + self._name_offsets[index]
+        end = self._names_start + self._name_offsets[index + 1]
+        return bytes(self._view[start:end]).decode('utf-8')
+
+    def names(self) -> List[str]:
+        name_data = bytes(self._view[self._names_start:self._names_start + self._name_offsets[self._count]])
+        offsets = self._name_offsets
+        return [name_data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(self._count)]
+
+    def version(self, index: int) -> int:
+        return self._versions[self._index(index)]
+
+    def values(self, index: int) -> array:
+        """
+        One preset's 108 normalized values
+        :param index:
+        :return:
+        """
+        values = array('f')
+        values.frombytes(self._row(index))
+        if not _NATIVE_LITTLE_ENDIAN:
+            values.byteswap()
+        return values
+
+    def matrix(self) -> 'np.ndarray':
+        """
+        All the values as a read only (N, 108) float32 matrix, straight out of the file (requires numpy)
+        :return:
+        """
+        try:
+            import numpy as np
+        except ImportError as e:  # pragma: no cover
+            raise ImportError('Library.matrix requires numpy. Install it with: pip install numpy') from e
+        return np.frombuffer(self._view, dtype='<f4', count=self._count * PARAM_COUNT,
+                             offset=self._values_start).reshape(self._count, PARAM_COUNT)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Preset, List[Preset]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+
+        preset = Preset(self.name(index), self.version(index))
+        preset.values[:PARAM_COUNT] = self.values(index)
+        return preset
+
+    def __iter__(self) -> Iterator[Preset]:
+        for i in range(self._count):
+            yield self[i]
+
+    def find(self, preset: 'Preset') -> List[int]:
+        """
+        Every preset in the library with exactly the same values as this one (names don't matter)
+        Uses the hash index if there is one, otherwise looks at every preset
+        :param preset:
+        :return: Their indices
+        """
+        row = _preset_row(preset)
+        if self._hash_keys is None:
+            return [i for i in range(self._count) if self._row(i) == row]
+
+        key = row_hash(row)
+        found = []
+        position = bisect_left(self._hash_keys, key)
+        while position < self._count and self._hash_keys[position] == key:
+            i = self._hash_rows[position]
+            if self._row(i) == row:  # Hashes can collide
+                found.append(i)
+            position += 1
+        return sorted(found)
+
+    def to_banks(self) -> Iterator[Bank]:
+        """
+        The library as FXB banks of 100 presets. The last one gets padded out with Init Patches
+        :return:
+        """
+        return pack_banks(iter(self))
+
+
+def process_library(library_data: BufferInput, errors: Union[List[str], None] = None,
+                    **kwargs) -> Union[Library, None]:
+    """
+    Open a preset library
+    :param library_data:
+    :param errors: Gets the reason code (see PARSE_ERRORS) added if it's not usable
+    :return:
+    """
+    try:
+        return Library(library_data, errors=errors)
+    except ValueError:
+        return None
@@ -0,0 +1,85 @@
+"""
+Prometheus metrics for the converter service
+
+Optional. Without prometheus_client installed everything here quietly does nothing.
+Under gunicorn with more than one worker, point PROMETHEUS_MULTIPROC_DIR at an empty directory before starting
+it and call mark_process_dead from gunicorn's child_exit hook, so /metrics adds up every worker
+"""
+from .convert import FORMATS
+from typing import Tuple, Union
+import os
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+# read: upload read, queue: waiting for a worker, parse/serialize: the conversion itself,
+# convert: parse and serialize together (banks), send: handing the response to the client, total: all of it
+STAGES = ('read', 'queue', 'parse', 'serialize', 'convert', 'send', 'total')
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+if prometheus_client is not None:
+    STAGE_SECONDS = prometheus_client.Histogram('oneconverter_stage_seconds', 'Time spent in each stage of /convert',
+                                                ('stage', 'from_fmt', 'to_fmt'), buckets=BUCKETS)
+    PARSE_FAILURES = prometheus_client.Counter('oneconverter_parse_failures_total',
+                                               'Uploads that could not be read, by reason', ('from_fmt', 'reason'))
+    CONVERSIONS = prometheus_client.Counter('oneconverter_conversions_total', 'Conversion requests, by outcome',
+                                            ('from_fmt', 'to_fmt', 'outcome'))
+
+
+def _fmt_label(fmt: str) -> str:
+    """
+    Formats come from the client. Don't let them make up new label values
+    :param fmt:
+    :return:
+    """
+    return fmt if fmt in FORMATS else 'other'
+
+
+def observe_stage(stage: str, from_fmt: str, to_fmt: str, seconds: float) -> None:
+    if prometheus_client is not None:
+        STAGE_SECONDS.labels(stage, _fmt_label(from_fmt), _fmt_label(to_fmt)).observe(seconds)
+
+
+def count_parse_failure(from_fmt: str, reason: str) -> None:
+    if prometheus_client is not None:
+        PARSE_FAILURES.labels(_fmt_label(from_fmt), reason).inc()
+
+
+def count_conversion(from_fmt: str, to_fmt: str, outcome: str) -> None:
+    """
+    :param from_fmt:
+    :param to_fmt:
+    :param outcome: ok, cached, failed, busy or timeout
+    :return:
+    """
+    if prometheus_client is not None:
+        CONVERSIONS.labels(_fmt_label(from_fmt), _fmt_label(to_fmt), outcome).inc()
+
+
+def render_metrics() -> Union[Tuple[bytes, str], None]:
+    """
+    The metrics in Prometheus' text format, gathered from every worker when in multiprocess mode
+    :return: The data and its content type, or None if prometheus_client isn't installed
+    """
+    if prometheus_client is None:
+        return None
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Call from gunicorn's child_exit hook so a dead worker's live gauges get cleaned up
+    :param pid:
+    :return:
+    """
+    if prometheus_client is not None and 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
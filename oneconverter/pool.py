@@ -0,0 +1,173 @@
+"""
+Bounded process pool for running conversions off the request thread
+"""
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Set, Tuple, Union
+import threading
+
+
+class PoolFull(Exception):
+    """
+    Every worker is busy and the queue is full. Try again later
+    """
+
+
+class ConversionTimeout(Exception):
+    """
+    A conversion took longer than it was allowed to
+    """
+
+
+class BoundedPool:
+    """
+    A process pool that only accepts so much work at once
+    At most workers + queue_depth jobs are running or waiting. Past that, submitting fails straight away
+    rather than queueing up behind everyone else
+    """
+    def __init__(self, workers: int = 1, queue_depth: int = 0, timeout: Union[float, None] = None) -> None:
+        """
+        Construct the pool. The processes are started on first use, so this is safe to do before forking
+        :param workers: Number of worker processes
+        :param queue_depth: Number of jobs allowed to wait for a free worker
+        :param timeout: Default seconds to wait for a result. None to wait forever
+        """
+        self.workers = max(workers, 1)
+        self.queue_depth = max(queue_depth, 0)
+        self.timeout = timeout
+        self.rejected = 0
+        self.timed_out = 0
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_depth)
+        self._executor = None
+        self._jobs: Dict[ProcessPoolExecutor, Set[Future]] = {}  # What's running or waiting in each executor
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_depth
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _restart(self, executor: ProcessPoolExecutor) -> None:
+        """
+        Throw away a pool with a stuck or dead worker in it. Whatever else was running in it fails with
+        BrokenProcessPool, which run() retries on the new pool
+        :param executor: The pool that went bad. Ignored if it's already been replaced
+        :return:
+        """
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+
+        self._kill(executor)
+
+    def _kill(self, executor: ProcessPoolExecutor) -> None:
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        with self._lock:
+            self._jobs.pop(executor, None)
+
+    def _retire(self, executor: ProcessPoolExecutor, stuck: Future) -> None:
+        """
+        Stop using a pool with a stuck worker in it, without breaking the jobs its other workers are busy with.
+        New jobs go to a fresh pool straight away, and the old one is killed once everything else in it is done
+        (or has had as long as any job gets)
+        :param executor:
+        :param stuck: The job that's stuck
+        :return:
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+            others = [future for future in self._jobs.get(executor, ()) if future is not stuck]
+
+        def reap() -> None:
+            if others:
+                wait(others, timeout=self.timeout)
+            self._kill(executor)
+
+        threading.Thread(target=reap, name='pool-reaper', daemon=True).start()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Start a job, if there's room for it
+        :param fn: Must be picklable, so a module level function
+        :return:
+        """
+        return self._submit(fn, args, kwargs)[1]
+
+    def _submit(self, fn: Callable, args: tuple, kwargs: dict) -> Tuple[ProcessPoolExecutor, Future, Callable]:
+        """
+        Start a job, if there's room for it
+        :return: The executor it went to, its future, and a function that gives its slot back (only the first call
+            does anything, the job finishing calls it too)
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PoolFull()
+
+        try:
+            executor = self._get_executor()
+            future = executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        released = threading.Lock()
+
+        def release(_: Union[Future, None] = None) -> None:
+            if released.acquire(blocking=False):
+                self._slots.release()
+
+        def done(_: Future) -> None:
+            release()
+            with self._lock:
+                jobs = self._jobs.get(executor)
+                if jobs is not None:
+                    jobs.discard(future)
+
+        with self._lock:
+            self._jobs.setdefault(executor, set()).add(future)
+        future.add_done_callback(done)
+        return executor, future, release
+
+    def run(self, fn: Callable, *args, timeout: Union[float, None] = None, **kwargs) -> Any:
+        """
+        Run a job and wait for its result
+        Raises PoolFull if there's no room, ConversionTimeout if it takes too long,
+        otherwise whatever the job raised
+        :param fn:
+        :param timeout: Seconds to wait. Defaults to the pool's timeout
+        :return:
+        """
+        timeout = self.timeout if timeout is None else timeout
+        for attempt in range(2):
+            executor, future, release = self._submit(fn, args, kwargs)
+            try:
+                return future.result(timeout=timeout)
+            except TimeoutError:
+                self.timed_out += 1
+                # Nobody's waiting for this job any more, so its slot is free now, not when its worker gets killed.
+                # The worker is stuck on it though, so its pool gets replaced
+                release()
+                self._retire(executor, future)
+                raise ConversionTimeout() from None
+            except BrokenProcessPool:
+                # Someone else's job took the pool down. Get a fresh one and have another go
+                self._restart(executor)
+                if attempt:
+                    raise
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -2,44 +2,171 @@
 Preset and Param stuff
 """
 
-from .utils import convert_magic, read_b_uint, range_pop, write_uint_b, CURRENT_VERSION
-from collections import OrderedDict
-from pathlib import Path
-from typing import Union
+from .binary import ByteReader, ByteWriter, BufferInput, FXP_HEADER, PARAM_CHUNK_HEADER, PARAM_VALUES, \
+    PARAM_CHUNK_SIZE, CHUNK_MAGIC, FXP_MAGIC, KHS_ONE_ID, FXP_NAME_SIZE, as_view, fxp_header, name_field
+from .render import render_au, render_reason, value_formatter
+from .schema import ParameterSpec, PARAMETER_SCHEMA, PARAMETER_NAMES, PARAMETER_INDEX, VALUE_COUNT, RE_EXCLUDE_PARAMS, \
+    DELAY_TIME_MS, DELAY_TIME_16TH, LFO_2_RATE_FREE, LFO_2_RATE_SYNC
+from .utils import CURRENT_VERSION, PARAM_COUNT
+from array import array
+from collections.abc import Mapping
+from io import BytesIO
+from typing import TYPE_CHECKING, BinaryIO, Callable, Dict, Iterable, Iterator, List, MutableSequence, Tuple, Union
 import base64
-import lxml.etree as et
-import struct
+import os
+import re
+
+if TYPE_CHECKING:
+    import lxml.etree as et
+
+
+# Why a preset or bank couldn't be read: reason code -> what gets printed
+PARSE_ERRORS = {
+    'truncated': 'Preset data is truncated',
+    'bad_chunk_magic': 'Invalid chunkMagic',
+    'bad_fx_magic': 'Unsupported fxMagic',
+    'wrong_fx_id': 'Preset does not seem to be for kHs ONE',
+    'old_version': 'Presets saved with a version of kHs ONE earlier than 1.014 are not supported',
+    'bad_param_chunk': 'Preset chunk data load failure',
+    'wrong_product_id': 'Preset does not seem to be for kHs ONE',
+    'missing_properties': 'Preset is missing Reason delay time or LFO 2 rate properties',
+    'wrong_subtype': 'Preset does not appear to be for kHs ONE',
+    'no_vstdata': 'Preset has no vstdata',
+    'bank_truncated': 'Bank data is truncated',
+    'bad_library_magic': 'Not a kHs ONE library',
+    'library_schema': 'Library was written with a different parameter schema',
+    'library_truncated': 'Library data is truncated',
+    'library_version': 'Library was written by a newer version of the converter',
+    'unknown_format': 'Not a kHs ONE preset, bank or library',
+    'invalid_name': 'Preset name has characters an AU preset can not have',
+}
+
+
+def parse_failed(reason: str, errors: Union[List[str], None] = None) -> None:
+    """
+    Report why something couldn't be parsed
+    :param reason: A key of PARSE_ERRORS
+    :param errors: If given, the reason gets added to it so callers can tell what went wrong
+    :return: None, so parsers can return it
+    """
+    print(PARSE_ERRORS[reason])
+    if errors is not None:
+        errors.append(reason)
+    return None
 
 
-def find_au_value(plist_xml_bytes: bytes, search_key: str) -> Union[et.Element, None]:
+def etree():
     """
-    Get a particular value based on the key
-    :param plist_xml_bytes:
-    :param search_key:
+    lxml.etree, imported the first time it's needed so binary only (FXP/FXB) work never pays for it
     :return:
     """
-    plist = et.XML(plist_xml_bytes)
+    import lxml.etree
+    return lxml.etree
+
 
-    result_idx = None
+_AU_ENTRY = re.compile(rb'<key>([^<&]*)</key>\s*<(string|integer|real|data)>([^<&]*)</\2>')
+_AU_KEY = re.compile(rb'<key>')
+_AU_MARKUP_DECL = re.compile(rb'<!(?!DOCTYPE[^\[>]*>)')  # Anything but a plain DOCTYPE: comments, CDATA, entities
+_AU_FOREIGN_ENCODING = re.compile(rb'<\?xml[^>]*encoding=["\'](?![Uu][Tt][Ff]-?8["\'])')
 
-    for i, x in enumerate(plist[0]):
-        if x.tag == 'key' and x.text == search_key:
-            result_idx = i + 1
-            break
 
-    if result_idx is not None:
-        return plist[0][result_idx]
+def _scan_au_values(plist_data: BufferInput, search_keys: Iterable[str]) -> Union[Dict[str, str], None]:
+    """
+    Find values in a flat plist with a scan over the raw bytes, the way AU presets are normally written
+    :param plist_data:
+    :param search_keys:
+    :return: Same as find_au_values, or None if the plist needs a real XML parser
+    """
+    data = bytes(plist_data)
+    if data.count(b'<dict') != 1 or b'<array' in data or b'&' in data or b'\r' in data \
+            or _AU_MARKUP_DECL.search(data) or _AU_FOREIGN_ENCODING.match(data):
+        return None
+    matches = _AU_ENTRY.findall(data)
+    if len(matches) != len(_AU_KEY.findall(data)):
+        return None
+
+    found = {}
+    for key, _, text in matches:
+        key = key.decode('utf-8')
+        if key in search_keys:
+            found[key] = text.decode('utf-8')
+            if len(found) == len(search_keys):
+                return found
+    return None
+
+
+def find_au_values(plist_data: BufferInput, search_keys: Iterable[str]) -> Dict[str, str]:
+    """
+    Get the values for some keys in an AU preset's top level dict, in one pass
+    Stops parsing once they've all turned up
+    :param plist_data:
+    :param search_keys:
+    :return: The text of each value that was found, by key
+    """
+    search_keys = set(search_keys)
+    plist_data = as_view(plist_data)
+    found = _scan_au_values(plist_data, search_keys)
+    if found is not None:
+        return found
+
+    found = {}
+    depth = 0
+    current_key = None
+
+    for event, elem in etree().iterparse(BytesIO(plist_data), events=('start', 'end'), resolve_entities=False):
+        if event == 'start':
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 2:  # plist > dict > this
+            if elem.tag == 'key':
+                current_key = elem.text
+            elif current_key is not None:
+                if current_key in search_keys:
+                    found[current_key] = elem.text if elem.text is not None else ''
+                    if len(found) == len(search_keys):
+                        break
+                current_key = None
+            elem.clear()
+
+    return found
 
 
 class Parameter:
     """
     A kHs ONE Preset Parameter
+    When it belongs to a preset, it's just a view onto a slot in the preset's value buffer
     """
+    __slots__ = ('name', 'param_type', 'steps', '_values', '_index')
+
     def __init__(self, name: str, param_type: str = 'number', steps: int = -1):
         self.name = name
         self.param_type = param_type
         self.steps = steps
-        self.normalized_value = float(0)
+        self._values = [float(0)]
+        self._index = 0
+
+    @classmethod
+    def bind(cls, spec: ParameterSpec, values: MutableSequence) -> 'Parameter':
+        """
+        Get a parameter backed by a slot in some value buffer
+        :param spec:
+        :param values:
+        :return:
+        """
+        param = cls.__new__(cls)
+        param.name, param.param_type, param.steps, param._index = spec
+        param._values = values
+        return param
+
+    @property
+    def normalized_value(self) -> float:
+        return self._values[self._index]
+
+    @normalized_value.setter
+    def normalized_value(self, value: float) -> None:
+        self._values[self._index] = value
 
     def get_logical_value(self) -> float:
         if self.steps != -1:
@@ -70,7 +197,7 @@ class Parameter:
         else:
             self.set_logical_value(float(formatted_value))
 
-    def get_xml(self) -> et.Element:
+    def get_xml(self) -> 'et.Element':
         """
         Return an XML element of the parameter
         :return:
@@ -79,432 +206,360 @@ class Parameter:
             'property': self.name,
             'type': self.param_type,
         }
-        if self.param_type == 'number' and float(self.get_formatted_value()) % 1 == 0:
-            tvalue = int(float(self.get_formatted_value()))
-        else:
-            tvalue = self.get_formatted_value()
-        element = et.Element('Value', attrib=attributes)
+        tvalue = self.get_formatted_value()
+        if self.param_type == 'number' and float(tvalue) % 1 == 0:
+            tvalue = int(float(tvalue))
+        element = etree().Element('Value', attrib=attributes)
         element.text = str(tvalue)
         return element
 
 
+class ParameterView(Mapping):
+    """
+    Dict style access to a preset's parameters, in FXP chunk order
+    """
+    __slots__ = ('_values',)
+
+    def __init__(self, values: MutableSequence) -> None:
+        self._values = values
+
+    def __getitem__(self, name: str) -> Parameter:
+        return Parameter.bind(PARAMETER_INDEX[name], self._values)
+
+    def __contains__(self, name: object) -> bool:
+        return name in PARAMETER_INDEX
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(PARAMETER_NAMES)
+
+    def __len__(self) -> int:
+        return len(PARAMETER_NAMES)
+
+    def values(self) -> Iterator[Parameter]:
+        values = self._values
+        return (Parameter.bind(spec, values) for spec in PARAMETER_SCHEMA)
+
+
+_EMPTY_VALUES = array('f', bytes(4 * VALUE_COUNT))
+_EMPTY_TEXT_VALUES = array('d', bytes(8 * VALUE_COUNT))
+
+
 class Preset:
     """
     A kHs ONE Preset
+    Only the name, version and a float32 buffer of values (FXP params, then the Reason specific ones) are stored.
+    Presets read from Reason patches have a float64 buffer instead, so the text's values go back out as they came in
     """
-    def __init__(self):
-        """
-        We're basically instantiating a shit ton of Parameters here
-        But doing some other stuff as well
-        """
-        self.name = None
-        self.version = None
-
-        self.parameters = OrderedDict()
-
-        self.parameters['OSC_1_WAVEFORM'] = Parameter('OSC_1_WAVEFORM', 'number', 3)
-        self.parameters['OSC_1_GAIN'] = Parameter('OSC_1_GAIN')
-        self.parameters['OSC_1_PW'] = Parameter('OSC_1_PW')
-        self.parameters['OSC_1_OCTAVE'] = Parameter('OSC_1_OCTAVE', 'number', 11)
-        self.parameters['OSC_1_SEMI'] = Parameter('OSC_1_SEMI', 'number', 23)
-        self.parameters['OSC_1_CENTS'] = Parameter('OSC_1_CENTS', 'number', 199)
-
-        self.parameters['OSC_2_WAVEFORM'] = Parameter('OSC_2_WAVEFORM', 'number', 3)
-        self.parameters['OSC_2_GAIN'] = Parameter('OSC_2_GAIN')
-        self.parameters['OSC_2_PW'] = Parameter('OSC_2_PW')
-        self.parameters['OSC_2_OCTAVE'] = Parameter('OSC_2_OCTAVE', 'number', 11)
-        self.parameters['OSC_2_SEMI'] = Parameter('OSC_2_SEMI', 'number', 23)
-        self.parameters['OSC_2_CENTS'] = Parameter('OSC_2_CENTS', 'number', 199)
-
-        self.parameters['OSC_SUB_SHAPE'] = Parameter('OSC_SUB_SHAPE')
-        self.parameters['OSC_SUB_GAIN'] = Parameter('OSC_SUB_GAIN')
-        self.parameters['OSC_SUB_OCTAVE'] = Parameter('OSC_SUB_OCTAVE', 'number', 11)
-
-        self.parameters['AMP_ENV_A'] = Parameter('AMP_ENV_A')
-        self.parameters['AMP_ENV_D'] = Parameter('AMP_ENV_D')
-        self.parameters['AMP_ENV_S'] = Parameter('AMP_ENV_S')
-        self.parameters['AMP_ENV_R'] = Parameter('AMP_ENV_R')
-
-        self.parameters['FILTER_ENV_A'] = Parameter('FILTER_ENV_A')
-        self.parameters['FILTER_ENV_D'] = Parameter('FILTER_ENV_D')
-        self.parameters['FILTER_ENV_S'] = Parameter('FILTER_ENV_S')
-        self.parameters['FILTER_ENV_R'] = Parameter('FILTER_ENV_R')
-
-        self.parameters['FILTER_1_CUTOFF'] = Parameter('FILTER_1_CUTOFF')
-        self.parameters['FILTER_1_Q'] = Parameter('FILTER_1_Q')
-        self.parameters['FILTER_1_ENV_AMT'] = Parameter('FILTER_1_ENV_AMT')
-        self.parameters['FILTER_1_MODE'] = Parameter('FILTER_1_MODE', 'number', 4)
-        self.parameters['FILTER_1_KEY_TRACK'] = Parameter('FILTER_1_KEY_TRACK')
-
-        self.parameters['SHAPER_MODE'] = Parameter('SHAPER_MODE', 'number', 4)
-        self.parameters['SHAPER_GAIN'] = Parameter('SHAPER_GAIN')
-        self.parameters['SHAPER_MIX'] = Parameter('SHAPER_MIX')
-
-        self.parameters['FILTER_2_CUTOFF'] = Parameter('FILTER_2_CUTOFF')
-        self.parameters['FILTER_2_Q'] = Parameter('FILTER_2_Q')
-        self.parameters['FILTER_2_ENV_AMT'] = Parameter('FILTER_2_ENV_AMT')
-        self.parameters['FILTER_2_MODE'] = Parameter('FILTER_2_MODE', 'number', 4)
-        self.parameters['FILTER_2_KEY_TRACK'] = Parameter('FILTER_2_KEY_TRACK')
-
-        self.parameters['CHORUS_DELAY'] = Parameter('CHORUS_DELAY')
-        self.parameters['CHORUS_RATE'] = Parameter('CHORUS_RATE')
-        self.parameters['CHORUS_DEPTH'] = Parameter('CHORUS_DEPTH')
-        self.parameters['CHORUS_WIDTH'] = Parameter('CHORUS_WIDTH')
-        self.parameters['CHORUS_MIX'] = Parameter('CHORUS_MIX')
-
-        self.parameters['DELAY_TIME'] = Parameter('DELAY_TIME')
-        self.parameters['DELAY_FEEDBACK'] = Parameter('DELAY_FEEDBACK')
-        self.parameters['DELAY_WIDTH'] = Parameter('DELAY_WIDTH')
-        self.parameters['DELAY_SEND'] = Parameter('DELAY_SEND')
-        self.parameters['DELAY_SYNC'] = Parameter('DELAY_SYNC', 'number', 2)
-
-        self.parameters['CONF_PITCH_BEND_RANGE'] = Parameter('CONF_PITCH_BEND_RANGE', 'number', 49)
-        self.parameters['CONF_UNISON_VOICES'] = Parameter('CONF_UNISON_VOICES', 'number', 8)
-        self.parameters['CONF_UNISON_DETUNE'] = Parameter('CONF_UNISON_DETUNE')
-        self.parameters['CONF_UNISON_WIDTH'] = Parameter('CONF_UNISON_WIDTH')
-        self.parameters['CONF_PORTAMENTO_TIME'] = Parameter('CONF_PORTAMENTO_TIME')
-        self.parameters['CONF_POLYPHONY'] = Parameter('CONF_POLYPHONY', 'number', 24)
-
-        self.parameters['MOD_WHEEL_TARGET_1'] = Parameter('MOD_WHEEL_TARGET_1', 'number', 48)
-        self.parameters['MOD_WHEEL_AMT_1'] = Parameter('MOD_WHEEL_AMT_1')
-        self.parameters['MOD_WHEEL_TARGET_2'] = Parameter('MOD_WHEEL_TARGET_2', 'number', 48)
-        self.parameters['MOD_WHEEL_AMT_2'] = Parameter('MOD_WHEEL_AMT_2')
-        self.parameters['MOD_WHEEL_TARGET_3'] = Parameter('MOD_WHEEL_TARGET_3', 'number', 48)
-        self.parameters['MOD_WHEEL_AMT_3'] = Parameter('MOD_WHEEL_AMT_3')
-
-        self.parameters['MOD_ENV_A'] = Parameter('MOD_ENV_A')
-        self.parameters['MOD_ENV_D'] = Parameter('MOD_ENV_D')
-        self.parameters['MOD_ENV_S'] = Parameter('MOD_ENV_S')
-        self.parameters['MOD_ENV_R'] = Parameter('MOD_ENV_R')
-
-        self.parameters['MOD_ENV_TARGET_1'] = Parameter('MOD_ENV_TARGET_1', 'number', 26)
-        self.parameters['MOD_ENV_AMT_1'] = Parameter('MOD_ENV_AMT_1')
-        self.parameters['MOD_ENV_TARGET_2'] = Parameter('MOD_ENV_TARGET_2', 'number', 26)
-        self.parameters['MOD_ENV_AMT_2'] = Parameter('MOD_ENV_AMT_2')
-        self.parameters['MOD_ENV_TARGET_3'] = Parameter('MOD_ENV_TARGET_3', 'number', 26)
-        self.parameters['MOD_ENV_AMT_3'] = Parameter('MOD_ENV_AMT_3')
-        self.parameters['MOD_ENV_DEPTH'] = Parameter('MOD_ENV_DEPTH')
-
-        self.parameters['VELOCITY_TARGET_1'] = Parameter('VELOCITY_TARGET_1', 'number', 39)
-        self.parameters['VELOCITY_AMT_1'] = Parameter('VELOCITY_AMT_1')
-        self.parameters['VELOCITY_TARGET_2'] = Parameter('VELOCITY_TARGET_2', 'number', 39)
-        self.parameters['VELOCITY_AMT_2'] = Parameter('VELOCITY_AMT_2')
-        self.parameters['VELOCITY_TARGET_3'] = Parameter('VELOCITY_TARGET_3', 'number', 39)
-        self.parameters['VELOCITY_AMT_3'] = Parameter('VELOCITY_AMT_3')
-
-        self.parameters['LFO_1_RATE'] = Parameter('LFO_1_RATE')
-        self.parameters['LFO_1_DEPTH'] = Parameter('LFO_1_DEPTH')
-        self.parameters['LFO_1_PHASE'] = Parameter('LFO_1_PHASE')
-        self.parameters['LFO_1_WAVEFORM'] = Parameter('LFO_1_WAVEFORM', 'number', 6)
-
-        self.parameters['LFO_1_TARGET_1'] = Parameter('LFO_1_TARGET_1', 'number', 23)
-        self.parameters['LFO_1_AMT_1'] = Parameter('LFO_1_AMT_1')
-        self.parameters['LFO_1_TARGET_2'] = Parameter('LFO_1_TARGET_2', 'number', 23)
-        self.parameters['LFO_1_AMT_2'] = Parameter('LFO_1_AMT_2')
-        self.parameters['LFO_1_TARGET_3'] = Parameter('LFO_1_TARGET_3', 'number', 23)
-        self.parameters['LFO_1_AMT_3'] = Parameter('LFO_1_AMT_3')
-        self.parameters['LFO_1_KEY_TRACK'] = Parameter('LFO_1_KEY_TRACK')
-
-        self.parameters['LFO_2_RATE'] = Parameter('LFO_2_RATE')
-        self.parameters['LFO_2_DEPTH'] = Parameter('LFO_2_DEPTH')
-        self.parameters['LFO_2_PHASE'] = Parameter('LFO_2_PHASE')
-        self.parameters['LFO_2_WAVEFORM'] = Parameter('LFO_2_WAVEFORM', 'number', 6)
-        self.parameters['LFO_2_SYNC'] = Parameter('LFO_2_SYNC', 'boolean')
-        self.parameters['LFO_2_SAMPLE_HOLD'] = Parameter('LFO_2_SAMPLE_HOLD', 'boolean')
-
-        self.parameters['LFO_2_TARGET_1'] = Parameter('LFO_2_TARGET_1', 'number', 46)
-        self.parameters['LFO_2_AMT_1'] = Parameter('LFO_2_AMT_1')
-        self.parameters['LFO_2_TARGET_2'] = Parameter('LFO_2_TARGET_2', 'number', 46)
-        self.parameters['LFO_2_AMT_2'] = Parameter('LFO_2_AMT_2')
-        self.parameters['LFO_2_TARGET_3'] = Parameter('LFO_2_TARGET_3', 'number', 46)
-        self.parameters['LFO_2_AMT_3'] = Parameter('LFO_2_AMT_3')
-
-        self.parameters['MASTER_GAIN'] = Parameter('MASTER_GAIN')
-        self.parameters['MASTER_LIMITER_ENABLED'] = Parameter('MASTER_LIMITER_ENABLED', 'boolean')
-        self.parameters['MASTER_EQ_GAIN_LOW'] = Parameter('MASTER_EQ_GAIN_LOW')
-        self.parameters['MASTER_EQ_GAIN_HIGH'] = Parameter('MASTER_EQ_GAIN_HIGH')
-        self.parameters['MASTER_EQ_FREQ_LOW'] = Parameter('MASTER_EQ_FREQ_LOW')
-        self.parameters['MASTER_EQ_FREQ_HIGH'] = Parameter('MASTER_EQ_FREQ_HIGH')
-
-        self.parameters['CONF_LEGATO'] = Parameter('CONF_LEGATO', 'boolean')
-        self.parameters['CONF_AUTO_GLIDE'] = Parameter('CONF_AUTO_GLIDE', 'boolean')
-
-        self.parameters['OSC_1_SYNC'] = Parameter('OSC_1_SYNC')
-        self.parameters['OSC_2_SYNC'] = Parameter('OSC_2_SYNC')
-
-        self.param_keys = self.parameters.keys()  # Mostly so we can access the ordered dict by index
-
-        # Treat these different - I believe these are Reason specific
-        self.delay_time_ms = Parameter('DELAY_TIME_MS')  # Derives from DELAY_TIME
-        self.delay_time_16 = Parameter('DELAY_TIME_16TH', 'number', 24)  # Derives from DELAY_TIME
-        self.lfo2_rate_free = Parameter('LFO_2_RATE_FREE')  # Derives from LFO_2_RATE
-        self.lfo2_rate_sync = Parameter('LFO_2_RATE_SYNC', 'number', 24)  # Derives from LFO_2_RATE
-
-        self.re_exclude_params = ['LFO_2_RATE', 'DELAY_TIME', 'MOD_ENV_DEPTH']
+    __slots__ = ('name', 'version', 'values')
 
-    def return_reason_data(self) -> bytes:
-        """
-        Return a bytes object of the Reason format
-        :return:
-        """
-
-        # Boilerplate
-        jukebox_patch = et.Element('JukeboxPatch', version='1.0')
+    re_exclude_params = RE_EXCLUDE_PARAMS
 
-        dnie = et.Element('DeviceNameInEnglish')
-        dnie.text = 'kiloHearts kHs ONE'
-        jukebox_patch.append(dnie)
+    def __init__(self, name: Union[str, None] = None, version: Union[int, None] = None) -> None:
+        self.name = name
+        self.version = version
+        self.values = _EMPTY_VALUES[:]
 
-        jbprops = et.Element('Properties', deviceProductID='com.kilohearts.khsONE', deviceVersion='0.0.1')
-        jbprops_o = et.Element('Object', name='custom_properties')
-        # End boilerplate
+    @property
+    def parameters(self) -> ParameterView:
+        return ParameterView(self.values)
 
-        # Reason special snowflakes
-        dt = self.parameters['DELAY_TIME']
-        l2r = self.parameters['LFO_2_RATE']
-        self.delay_time_ms.normalized_value = pow(dt.normalized_value, float(0.25))
-        self.delay_time_16.normalized_value = dt.normalized_value
-        self.lfo2_rate_free.normalized_value = l2r.normalized_value
-        self.lfo2_rate_sync.normalized_value = l2r.normalized_value
+    @property
+    def param_keys(self) -> Tuple[str, ...]:
+        return PARAMETER_NAMES
 
-        for pn, pd in self.parameters.items():
-            if pn not in self.re_exclude_params:
-                jbprops_o.append(pd.get_xml())
+    # Treat these different - I believe these are Reason specific
+    @property
+    def delay_time_ms(self) -> Parameter:
+        return Parameter.bind(DELAY_TIME_MS, self.values)  # Derives from DELAY_TIME
 
-        jbprops_o.append(self.delay_time_ms.get_xml())
-        jbprops_o.append(self.delay_time_16.get_xml())
-        jbprops_o.append(self.lfo2_rate_free.get_xml())
-        jbprops_o.append(self.lfo2_rate_sync.get_xml())
+    @property
+    def delay_time_16(self) -> Parameter:
+        return Parameter.bind(DELAY_TIME_16TH, self.values)  # Derives from DELAY_TIME
 
-        jbprops.append(jbprops_o)
-        jukebox_patch.append(jbprops)
+    @property
+    def lfo2_rate_free(self) -> Parameter:
+        return Parameter.bind(LFO_2_RATE_FREE, self.values)  # Derives from LFO_2_RATE
 
-        jbprops.append(jbprops_o)
-        jukebox_patch.append(jbprops)
+    @property
+    def lfo2_rate_sync(self) -> Parameter:
+        return Parameter.bind(LFO_2_RATE_SYNC, self.values)  # Derives from LFO_2_RATE
 
-        return_xml = b'<?xml version="1.0"?>\n'  # We have to do this because Reason can't handle single quotes
-        return_xml += et.tostring(jukebox_patch, encoding='UTF-8', xml_declaration=False, pretty_print=True)
-        return return_xml
+    def return_reason_data(self) -> bytes:
+        """
+        Return a bytes object of the Reason format
+        :return:
+        """
+        return render_reason(self.values)
 
     def return_au_data(self) -> bytes:
         """
         Return a bytes object of the AU format
         :return:
         """
-        dctyp = '<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">'
-        plist = et.Element('plist', version='1.0')
-
-        pld_dict = {
-            'manufacturer': ('integer', 543901811),
-            'name': ('string', self.name),
-            'subtype': ('integer', 1799910193),
-            'type': ('integer', 1635085685),
-            'version': ('integer', 1),
-            'vstdata': ('data', base64.b64encode(self.return_fxp_data()).decode('utf-8')),
-        }
-        pld = et.Element('dict')
-        for k, v in pld_dict.items():
-            t = et.Element('key')
-            t.text = k
-            pld.append(t)
-
-            t = et.Element(v[0])
-            t.text = str(v[1])
-            pld.append(t)
-
-        plist.append(pld)
+        return render_au(self.name, self.return_fxp_data())
 
-        return_xml = b'<?xml version="1.0" encoding="UTF-8"?>\n'
-        return_xml += et.tostring(plist, encoding='UTF-8', xml_declaration=False, pretty_print=True, doctype=dctyp)
-        return return_xml
-
-    def return_fxp_data(self) -> bytes:
+    def return_fxp_data(self) -> bytearray:
         """
         Return a bytes object of the FXP format
         :return:
         """
-        data = bytearray()
-        data += write_uint_b(convert_magic('FPCh'))
-        data += write_uint_b(1)
-        data += write_uint_b(convert_magic('kHs1'))
-        data += write_uint_b(self.version)
-        data += write_uint_b(len(self.parameters))
-
-        cropped_name = self.name[0:24] if len(self.name) >= 24 else self.name
-        data += cropped_name.encode('utf-8')
-        for x in range(0, 28 - len(cropped_name)):
-            data += b'\x00'  # Spoiler alert: I'm a dumbass and found out bytes(0) doesn't work like I expected...
-
-        chunk_data = self.return_fxp_param_chunk()
-        data += write_uint_b(len(chunk_data))
-        data += chunk_data
-
-        final_data = bytearray()
-        final_data += write_uint_b(convert_magic('CcnK'))
-        final_data += write_uint_b(len(data))
-        final_data += data
-
-        return final_data
-
-    def return_fxp_param_chunk(self) -> bytes:
+        writer = ByteWriter(FXP_HEADER.size + PARAM_CHUNK_SIZE)
+        writer.pack(FXP_HEADER, *fxp_header(self.version, name_field(self.name, FXP_NAME_SIZE)))
+        self.write_fxp_param_chunk(writer)
+        return writer.buffer
+
+    def return_fxp_param_chunk(self) -> bytearray:
         """
         Return a parameter chunk
         :return:
         """
-        data = bytearray()
-        data += write_uint_b(self.version, False)
-        data += write_uint_b(len(self.parameters), False)
-        for x in self.parameters.values():
-            data += struct.pack('<f', x.normalized_value)
+        writer = ByteWriter(PARAM_CHUNK_SIZE)
+        self.write_fxp_param_chunk(writer)
+        return writer.buffer
 
-        return data
+    def write_fxp_param_chunk(self, writer: ByteWriter) -> None:
+        """
+        Write a parameter chunk (PARAM_CHUNK_SIZE bytes) at the writer's cursor
+        :param writer:
+        :return:
+        """
+        writer.pack(PARAM_CHUNK_HEADER, self.version, PARAM_COUNT)
+        writer.pack(PARAM_VALUES, *self.values[:PARAM_COUNT])
 
-    def insert_param_chunk_into_fxp_preset(self, chunk_data: bytearray) -> bool:
+    def fxp_values(self) -> array:
+        """
+        The FXP params as float32, whichever buffer the preset has
+        :return:
+        """
+        values = self.values[:PARAM_COUNT]
+        return values if values.typecode == 'f' else array('f', values)
+
+    def insert_param_chunk_into_fxp_preset(self, chunk_data: BufferInput) -> bool:
         """
         Insert prameter chunk data into the preset. Bank originated
         :param chunk_data:
         :return:
         """
-        self.version = read_b_uint(chunk_data, False)
-        read_b_uint(chunk_data, False)  # param_count = read_b_uint(chunk_data, False)
-        for k in self.param_keys:
-            self.parameters[k].normalized_value = struct.unpack('<f', range_pop(chunk_data, 0, 4))[0]
+        reader = ByteReader(chunk_data)
+        if reader.remaining < PARAM_CHUNK_HEADER.size + PARAM_VALUES.size:
+            return False
+
+        self.version, _ = reader.unpack(PARAM_CHUNK_HEADER)  # version, param_count
+        self.values[:PARAM_COUNT] = array('f', reader.unpack(PARAM_VALUES))
 
         return True
 
 
-def process_fxp(preset_data: Union[Path, bytes], **kwargs) -> Union[Preset, None]:
+def process_fxp(preset_data: BufferInput, errors: Union[List[str], None] = None, **kwargs) -> Union[Preset, None]:
     """
     Parse an FXP Preset
     :param preset_data:
+    :param errors: Gets the reason code (see PARSE_ERRORS) added if the preset can't be read
     :return:
     """
-    preset = Preset()
+    reader = ByteReader(preset_data)
+    if reader.remaining < FXP_HEADER.size:
+        return parse_failed('truncated', errors)
 
-    if isinstance(preset_data, Path):
-        data = bytearray(preset_data.read_bytes())  # Now with 100% more mutability! Probably should bytestream it, tho
-    else:
-        data = bytearray(preset_data)  # I think Rush once said "Why does it happen? Because it happens: Roll the bones"
-
-    chunk_magic = read_b_uint(data)
-    read_b_uint(data)  # size = read_b_uint(data)
-    fx_magic = read_b_uint(data)
-    read_b_uint(data)  # format_version = read_b_uint(data)
-    fx_id = read_b_uint(data)
-    preset.version = read_b_uint(data)
-    read_b_uint(data)  # num_params = read_b_uint(data)
-    preset.name = range_pop(data, 0, 28).decode('utf-8')
-    chunk_size = read_b_uint(data)
-    chunk_data = range_pop(data, 0, chunk_size)
-
-    if chunk_magic != convert_magic('CcnK'):
-        print('Invalid chunkMagic')
-        return None
+    chunk_magic, _, fx_magic, _, fx_id, version, _, name, chunk_size = reader.unpack(FXP_HEADER)
 
-    if fx_magic != convert_magic('FPCh'):
-        print('Unsupported fxMagic')
-        return None
+    if chunk_magic != CHUNK_MAGIC:
+        return parse_failed('bad_chunk_magic', errors)
 
-    if fx_id != convert_magic('kHs1'):
-        print('Preset does not seem to be for kHs ONE')
-        return None
+    if fx_magic != FXP_MAGIC:
+        return parse_failed('bad_fx_magic', errors)
 
-    if preset.version < CURRENT_VERSION:
-        print('Presets saved with a version of kHs ONE earlier than 1.014 are not supported')
-        return None
+    if fx_id != KHS_ONE_ID:
+        return parse_failed('wrong_fx_id', errors)
 
-    if not preset.insert_param_chunk_into_fxp_preset(chunk_data):
-        print('Preset chunk data load failure')
-        return None
+    if version < CURRENT_VERSION:
+        return parse_failed('old_version', errors)
 
-    preset.name = preset.name.rstrip('\x00')
+    preset = Preset()
+    preset.version = version
+    if not preset.insert_param_chunk_into_fxp_preset(reader.read(chunk_size)):
+        return parse_failed('bad_param_chunk', errors)
+
+    preset.name = name.decode('utf-8', errors='replace').rstrip('\x00')
     return preset
 
 
-def process_re(preset_data: Union[Path, bytes], file_name: str = 'fake.reapatch', **kwargs) -> Union[Preset, None]:
+def _text_parser(param_type: str, steps: int = -1) -> Callable[[str], float]:
     """
-    Parse a Reason Preset
-    :param preset_data:
-    :param file_name:
+    Get a function that turns Reason value text into a normalized value
+    Same result as Parameter.set_formatted_value
+    :param param_type:
+    :param steps:
     :return:
     """
-    if isinstance(preset_data, Path):
-        data = bytearray(preset_data.read_bytes())  # Now with 100% more mutability! Probably should bytestream it, tho
-        file_name = preset_data.stem
-    else:
-        data = bytearray(preset_data)
-        file_name = file_name.split('.')[0]
+    if param_type == 'boolean':
+        return lambda text: float(1) if text == 'true' else float(0)
+    if steps != -1:
+        top_step = steps - 1
+        return lambda text: float(text) / top_step
+    return float
+
 
-    jukebox_xml = et.XML(data.decode('UTF-8'))
+_RE_VALUE_PARSERS = {spec.name: (spec.index, _text_parser(spec.param_type, spec.steps)) for spec in PARAMETER_SCHEMA}
+_RE_SOURCE_PARAMS = ('DELAY_TIME_16TH', 'DELAY_TIME_MS', 'LFO_2_RATE_SYNC', 'LFO_2_RATE_FREE')
+_RE_PRODUCT_ID = re.compile(rb'<Properties deviceProductID="([^"]*)"')
+_RE_VALUE = re.compile(rb'<Value property="([^"]*)" type="([^"]*)">([^<&]*)</Value>')
+_RE_VALUE_TAG = re.compile(rb'<Value\b')
+_RE_MARKUP_DECL = re.compile(rb'<!')
 
-    device_product_id = jukebox_xml[1].get('deviceProductID')
-    if device_product_id != 'com.kilohearts.khsONE':
-        print('Preset does not seem to be for kHs ONE')
+
+def _scan_re_values(data: BufferInput, values: MutableSequence) -> Union[Dict[str, float], None, bool]:
+    """
+    Pull a Reason patch's values straight into a value buffer with a scan over the raw bytes
+    Only works on files laid out the way Reason (and we) write them
+    :param data:
+    :param values:
+    :return: Same as _read_re_values, or False if the file needs a real XML parser
+    """
+    product_id = _RE_PRODUCT_ID.search(data)
+    matches = _RE_VALUE.findall(data)
+    if product_id is None or len(_RE_VALUE_TAG.findall(data)) != len(matches) or _RE_MARKUP_DECL.search(data):
+        return False  # Comments, CDATA, entities or a different layout. Let lxml deal with it
+
+    if product_id.group(1) != b'com.kilohearts.khsONE':
         return None
 
-    custom_properties = jukebox_xml[1][0]
+    xfer_values = {}
+    for param, param_type, text in matches:
+        param = param.decode('utf-8')
+        text = text.decode('utf-8')
+        if param in _RE_VALUE_PARSERS:
+            index, parser = _RE_VALUE_PARSERS[param]
+            values[index] = parser(text)
+        else:
+            xfer_values[param] = _text_parser(param_type.decode('utf-8'))(text)
+
+    return xfer_values
 
-    preset = Preset()
-    preset.name = file_name
-    preset.version = CURRENT_VERSION  # Because we don't have that information from the repatch file
-
-    dt16: Parameter
-    dtms: Parameter
-    l2rs: Parameter
-    l2rf: Parameter
-    xfer_params = {}
-    for x in custom_properties:
-        param = x.get('property')
-        if param in preset.parameters:
-            preset.parameters[param].set_formatted_value(x.text)
+
+def _read_re_values(source: Union[str, BinaryIO], values: MutableSequence) -> Union[Dict[str, float], None]:
+    """
+    Stream a Reason patch's values straight into a value buffer, one element at a time
+    :param source: A file name or file like object
+    :param values:
+    :return: The values of the properties that aren't FXP parameters, or None if it's not a kHs ONE patch
+    """
+    xfer_values = {}
+    seen_properties = False
+    for event, elem in etree().iterparse(source, events=('start', 'end'), tag=('Properties', 'Value'),
+                                         resolve_entities=False):
+        if elem.tag == 'Properties':
+            if event == 'start':
+                if elem.get('deviceProductID') != 'com.kilohearts.khsONE':
+                    return None
+                seen_properties = True
+            continue
+
+        if event != 'end':
+            continue
+
+        param = elem.get('property')
+        if param in _RE_VALUE_PARSERS:
+            index, parser = _RE_VALUE_PARSERS[param]
+            values[index] = parser(elem.text)
         else:
-            xfer_params[param] = Parameter(param, x.get('type'))
-            xfer_params[param].set_formatted_value(x.text)
-
-    dt16 = xfer_params['DELAY_TIME_16TH']
-    dtms = xfer_params['DELAY_TIME_MS']
-    if preset.parameters['DELAY_SYNC'].get_formatted_value():
-        preset.delay_time_16.set_formatted_value(dt16.get_formatted_value())
-        preset.parameters['DELAY_TIME'].set_formatted_value(dt16.get_formatted_value())
+            xfer_values[param] = _text_parser(elem.get('type'))(elem.text)
+
+        # Nothing needs the element after this, so don't let the tree grow
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    return xfer_values if seen_properties else None
+
+
+def process_re(preset_data: BufferInput, file_name: Union[str, None] = None,
+               errors: Union[List[str], None] = None, **kwargs) -> Union[Preset, None]:
+    """
+    Parse a Reason Preset
+    :param preset_data:
+    :param file_name: What the preset gets named after. Defaults to the path's name, if it's a path
+    :param errors: Gets the reason code (see PARSE_ERRORS) added if the preset can't be read
+    :return:
+    """
+    if file_name is None and isinstance(preset_data, os.PathLike):
+        file_name = os.path.splitext(os.path.basename(preset_data))[0]
     else:
-        preset.delay_time_ms.set_formatted_value(dtms.get_formatted_value())
-        preset.parameters['DELAY_TIME'].set_formatted_value(str(pow(dtms.normalized_value, float(4))))
-
-    l2rs = xfer_params['LFO_2_RATE_SYNC']
-    l2rf = xfer_params['LFO_2_RATE_FREE']
-    if preset.parameters['LFO_2_SYNC'].get_formatted_value():
-        preset.lfo2_rate_sync.set_formatted_value(l2rs.get_formatted_value())
-        preset.parameters['LFO_2_RATE'].set_formatted_value(l2rs.get_formatted_value())
+        file_name = (file_name or 'fake.reapatch').split('.')[0]
+    data = as_view(preset_data)
+
+    preset = Preset(file_name, CURRENT_VERSION)  # Because we don't have version information from the repatch file
+    preset.values = values = _EMPTY_TEXT_VALUES[:]
+
+    xfer_values = _scan_re_values(data, values)
+    if xfer_values is False:
+        xfer_values = _read_re_values(BytesIO(data), values)
+    if xfer_values is None:
+        return parse_failed('wrong_product_id', errors)
+
+    if any(p not in xfer_values for p in _RE_SOURCE_PARAMS):
+        return parse_failed('missing_properties', errors)
+
+    # These check the formatted value like they always have, which is a non-empty string. So truthy
+    delay_time = PARAMETER_INDEX['DELAY_TIME'].index
+    if value_formatter(PARAMETER_INDEX['DELAY_SYNC'])(values[PARAMETER_INDEX['DELAY_SYNC'].index]):
+        dt16 = xfer_values['DELAY_TIME_16TH']
+        values[DELAY_TIME_16TH.index] = dt16 / (DELAY_TIME_16TH.steps - 1)
+        values[delay_time] = dt16
     else:
-        preset.lfo2_rate_free.set_formatted_value(l2rf.get_formatted_value())
-        preset.parameters['LFO_2_RATE'].set_formatted_value(l2rf.get_formatted_value())
+        dtms = xfer_values['DELAY_TIME_MS']
+        values[DELAY_TIME_MS.index] = dtms
+        values[delay_time] = pow(dtms, float(4))
+
+    lfo2_rate = PARAMETER_INDEX['LFO_2_RATE'].index
+    if value_formatter(PARAMETER_INDEX['LFO_2_SYNC'])(values[PARAMETER_INDEX['LFO_2_SYNC'].index]):
+        l2rs = xfer_values['LFO_2_RATE_SYNC']
+        values[LFO_2_RATE_SYNC.index] = l2rs / (LFO_2_RATE_SYNC.steps - 1)
+        values[lfo2_rate] = l2rs
+    else:
+        l2rf = xfer_values['LFO_2_RATE_FREE']
+        values[LFO_2_RATE_FREE.index] = l2rf
+        values[lfo2_rate] = l2rf
 
     return preset
 
 
-def process_au(preset_data: Union[Path, bytes], **kwargs) -> Union[Preset, None]:
+def process_re_batch(preset_files: Iterable[Union[os.PathLike, Tuple[BufferInput, str]]],
+                     **kwargs) -> Iterator[Union[Preset, None]]:
+    """
+    Parse a bunch of Reason Presets, one at a time
+    :param preset_files: Paths, or (data, file_name) pairs
+    :return:
+    """
+    for preset_file in preset_files:
+        if isinstance(preset_file, os.PathLike):
+            yield process_re(preset_file)
+        else:
+            preset_data, file_name = preset_file
+            yield process_re(preset_data, file_name=file_name)
+
+
+def process_au(preset_data: BufferInput, errors: Union[List[str], None] = None, **kwargs) -> Union[Preset, None]:
     """
     Parse an AU Preset
     :param preset_data:
+    :param errors: Gets the reason code (see PARSE_ERRORS) added if the preset can't be read
     :return:
     """
-    if isinstance(preset_data, Path):
-        data = bytearray(preset_data.read_bytes())  # Now with 100% more mutability! Probably should bytestream it, tho
-    else:
-        data = bytearray(preset_data)
+    au_values = find_au_values(preset_data, ('subtype', 'name', 'vstdata'))
+    if 'subtype' not in au_values or int(au_values['subtype']) != KHS_ONE_ID:
+        return parse_failed('wrong_subtype', errors)
 
-    xml_data = et.XML(data.decode('UTF-8'))
-    fx_id = int(find_au_value(xml_data, 'subtype').text)
-    if fx_id != convert_magic('kHs1'):
-        print('Preset does not appear to be for kHs ONE')
-        return None
+    if 'vstdata' not in au_values:
+        return parse_failed('no_vstdata', errors)
 
-    fxp_data = base64.b64decode(find_au_value(xml_data, 'vstdata').text, validate=True)
+    # Plist data is usually wrapped over a few lines
+    fxp_data = base64.b64decode(''.join(au_values['vstdata'].split()), validate=True)
 
-    preset = process_fxp(fxp_data)
+    preset = process_fxp(fxp_data, errors=errors)
 
     if isinstance(preset, Preset):
-        preset.name = find_au_value(xml_data, 'name').text
+        preset.name = au_values.get('name', preset.name)
         return preset
 
     return None
@@ -0,0 +1,148 @@
+"""
+Text format (Reason and AU) rendering
+
+Output is identical to what lxml's pretty printer gives for these documents, but it's filled into
+precompiled templates rather than building an element tree for every export
+"""
+from .schema import ParameterSpec, PARAMETER_SCHEMA, PARAMETER_INDEX, REASON_SCHEMA, RE_EXCLUDE_PARAMS
+from typing import Callable, MutableSequence, Tuple
+import base64
+import re
+
+Formatter = Callable[[float], str]
+
+# Characters XML can't have at all, escaped or not. lxml refuses to write them
+_XML_INCOMPATIBLE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def _format_boolean(value: float) -> str:
+    return 'true' if value > float(0.5) else 'false'
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if value % 1 == 0 else str(value)
+
+
+def _stepped_formatter(steps: int) -> Formatter:
+    top_step = steps - 1
+
+    def format_stepped(value: float) -> str:
+        return str(round(value * top_step))
+
+    return format_stepped
+
+
+def value_formatter(spec: ParameterSpec) -> Formatter:
+    """
+    Get a function that turns a normalized value into the text Reason expects for the parameter
+    Same result as Parameter.get_xml's text
+    :param spec:
+    :return:
+    """
+    if spec.param_type == 'boolean':
+        return _format_boolean
+    if spec.steps != -1:
+        return _stepped_formatter(spec.steps)
+    return _format_number
+
+
+def xml_compatible(text: str) -> bool:
+    """
+    Whether text can go in an XML document at all
+    :param text:
+    :return:
+    """
+    return _XML_INCOMPATIBLE.search(text) is None
+
+
+def escape_text(text: str) -> str:
+    """
+    Escape element text the way lxml does. Raises ValueError, same as lxml, for text that can't be in XML at all
+    :param text:
+    :return:
+    """
+    if not xml_compatible(text):
+        raise ValueError('All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters')
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#13;')
+
+
+def _value_fields(schema: Tuple[ParameterSpec, ...]) -> Tuple[Tuple[str, Formatter, int], ...]:
+    return tuple((f'      <Value property="{spec.name}" type="{spec.param_type}">', value_formatter(spec), spec.index)
+                 for spec in schema if spec.name not in RE_EXCLUDE_PARAMS)
+
+
+REASON_HEAD = (
+    '<?xml version="1.0"?>\n'  # Reason can't handle single quotes, so no lxml generated declaration
+    '<JukeboxPatch version="1.0">\n'
+    '  <DeviceNameInEnglish>kiloHearts kHs ONE</DeviceNameInEnglish>\n'
+    '  <Properties deviceProductID="com.kilohearts.khsONE" deviceVersion="0.0.1">\n'
+    '    <Object name="custom_properties">\n'
+)
+REASON_TAIL = (
+    '    </Object>\n'
+    '  </Properties>\n'
+    '</JukeboxPatch>\n'
+)
+REASON_VALUE_FIELDS = _value_fields(PARAMETER_SCHEMA)
+REASON_DERIVED_FIELDS = _value_fields(REASON_SCHEMA)
+
+_DELAY_TIME = PARAMETER_INDEX['DELAY_TIME'].index
+_LFO_2_RATE = PARAMETER_INDEX['LFO_2_RATE'].index
+
+AU_HEAD = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">\n'
+    b'<plist version="1.0">\n'
+    b'  <dict>\n'
+    b'    <key>manufacturer</key>\n'
+    b'    <integer>543901811</integer>\n'
+    b'    <key>name</key>\n'
+    b'    <string>'
+)
+AU_MIDDLE = (
+    b'</string>\n'
+    b'    <key>subtype</key>\n'
+    b'    <integer>1799910193</integer>\n'
+    b'    <key>type</key>\n'
+    b'    <integer>1635085685</integer>\n'
+    b'    <key>version</key>\n'
+    b'    <integer>1</integer>\n'
+    b'    <key>vstdata</key>\n'
+    b'    <data>'
+)
+AU_TAIL = (
+    b'</data>\n'
+    b'  </dict>\n'
+    b'</plist>\n'
+)
+
+
+def render_reason(values: MutableSequence) -> bytes:
+    """
+    Render a preset's value buffer as a Reason patch
+    :param values:
+    :return:
+    """
+    # Reason special snowflakes. Derived at full precision
+    dt = values[_DELAY_TIME]
+    l2r = values[_LFO_2_RATE]
+    derived = (pow(dt, float(0.25)), dt, l2r, l2r)
+
+    parts = [REASON_HEAD]
+    for prefix, fmt, index in REASON_VALUE_FIELDS:
+        parts += (prefix, fmt(values[index]), '</Value>\n')
+    for (prefix, fmt, _), value in zip(REASON_DERIVED_FIELDS, derived):
+        parts += (prefix, fmt(value), '</Value>\n')
+    parts.append(REASON_TAIL)
+
+    return ''.join(parts).encode('utf-8')
+
+
+def render_au(name: str, fxp_data: bytes) -> bytes:
+    """
+    Render an AU preset wrapping some FXP data
+    :param name:
+    :param fxp_data:
+    :return:
+    """
+    return b''.join((AU_HEAD, escape_text(name).encode('utf-8'), AU_MIDDLE, base64.b64encode(fxp_data), AU_TAIL))
@@ -0,0 +1,184 @@
+"""
+The kHs ONE parameter schema
+
+Parameter names, types and step counts never change between presets, so they live here once
+and presets only carry their values
+"""
+from .utils import PARAM_COUNT
+from typing import Dict, NamedTuple, Tuple
+
+
+SCHEMA_VERSION = 1  # Bump whenever parameters get added, removed or reordered
+
+
+class ParameterSpec(NamedTuple):
+    """
+    Static description of a parameter
+    """
+    name: str
+    param_type: str = 'number'
+    steps: int = -1
+    index: int = -1
+
+
+def _build_schema(definitions: tuple, start: int = 0) -> Tuple[ParameterSpec, ...]:
+    """
+    Number up the parameter definitions
+    :param definitions:
+    :param start:
+    :return:
+    """
+    return tuple(ParameterSpec(*d, index=i) for i, d in enumerate(definitions, start))
+
+
+# In FXP param chunk order
+PARAMETER_SCHEMA = _build_schema((
+    ('OSC_1_WAVEFORM', 'number', 3),
+    ('OSC_1_GAIN',),
+    ('OSC_1_PW',),
+    ('OSC_1_OCTAVE', 'number', 11),
+    ('OSC_1_SEMI', 'number', 23),
+    ('OSC_1_CENTS', 'number', 199),
+
+    ('OSC_2_WAVEFORM', 'number', 3),
+    ('OSC_2_GAIN',),
+    ('OSC_2_PW',),
+    ('OSC_2_OCTAVE', 'number', 11),
+    ('OSC_2_SEMI', 'number', 23),
+    ('OSC_2_CENTS', 'number', 199),
+
+    ('OSC_SUB_SHAPE',),
+    ('OSC_SUB_GAIN',),
+    ('OSC_SUB_OCTAVE', 'number', 11),
+
+    ('AMP_ENV_A',),
+    ('AMP_ENV_D',),
+    ('AMP_ENV_S',),
+    ('AMP_ENV_R',),
+
+    ('FILTER_ENV_A',),
+    ('FILTER_ENV_D',),
+    ('FILTER_ENV_S',),
+    ('FILTER_ENV_R',),
+
+    ('FILTER_1_CUTOFF',),
+    ('FILTER_1_Q',),
+    ('FILTER_1_ENV_AMT',),
+    ('FILTER_1_MODE', 'number', 4),
+    ('FILTER_1_KEY_TRACK',),
+
+    ('SHAPER_MODE', 'number', 4),
+    ('SHAPER_GAIN',),
+    ('SHAPER_MIX',),
+
+    ('FILTER_2_CUTOFF',),
+    ('FILTER_2_Q',),
+    ('FILTER_2_ENV_AMT',),
+    ('FILTER_2_MODE', 'number', 4),
+    ('FILTER_2_KEY_TRACK',),
+
+    ('CHORUS_DELAY',),
+    ('CHORUS_RATE',),
+    ('CHORUS_DEPTH',),
+    ('CHORUS_WIDTH',),
+    ('CHORUS_MIX',),
+
+    ('DELAY_TIME',),
+    ('DELAY_FEEDBACK',),
+    ('DELAY_WIDTH',),
+    ('DELAY_SEND',),
+    ('DELAY_SYNC', 'number', 2),
+
+    ('CONF_PITCH_BEND_RANGE', 'number', 49),
+    ('CONF_UNISON_VOICES', 'number', 8),
+    ('CONF_UNISON_DETUNE',),
+    ('CONF_UNISON_WIDTH',),
+    ('CONF_PORTAMENTO_TIME',),
+    ('CONF_POLYPHONY', 'number', 24),
+
+    ('MOD_WHEEL_TARGET_1', 'number', 48),
+    ('MOD_WHEEL_AMT_1',),
+    ('MOD_WHEEL_TARGET_2', 'number', 48),
+    ('MOD_WHEEL_AMT_2',),
+    ('MOD_WHEEL_TARGET_3', 'number', 48),
+    ('MOD_WHEEL_AMT_3',),
+
+    ('MOD_ENV_A',),
+    ('MOD_ENV_D',),
+    ('MOD_ENV_S',),
+    ('MOD_ENV_R',),
+
+    ('MOD_ENV_TARGET_1', 'number', 26),
+    ('MOD_ENV_AMT_1',),
+    ('MOD_ENV_TARGET_2', 'number', 26),
+    ('MOD_ENV_AMT_2',),
+    ('MOD_ENV_TARGET_3', 'number', 26),
+    ('MOD_ENV_AMT_3',),
+    ('MOD_ENV_DEPTH',),
+
+    ('VELOCITY_TARGET_1', 'number', 39),
+    ('VELOCITY_AMT_1',),
+    ('VELOCITY_TARGET_2', 'number', 39),
+    ('VELOCITY_AMT_2',),
+    ('VELOCITY_TARGET_3', 'number', 39),
+    ('VELOCITY_AMT_3',),
+
+    ('LFO_1_RATE',),
+    ('LFO_1_DEPTH',),
+    ('LFO_1_PHASE',),
+    ('LFO_1_WAVEFORM', 'number', 6),
+
+    ('LFO_1_TARGET_1', 'number', 23),
+    ('LFO_1_AMT_1',),
+    ('LFO_1_TARGET_2', 'number', 23),
+    ('LFO_1_AMT_2',),
+    ('LFO_1_TARGET_3', 'number', 23),
+    ('LFO_1_AMT_3',),
+    ('LFO_1_KEY_TRACK',),
+
+    ('LFO_2_RATE',),
+    ('LFO_2_DEPTH',),
+    ('LFO_2_PHASE',),
+    ('LFO_2_WAVEFORM', 'number', 6),
+    ('LFO_2_SYNC', 'boolean'),
+    ('LFO_2_SAMPLE_HOLD', 'boolean'),
+
+    ('LFO_2_TARGET_1', 'number', 46),
+    ('LFO_2_AMT_1',),
+    ('LFO_2_TARGET_2', 'number', 46),
+    ('LFO_2_AMT_2',),
+    ('LFO_2_TARGET_3', 'number', 46),
+    ('LFO_2_AMT_3',),
+
+    ('MASTER_GAIN',),
+    ('MASTER_LIMITER_ENABLED', 'boolean'),
+    ('MASTER_EQ_GAIN_LOW',),
+    ('MASTER_EQ_GAIN_HIGH',),
+    ('MASTER_EQ_FREQ_LOW',),
+    ('MASTER_EQ_FREQ_HIGH',),
+
+    ('CONF_LEGATO', 'boolean'),
+    ('CONF_AUTO_GLIDE', 'boolean'),
+
+    ('OSC_1_SYNC',),
+    ('OSC_2_SYNC',),
+))
+
+# Treat these different - I believe these are Reason specific
+REASON_SCHEMA = _build_schema((
+    ('DELAY_TIME_MS',),  # Derives from DELAY_TIME
+    ('DELAY_TIME_16TH', 'number', 24),  # Derives from DELAY_TIME
+    ('LFO_2_RATE_FREE',),  # Derives from LFO_2_RATE
+    ('LFO_2_RATE_SYNC', 'number', 24),  # Derives from LFO_2_RATE
+), start=len(PARAMETER_SCHEMA))
+
+PARAMETER_NAMES: Tuple[str, ...] = tuple(p.name for p in PARAMETER_SCHEMA)
+PARAMETER_INDEX: Dict[str, ParameterSpec] = {p.name: p for p in PARAMETER_SCHEMA}
+VALUE_COUNT = len(PARAMETER_SCHEMA) + len(REASON_SCHEMA)  # Slots in a preset's value buffer
+
+DELAY_TIME_MS, DELAY_TIME_16TH, LFO_2_RATE_FREE, LFO_2_RATE_SYNC = REASON_SCHEMA
+
+RE_EXCLUDE_PARAMS = frozenset(('LFO_2_RATE', 'DELAY_TIME', 'MOD_ENV_DEPTH'))
+
+if len(PARAMETER_SCHEMA) != PARAM_COUNT:
+    raise Exception(f'Parameter schema has {len(PARAMETER_SCHEMA)} entries. Expected {PARAM_COUNT}')
@@ -0,0 +1,364 @@
+"""
+Preset similarity search
+
+Every preset is a fixed vector of 108 normalized values, so a library of them is a float32 matrix and finding similar
+sounds is a nearest neighbour search over it. Continuous parameters are compared by value. Categorical ones
+(waveforms, modes, modulation targets, switches) are either the same or they aren't: sine is no closer to triangle
+than it is to square.
+
+Optional. Requires NumPy
+"""
+from .preset import Preset
+from .schema import PARAMETER_SCHEMA
+from .utils import PARAM_COUNT
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError as e:  # pragma: no cover
+    raise ImportError('Preset similarity search requires numpy. Install it with: pip install numpy') from e
+
+INDEX_VERSION = 1
+ONE_HOT_QUERIES = 16  # Query batches at least this big match categories with a matrix product
+RERANK_SLACK = 16  # Extra candidates to re-rank by exact distance, for ones the rounding error put just out of the k
+# The matrix product distances are float32 sums of big terms, so they're only good to about this much of the squared
+# norms involved. Anything within that of a radius gets its exact distance checked
+ROUNDING_MARGIN = 1e-4
+
+# Stepped parameters whose steps are categories rather than amounts. Octaves, voices and the like stay continuous
+CATEGORICAL_PARAMS = frozenset(
+    spec.name for spec in PARAMETER_SCHEMA
+    if spec.param_type == 'boolean'
+    or spec.steps != -1 and (spec.name.endswith(('_WAVEFORM', '_MODE', '_SYNC')) or '_TARGET_' in spec.name)
+)
+
+QueryInput = Union['Preset', Iterable['Preset'], np.ndarray]
+
+
+class PresetIndex:
+    """
+    A searchable library of presets
+    """
+    def __init__(self, categorical_weight: float = 1.0, weights: Union[Dict[str, float], None] = None) -> None:
+        """
+        Construct an empty index
+        :param categorical_weight: Distance a mismatched categorical parameter adds. A continuous parameter going
+        from one end of its range to the other adds 1
+        :param weights: Per parameter weights, by name, instead of 1 (or categorical_weight)
+        """
+        self.categorical_weight = categorical_weight
+        self.weights = dict(weights or {})
+
+        continuous = [spec for spec in PARAMETER_SCHEMA if spec.name not in CATEGORICAL_PARAMS]
+        categorical = [spec for spec in PARAMETER_SCHEMA if spec.name in CATEGORICAL_PARAMS]
+        self._cont_index = np.array([spec.index for spec in continuous], dtype=np.intp)
+        self._cont_weight = np.array([self.weights.get(spec.name, 1.0) for spec in continuous], dtype=np.float32)
+        self._cat_index = np.array([spec.index for spec in categorical], dtype=np.intp)
+        self._cat_top = np.array([spec.steps - 1 if spec.steps != -1 else 1 for spec in categorical],
+                                 dtype=np.float32)
+        self._cat_boolean = np.array([spec.param_type == 'boolean' for spec in categorical])
+        self._cat_weight2 = np.square(np.array([self.weights.get(spec.name, categorical_weight)
+                                                for spec in categorical], dtype=np.float32))
+        # Where each categorical parameter's categories start in a one hot row
+        self._cat_offsets = np.concatenate(([0], np.cumsum(self._cat_top + 1)[:-1])).astype(np.intp)
+        self._cat_width = int((self._cat_top + 1).sum())
+
+        self.values = np.zeros((0, PARAM_COUNT), dtype=np.float32)
+        self.names: List[str] = []
+        self._features = np.zeros((0, len(continuous)), dtype=np.float32)
+        self._sq_norms = np.zeros(0, dtype=np.float32)
+        self._codes = np.zeros((0, len(categorical)), dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _encode(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Split values into weighted continuous features (and their squared norms) and categorical codes
+        :param values: (N, 108)
+        :return:
+        """
+        features = values[:, self._cont_index] * self._cont_weight
+        cat_values = values[:, self._cat_index]
+        codes = np.where(self._cat_boolean, cat_values > 0.5, np.rint(cat_values * self._cat_top))
+        # Steps past the last category count as the last one, the same in the candidate search and the rerank
+        codes = np.clip(codes, 0, self._cat_top).astype(np.uint8)
+        return features, np.einsum('ij,ij->i', features, features), codes
+
+    @staticmethod
+    def _as_values(presets: QueryInput) -> np.ndarray:
+        """
+        Get an (N, 108) float32 matrix from presets or values
+        :param presets:
+        :return:
+        """
+        if isinstance(presets, Preset):
+            presets = [presets]
+        if isinstance(presets, np.ndarray):
+            values = np.asarray(presets, dtype=np.float32)
+            return values.reshape(1, -1) if values.ndim == 1 else values
+
+        rows = [np.frombuffer(p.fxp_values(), dtype=np.float32) for p in presets if p is not None]
+        return np.stack(rows) if rows else np.zeros((0, PARAM_COUNT), dtype=np.float32)
+
+    def add_values(self, values: np.ndarray, names: Sequence[str]) -> None:
+        """
+        Add presets by their values
+        :param values: (N, 108)
+        :param names:
+        :return:
+        """
+        values = self._as_values(values)
+        if len(values) != len(names):
+            raise ValueError('Need a name for every row of values')
+
+        features, sq_norms, codes = self._encode(values)
+        self.values = np.concatenate((self.values, values))
+        self._features = np.concatenate((self._features, features))
+        self._sq_norms = np.concatenate((self._sq_norms, sq_norms))
+        self._codes = np.concatenate((self._codes, codes))
+        self.names.extend(names)
+
+    def add(self, presets: Iterable['Preset']) -> None:
+        """
+        Add presets, straight from any of the process_* parsers. Failed parses (None) are skipped
+        :param presets:
+        :return:
+        """
+        presets = [p for p in presets if p is not None]
+        self.add_values(self._as_values(presets), [p.name for p in presets])
+
+    @classmethod
+    def from_presets(cls, presets: Iterable['Preset'], **kwargs) -> 'PresetIndex':
+        index = cls(**kwargs)
+        index.add(presets)
+        return index
+
+    def _one_hot(self, codes: np.ndarray, weighted: bool = False) -> np.ndarray:
+        """
+        Categorical codes as one hot rows, so counting matches between two sets of them is a matrix product
+        :param codes: (N, categorical parameter count)
+        :param weighted: Use each parameter's squared weight instead of 1
+        :return: (N, total categories)
+        """
+        one_hot = np.zeros((len(codes), self._cat_width), dtype=np.float32)
+        columns = self._cat_offsets + codes
+        one_hot[np.arange(len(codes))[:, None], columns] = self._cat_weight2 if weighted else 1
+        return one_hot
+
+    def _distances(self, features: np.ndarray, sq_norms: np.ndarray, codes: np.ndarray,
+                   query_one_hot: Union[np.ndarray, None], start: int, stop: int) -> np.ndarray:
+        """
+        Squared distances from some queries to a slice of the index
+        Every mismatched categorical parameter adds its weight squared. Few queries compare codes column by column,
+        lots of them count matches with a matrix product (all the weights, less the ones that match)
+        :return: (Q, stop - start)
+        """
+        d2 = features @ self._features[start:stop].T
+        if query_one_hot is not None:
+            d2 += query_one_hot @ self._one_hot(self._codes[start:stop]).T
+        d2 *= -2
+        d2 += sq_norms[:, None]
+        d2 += self._sq_norms[None, start:stop]
+
+        if query_one_hot is not None:
+            d2 += self._cat_weight2.sum()
+        else:
+            index_codes = self._codes[start:stop]
+            for column, weight2 in enumerate(self._cat_weight2):
+                d2 += weight2 * (codes[:, column, None] != index_codes[None, :, column])
+        return np.maximum(d2, 0, out=d2)
+
+    def _exact_distances(self, features: np.ndarray, codes: np.ndarray, query_rows: np.ndarray,
+                         index_rows: np.ndarray) -> np.ndarray:
+        """
+        Distances between query rows and index rows, pair by pair. Worked out from the differences in float64, so
+        they don't have the matrix product's rounding error (a preset is exactly 0 from itself)
+        :param features:
+        :param codes:
+        :param query_rows:
+        :param index_rows: Same shape as query_rows
+        :return: Same shape as query_rows
+        """
+        diff = features[query_rows].astype(np.float64) - self._features[index_rows]
+        d2 = np.einsum('...j,...j->...', diff, diff)
+        d2 += (codes[query_rows] != self._codes[index_rows]) @ self._cat_weight2.astype(np.float64)
+        return np.sqrt(d2)
+
+    def search(self, presets: QueryInput, k: int = 10,
+               chunk_size: int = 8192) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest presets in the index to each query
+        :param presets: Presets or (Q, 108) values
+        :param k:
+        :param chunk_size: Index rows to compare against at once. Bounds memory to about Q * chunk_size floats
+        :return: (Q, k) distances and (Q, k) indices, nearest first
+        """
+        features, sq_norms, codes = self._encode(self._as_values(presets))
+        query_one_hot = None
+        if len(codes) >= ONE_HOT_QUERIES:
+            query_one_hot = self._one_hot(codes, weighted=True) / 2  # Halved to go in with the -2 of the features
+        wanted = min(k, len(self))
+        k = min(k + RERANK_SLACK, len(self))
+        best_d2 = np.zeros((len(features), 0), dtype=np.float32)
+        best_index = np.zeros((len(features), 0), dtype=np.intp)
+
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            d2 = self._distances(features, sq_norms, codes, query_one_hot, start, stop)
+            if stop - start > k:
+                part = np.argpartition(d2, k - 1, axis=1)[:, :k]
+                d2 = np.take_along_axis(d2, part, axis=1)
+            else:
+                part = np.broadcast_to(np.arange(stop - start), d2.shape)
+            best_d2 = np.concatenate((best_d2, d2), axis=1)
+            best_index = np.concatenate((best_index, part + start), axis=1)
+
+        # Candidates by the fast distances, ranked by the exact ones
+        order = np.argsort(best_d2, axis=1, kind='stable')[:, :k]
+        candidates = np.take_along_axis(best_index, order, axis=1)
+        query_rows = np.broadcast_to(np.arange(len(features))[:, None], candidates.shape)
+        distances = self._exact_distances(features, codes, query_rows, candidates)
+        order = np.argsort(distances, axis=1, kind='stable')[:, :wanted]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+    def within(self, presets: QueryInput, radius: float,
+               chunk_size: int = 8192) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """
+        Find every preset in the index at most radius from each query, however many there are
+        :param presets: Presets or (Q, 108) values
+        :param radius:
+        :param chunk_size: Index rows to compare against at once. Queries are taken a block at a time too, so memory
+            stays at about chunk_size * 512 floats
+        :return: Distances and indices for each query, nearest first
+        """
+        features, sq_norms, codes = self._encode(self._as_values(presets))
+        found: List[List[Tuple[np.ndarray, np.ndarray]]] = [[] for _ in range(len(features))]
+        block_size = max(ONE_HOT_QUERIES, (1 << 22) // max(chunk_size, 1))
+        radius2 = radius * radius
+        for block_start in range(0, len(features), block_size):
+            block = slice(block_start, block_start + block_size)
+            block_codes = codes[block]
+            query_one_hot = None
+            if len(block_codes) >= ONE_HOT_QUERIES:
+                query_one_hot = self._one_hot(block_codes, weighted=True) / 2
+            for start in range(0, len(self), chunk_size):
+                stop = min(start + chunk_size, len(self))
+                d2 = self._distances(features[block], sq_norms[block], block_codes, query_one_hot, start, stop)
+                margin = ROUNDING_MARGIN * (sq_norms[block, None] + self._sq_norms[None, start:stop] + 1)
+                query_rows, index_rows = np.nonzero(d2 <= radius2 + margin)
+                query_rows += block_start
+                index_rows += start
+                distances = self._exact_distances(features, codes, query_rows, index_rows)
+                close = distances <= radius
+                query_rows, index_rows, distances = query_rows[close], index_rows[close], distances[close]
+                for q in np.unique(query_rows).tolist():
+                    mine = query_rows == q
+                    found[q].append((distances[mine], index_rows[mine]))
+
+        all_distances, all_indices = [], []
+        for parts in found:
+            distances = np.concatenate([d for d, _ in parts]) if parts else np.zeros(0)
+            indices = np.concatenate([i for _, i in parts]) if parts else np.zeros(0, dtype=np.intp)
+            order = np.lexsort((indices, distances))
+            all_distances.append(distances[order])
+            all_indices.append(indices[order])
+        return all_distances, all_indices
+
+    def similar(self, preset: 'Preset', k: int = 10) -> List[Tuple[int, str, float]]:
+        """
+        The k presets most like one preset
+        :param preset:
+        :param k:
+        :return: Index, name and distance of each, nearest first
+        """
+        distances, indices = self.search(preset, k)
+        return [(int(i), self.names[i], float(d)) for d, i in zip(distances[0], indices[0])]
+
+    def _row_keys(self, values: np.ndarray) -> List[bytes]:
+        return [row.tobytes() for row in np.ascontiguousarray(values, dtype='<f4')]
+
+    def exact_matches(self, presets: QueryInput) -> List[List[int]]:
+        """
+        Presets in the index with exactly the same values as each query (names don't count)
+        :param presets:
+        :return: Indices, per query
+        """
+        by_key: Dict[bytes, List[int]] = {}
+        for i, key in enumerate(self._row_keys(self.values)):
+            by_key.setdefault(key, []).append(i)
+        return [by_key.get(key, []) for key in self._row_keys(self._as_values(presets))]
+
+    def duplicate_groups(self) -> List[List[int]]:
+        """
+        Groups of presets in the index that are exact duplicates of each other
+        :return: Indices of each group of two or more, in index order
+        """
+        if not len(self):
+            return []
+        rows = np.ascontiguousarray(self.values).view(np.dtype((np.void, PARAM_COUNT * 4))).ravel()
+        _, inverse, counts = np.unique(rows, return_inverse=True, return_counts=True)
+        groups: Dict[int, List[int]] = {}
+        for i, group in enumerate(inverse.ravel()):
+            if counts[group] > 1:
+                groups.setdefault(int(group), []).append(i)
+        return sorted(groups.values())
+
+    def save(self, path: Union[Path, str]) -> None:
+        """
+        Save the index (uncompressed, so loading is just a read)
+        :param path:
+        :return:
+        """
+        weight_names = np.array(list(self.weights), dtype=str)
+        with open(path, 'wb') as f:
+            np.savez(f, version=np.array(INDEX_VERSION), values=self.values, names=np.array(self.names, dtype=str),
+                     categorical_weight=np.array(self.categorical_weight), weight_names=weight_names,
+                     weight_values=np.array([self.weights[n] for n in weight_names], dtype=np.float64))
+
+    @classmethod
+    def load(cls, path: Union[Path, str]) -> 'PresetIndex':
+        with np.load(path, allow_pickle=False) as saved:
+            if int(saved['version']) != INDEX_VERSION:
+                raise ValueError(f'Unsupported preset index version {int(saved["version"])}')
+            weights = dict(zip(saved['weight_names'].tolist(), saved['weight_values'].tolist()))
+            index = cls(float(saved['categorical_weight']), weights)
+            index.add_values(saved['values'], saved['names'].tolist())
+        return index
+
+
+def unique_presets(presets: Iterable['Preset'], tolerance: float = 0.0, **kwargs) -> List['Preset']:
+    """
+    Drop duplicate presets, keeping the first of each. Handy when importing banks padded out with Init Patches
+    With a tolerance, presets chained together by being within it of each other all count as one
+    :param presets:
+    :param tolerance: Presets at most this far apart count as duplicates. 0 for exact duplicates only
+    :param kwargs: Passed on to PresetIndex, for weights
+    :return:
+    """
+    presets = [p for p in presets if p is not None]
+    index = PresetIndex.from_presets(presets, **kwargs)
+
+    if tolerance <= 0:
+        first = {}
+        for i, key in enumerate(index._row_keys(index.values)):
+            first.setdefault(key, i)
+        return [presets[i] for i in sorted(first.values())]
+
+    # Union find over every pair within tolerance. Each group is represented by its first preset
+    parent = list(range(len(presets)))
+
+    def root(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    _, neighbours = index.within(index.values, tolerance)
+    for i, close in enumerate(neighbours):
+        for j in close.tolist():
+            a, b = root(i), root(j)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+    return [p for i, p in enumerate(presets) if root(i) == i]
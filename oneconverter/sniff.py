@@ -0,0 +1,138 @@
+"""
+Working out what a file is from its first few hundred bytes
+
+Good for picking the parser when nobody said what the format is, for turning away foreign and old files before
+they get anywhere near a parser, and for classifying lots of files without reading all of them.
+It only looks at headers, so passing doesn't guarantee a file will parse. Failing does mean it won't
+"""
+from .binary import BufferInput, FXB_HEADER, FXP_HEADER, PARAM_CHUNK_SIZE, CHUNK_MAGIC, FXB_MAGIC, FXP_MAGIC, \
+    KHS_ONE_ID, as_view
+from .library import LIBRARY_HEADER, LIBRARY_MAGIC, LIBRARY_VERSION
+from .schema import SCHEMA_VERSION
+from .utils import CURRENT_VERSION, PARAM_COUNT
+from typing import NamedTuple, Union
+import os
+import re
+import struct
+
+SNIFF_SIZE = 512  # Bytes looked at
+
+_CHUNK_MAGIC_BYTES = CHUNK_MAGIC.to_bytes(4, 'big')
+
+_CHUNK_HEADER = struct.Struct('>4I')  # The parts FXP_HEADER and FXB_HEADER share: chunkMagic, size, fxMagic, version
+_FX_ID = struct.Struct('>2I')  # fx_id, version, after those
+# The parsers don't mind a mangled prolog or root element, so neither does this. Any of the elements they look at
+# will do
+_RE_MARKER = re.compile(rb'<(?:JukeboxPatch|DeviceNameInEnglish|Properties|Value)\b')
+_AU_MARKER = re.compile(rb'<(?:plist|dict|key)\b')
+_AU_SUBTYPE = re.compile(rb'<key>subtype</key>\s*<integer>\s*(-?\d+)\s*</integer>')
+_RE_PRODUCT_ID = re.compile(rb'deviceProductID="([^"]*)"')
+
+
+class SniffResult(NamedTuple):
+    """
+    What a file looks like
+    """
+    fmt: Union[str, None]  # One of convert.FORMATS, or None if it's nothing we know
+    error: Union[str, None] = None  # A PARSE_ERRORS reason code if it won't convert
+
+    @property
+    def ok(self) -> bool:
+        return self.fmt is not None and self.error is None
+
+
+def _sniff_chunk(head: memoryview, size: int) -> SniffResult:
+    """
+    FXP and FXB
+    :param head:
+    :param size: Of the whole file
+    :return:
+    """
+    if len(head) < _CHUNK_HEADER.size + _FX_ID.size:
+        return SniffResult(None, 'truncated')
+
+    _, _, fx_magic, _ = _CHUNK_HEADER.unpack_from(head)
+    if fx_magic == FXP_MAGIC:
+        fmt, header_size, minimum_size, truncated = 'fxp', FXP_HEADER.size, FXP_HEADER.size + PARAM_CHUNK_SIZE, \
+            'truncated'
+    elif fx_magic == FXB_MAGIC:
+        fmt, header_size, minimum_size, truncated = 'fxb', FXB_HEADER.size, FXB_HEADER.size, 'bank_truncated'
+    else:
+        return SniffResult(None, 'bad_fx_magic')
+
+    fx_id, version = _FX_ID.unpack_from(head, _CHUNK_HEADER.size)
+    if size < header_size:
+        return SniffResult(fmt, truncated)
+    if fx_id != KHS_ONE_ID:
+        return SniffResult(fmt, 'wrong_fx_id')
+    if version < CURRENT_VERSION:
+        return SniffResult(fmt, 'old_version')
+    if size < minimum_size:
+        return SniffResult(fmt, 'bad_param_chunk')
+    return SniffResult(fmt)
+
+
+def _sniff_library(head: memoryview, size: int) -> SniffResult:
+    if len(head) < LIBRARY_HEADER.size:
+        return SniffResult('lib', 'library_truncated')
+
+    _, version, _, schema_version, param_count, _, *layout = LIBRARY_HEADER.unpack_from(head)
+    if version > LIBRARY_VERSION:
+        return SniffResult('lib', 'library_version')
+    if schema_version != SCHEMA_VERSION or param_count != PARAM_COUNT:
+        return SniffResult('lib', 'library_schema')
+    if layout[-1] > size:
+        return SniffResult('lib', 'library_truncated')
+    return SniffResult('lib')
+
+
+def _sniff_xml(head: memoryview) -> SniffResult:
+    """
+    AU and Reason. Their identifying values are checked if they're near enough the start to see
+    :param head:
+    :return:
+    """
+    head = bytes(head)
+    if _RE_MARKER.search(head):
+        product_id = _RE_PRODUCT_ID.search(head)
+        if product_id is not None and product_id.group(1) != b'com.kilohearts.khsONE':
+            return SniffResult('res', 'wrong_product_id')
+        return SniffResult('res')
+
+    if _AU_MARKER.search(head):
+        subtype = _AU_SUBTYPE.search(head)
+        if subtype is not None and int(subtype.group(1)) != KHS_ONE_ID:
+            return SniffResult('aup', 'wrong_subtype')
+        return SniffResult('aup')
+
+    return SniffResult(None, 'unknown_format')
+
+
+def sniff(data: BufferInput, size: Union[int, None] = None) -> SniffResult:
+    """
+    Work out a file's format from the start of it
+    :param data: The file, or at least its first SNIFF_SIZE bytes
+    :param size: Size of the whole file, if data is only the start of it
+    :return:
+    """
+    view = as_view(data)
+    head = view[:SNIFF_SIZE]
+    size = len(view) if size is None else size
+    if size == 0:
+        return SniffResult(None, 'unknown_format')
+
+    if head[:4] == _CHUNK_MAGIC_BYTES:
+        return _sniff_chunk(head, size)
+    if head[:4] == LIBRARY_MAGIC:
+        return _sniff_library(head, size)
+    return _sniff_xml(head)
+
+
+def sniff_file(file_path: Union[os.PathLike, str]) -> SniffResult:
+    """
+    Work out a file's format, reading no more of it than sniff needs
+    :param file_path:
+    :return:
+    """
+    with open(file_path, 'rb') as f:
+        return sniff(f.read(SNIFF_SIZE), os.fstat(f.fileno()).st_size)
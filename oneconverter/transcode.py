@@ -0,0 +1,116 @@
+"""
+Passthrough transcoding between FXP and AU
+
+An AU preset is just an FXP in a plist, so going between the two only needs the FXP header checked and the bytes
+wrapped or unwrapped. Nothing gets decoded into a Preset. Anything not laid out exactly the way return_fxp_data
+would write it goes the long way round instead, so the output is the same either way
+"""
+from .binary import BufferInput, FXP_HEADER, PARAM_CHUNK_HEADER, PARAM_CHUNK_SIZE, CHUNK_MAGIC, FXP_MAGIC, \
+    KHS_ONE_ID, FXP_NAME_SIZE, as_view, fxp_header, name_field
+from .preset import find_au_values, parse_failed, process_au, process_fxp
+from .render import render_au, xml_compatible
+from .utils import CURRENT_VERSION, PARAM_COUNT
+from typing import List, Tuple, Union
+import base64
+import binascii
+import struct
+
+FXP_SIZE = FXP_HEADER.size + PARAM_CHUNK_SIZE
+FXP_NAME = struct.Struct(f'>{FXP_NAME_SIZE}s')
+FXP_NAME_OFFSET = 28  # After the seven header ints
+
+
+def canonical_fxp_name(fxp_data: BufferInput) -> Union[str, None]:
+    """
+    Check an FXP's headers without touching its parameters
+    :param fxp_data:
+    :return: The preset name, or None if it's not a valid FXP laid out exactly like we'd write it
+    """
+    view = as_view(fxp_data)
+    if len(view) < FXP_SIZE:
+        return None
+
+    chunk_magic, _, fx_magic, _, fx_id, version, _, raw_name, chunk_size = FXP_HEADER.unpack_from(view)
+    if chunk_magic != CHUNK_MAGIC or fx_magic != FXP_MAGIC or fx_id != KHS_ONE_ID or version < CURRENT_VERSION \
+            or chunk_size != PARAM_CHUNK_SIZE:
+        return None
+
+    try:
+        name = raw_name.decode('utf-8').rstrip('\x00')
+    except UnicodeDecodeError:
+        return None
+
+    # Written back out, the header gets the param chunk's version and a tidied up name
+    chunk_version, _ = PARAM_CHUNK_HEADER.unpack_from(view, FXP_HEADER.size)
+    expected = FXP_HEADER.pack(*fxp_header(chunk_version, name_field(name, FXP_NAME_SIZE))) \
+        + PARAM_CHUNK_HEADER.pack(chunk_version, PARAM_COUNT)
+    if view[:len(expected)] != expected:
+        return None
+    return name
+
+
+def rename_fxp(fxp_data: BufferInput, name: str) -> bytearray:
+    """
+    Copy of an FXP with just the name field changed
+    :param fxp_data:
+    :param name:
+    :return:
+    """
+    renamed = bytearray(as_view(fxp_data))
+    FXP_NAME.pack_into(renamed, FXP_NAME_OFFSET, name_field(name, FXP_NAME_SIZE))
+    return renamed
+
+
+def fxp_to_au(fxp_data: BufferInput, errors: Union[List[str], None] = None) -> Union[Tuple[bytes, str], None]:
+    """
+    Wrap an FXP up as an AU preset
+    :param fxp_data:
+    :param errors: Gets the reason code (see PARSE_ERRORS) added if the preset can't be read
+    :return: The AU data and preset name, or None if it's not a usable preset
+    """
+    preset = None
+    name = canonical_fxp_name(fxp_data)
+    if name is None:
+        preset = process_fxp(fxp_data, errors=errors)
+        if preset is None:
+            return None
+        name = preset.name
+
+    if not xml_compatible(name):
+        return parse_failed('invalid_name', errors)
+    if preset is not None:
+        return preset.return_au_data(), name
+    return render_au(name, as_view(fxp_data)[:FXP_SIZE]), name
+
+
+def au_to_fxp(au_data: BufferInput, errors: Union[List[str], None] = None) -> Union[Tuple[bytes, str], None]:
+    """
+    Unwrap the FXP from an AU preset, named after the AU preset
+    :param au_data:
+    :param errors: Gets the reason code (see PARSE_ERRORS) added if the preset can't be read
+    :return: The FXP data and preset name, or None if it's not a usable preset
+    """
+    au_values = find_au_values(au_data, ('subtype', 'name', 'vstdata'))
+    if 'subtype' not in au_values or int(au_values['subtype']) != KHS_ONE_ID:
+        return parse_failed('wrong_subtype', errors)
+    if 'vstdata' not in au_values:
+        return parse_failed('no_vstdata', errors)
+
+    try:
+        fxp_data = base64.b64decode(''.join(au_values['vstdata'].split()), validate=True)
+    except binascii.Error:
+        fxp_data = b''
+    name = canonical_fxp_name(fxp_data)
+    if name is None:
+        preset = process_au(au_data, errors=errors)
+        return (bytes(preset.return_fxp_data()), preset.name) if preset is not None else None
+
+    name = au_values.get('name', name)
+    return bytes(rename_fxp(fxp_data[:FXP_SIZE], name)), name
+
+
+# (from, to): transcoder
+TRANSCODERS = {
+    ('fxp', 'aup'): fxp_to_au,
+    ('aup', 'fxp'): au_to_fxp,
+}
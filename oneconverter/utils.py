@@ -4,6 +4,7 @@ Utility functions for the ONE converter
 from typing import Union
 
 CURRENT_VERSION = 1014
+PARAM_COUNT = 108  # Number of parameters in an FXP param chunk
 
 
 def convert_magic(st_input: str) -> int:
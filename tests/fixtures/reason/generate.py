@@ -0,0 +1,49 @@
+"""
+Regenerate the Reason round trip golden files with the original code, which kept Reason values as Python floats
+
+    git worktree add /tmp/original 80145c7
+    python tests/fixtures/reason/generate.py /tmp/original
+
+Every case is a Reason patch with its values written as short decimals, like a person (or Reason) might write them
+(<case>.repatch), and what the original code wrote after reading it in (<case>.expected.repatch)
+"""
+from pathlib import Path
+import random
+import re
+import sys
+
+FIXTURES = Path(__file__).parent
+SOURCES = FIXTURES.parent.joinpath('render')
+
+
+def short_decimals(reason_data: bytes, seed: int) -> bytes:
+    """
+    A Reason patch with every fractional number swapped for a short decimal
+    :param reason_data:
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+
+    def replace(match: re.Match) -> bytes:
+        if b'.' not in match.group(2):
+            return match.group(0)  # Whole numbers (steps) stay as they are
+        return match.group(1) + str(rng.randrange(1, 1000) / 1000).encode('ascii')
+
+    return re.sub(rb'(type="number">)([^<]*)', replace, reason_data)
+
+
+def main(original: str) -> None:
+    sys.path.insert(0, original)
+    from oneconverter.preset import process_re
+
+    for seed, source in enumerate(('random_0', 'random_1')):
+        case = f'short_decimals_{source}'
+        reason_data = short_decimals(SOURCES.joinpath(f'{source}.repatch').read_bytes(), seed)
+        FIXTURES.joinpath(f'{case}.repatch').write_bytes(reason_data)
+        preset = process_re(reason_data, file_name=f'{case}.repatch')
+        FIXTURES.joinpath(f'{case}.expected.repatch').write_bytes(preset.return_reason_data())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
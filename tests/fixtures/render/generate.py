@@ -0,0 +1,77 @@
+"""
+Regenerate the render golden files with the lxml renderer the templates replaced
+
+    git worktree add /tmp/lxml-render a97c090^
+    python tests/fixtures/render/generate.py /tmp/lxml-render
+
+Every case is written as an FXP (the input), then the .repatch and .aupreset the old renderer made from that FXP.
+Cases with no .aupreset are ones the old renderer refused to make one for
+"""
+from pathlib import Path
+import random
+import struct
+import sys
+
+FIXTURES = Path(__file__).parent
+PARAM_COUNT = 108
+
+
+def _float32(value: float) -> float:
+    return struct.unpack('<f', struct.pack('<f', value))[0]
+
+
+def cases():
+    """
+    Name and values (None for the Init Patch's) of every case
+    :return:
+    """
+    rng = random.Random(7)
+    yield 'init_patch', 'Init Patch', None
+    yield 'zeros_empty_name', '', [0.0] * PARAM_COUNT
+    yield 'ones', 'Full Scale', [1.0] * PARAM_COUNT
+    yield 'escaped_name', 'A&B <c> "d" \'e\' &amp;', [rng.random() for _ in range(PARAM_COUNT)]
+    yield 'carriage_return_name', 'Line\rBreak', [rng.random() for _ in range(PARAM_COUNT)]
+    yield 'unicode_name', 'Ünïcödé ✓', [rng.random() for _ in range(PARAM_COUNT)]
+    yield 'long_name', 'A name much longer than twenty four bytes', [rng.random() for _ in range(PARAM_COUNT)]
+    yield 'tiny_values', 'Tiny', [rng.choice((1e-45, 1.1754944e-38, 5e-324, 1e-7, 0.0)) for _ in range(PARAM_COUNT)]
+    yield 'almost_one', 'Almost One', [rng.choice((0.99999994, 0.9999999, 0.5, 0.49999997, 0.50000006))
+                                       for _ in range(PARAM_COUNT)]
+    yield 'out_of_range', 'Out Of Range', [rng.choice((-1.0, -0.25, 1.5, 3.0, 1e6, -1e6)) for _ in range(PARAM_COUNT)]
+    yield 'step_boundaries', 'Step Boundaries', [rng.randrange(0, 64) / 126 for _ in range(PARAM_COUNT)]
+    for seed in range(3):
+        seeded = random.Random(seed)
+        yield f'random_{seed}', f'Random {seed}', [seeded.random() for _ in range(PARAM_COUNT)]
+    # Added later, so they get their own random numbers rather than changing everything else's
+    names = random.Random(100)
+    yield 'tab_newline_name', 'Tab\tNew\nLine', [names.random() for _ in range(PARAM_COUNT)]
+    yield 'control_character_name', 'Bell\x07 Escape\x1b', [names.random() for _ in range(PARAM_COUNT)]
+
+
+def main(baseline: str) -> None:
+    sys.path.insert(0, baseline)
+    from oneconverter.bank import init_patch_data
+    from oneconverter.preset import Preset, process_fxp
+    from oneconverter.utils import CURRENT_VERSION
+
+    for case, name, values in cases():
+        if values is None:
+            fxp_data = bytes(init_patch_data())
+        else:
+            preset = Preset(name, CURRENT_VERSION)
+            preset.values[:PARAM_COUNT] = type(preset.values)('f', [_float32(v) for v in values])
+            fxp_data = bytes(preset.return_fxp_data())
+
+        # Rendered from the FXP, the same way the tests read it
+        preset = process_fxp(fxp_data)
+        FIXTURES.joinpath(f'{case}.fxp').write_bytes(fxp_data)
+        FIXTURES.joinpath(f'{case}.repatch').write_bytes(preset.return_reason_data())
+        au_path = FIXTURES.joinpath(f'{case}.aupreset')
+        try:
+            au_path.write_bytes(preset.return_au_data())
+        except ValueError:  # lxml won't write names XML can't have
+            if au_path.exists():
+                au_path.unlink()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
@@ -0,0 +1,94 @@
+"""
+/convert and /converted: redirects to permanent addresses, ETags and conditional GETs
+"""
+from io import BytesIO
+from oneconverter.cache import ConversionCache
+from pathlib import Path
+from unittest import mock
+import converter_app
+import tempfile
+import unittest
+
+FXP = Path(__file__).parent.joinpath('fixtures', 'render', 'random_0.fxp').read_bytes()
+AUPRESET = Path(__file__).parent.joinpath('fixtures', 'render', 'random_0.aupreset').read_bytes()
+
+
+class ConvertedTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = Path(tmp.name)
+        self.use_cache(ConversionCache(cache_dir=self.cache_dir))
+        self.client = converter_app.app.test_client()
+
+    def use_cache(self, cache: ConversionCache) -> None:
+        patcher = mock.patch.object(converter_app, 'conversion_cache', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def convert(self):
+        return self.client.post('/convert', data={'to_fmt': 'aup', 'preset_file': (BytesIO(FXP), 'random_0.fxp')})
+
+    def test_redirect_and_conditional_get(self):
+        response = self.convert()
+        self.assertEqual(response.status_code, 303)
+        location = response.headers['Location']
+        key = location.rpartition('/')[2]
+
+        response = self.client.get(location)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, AUPRESET)
+        self.assertEqual(response.headers['ETag'], f'"{key}"')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+        for if_none_match in (f'"{key}"', f'W/"{key}"', '*'):
+            with self.subTest(if_none_match):
+                response = self.client.get(location, headers={'If-None-Match': if_none_match})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.data, b'')
+
+        # Converting again is a cache hit, that goes to the same place
+        response = self.convert()
+        self.assertEqual(response.status_code, 303)
+        self.assertEqual(response.headers['Location'], location)
+
+    def test_unknown_key(self):
+        location = '/converted/' + '0' * 64 + '.aup'
+        for headers in ({}, {'If-None-Match': '*'}, {'If-None-Match': '"' + '0' * 64 + '.aup"'}):
+            with self.subTest(headers):
+                self.assertEqual(self.client.get(location, headers=headers).status_code, 404)
+        self.assertEqual(self.client.get('/converted/not-a-key').status_code, 404)
+
+    def test_evicted(self):
+        location = self.convert().headers['Location']
+        self.use_cache(ConversionCache(cache_dir=self.cache_dir, max_disk_bytes=0))  # Prunes everything
+        response = self.client.get(location, headers={'If-None-Match': '*'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_no_disk_tier(self):
+        self.use_cache(ConversionCache())
+        response = self.convert()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, AUPRESET)
+        self.assertTrue(response.headers['Content-Location'].startswith('/converted/'))
+
+        # Still there for as long as it's in memory
+        response = self.client.get(response.headers['Content-Location'])
+        self.assertEqual(response.data, AUPRESET)
+
+    def test_disk_write_failed(self):
+        response = self.convert()
+        key = response.headers['Location'].rpartition('/')[2]
+        self.use_cache(ConversionCache(cache_dir=self.cache_dir))
+        for path in self.cache_dir.joinpath(key[:2]).iterdir():
+            path.unlink()
+        self.cache_dir.joinpath(key[:2]).rmdir()
+        self.cache_dir.joinpath(key[:2]).write_bytes(b'')  # Where its directory should be
+
+        response = self.convert()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, AUPRESET)
+
+
+if __name__ == '__main__':
+    unittest.main()
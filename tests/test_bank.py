@@ -0,0 +1,169 @@
+"""
+Reading, writing and editing FXB banks
+"""
+from oneconverter.bank import Bank, BankEditor, LazyBank, process_fxb, return_program_slot
+from oneconverter.binary import BANK_CHUNK_HEADER, BANK_PROGRAM_HEADER, FXB_HEADER, PROGRAM_SLOT_SIZE, fxb_header
+from oneconverter.preset import Preset, process_fxp
+from oneconverter.utils import CURRENT_VERSION
+from pathlib import Path
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+except ImportError:  # No numpy, no columnar banks
+    np = None
+
+
+def bank_with_program_chunk(program_chunk: bytes) -> bytes:
+    return FXB_HEADER.pack(*fxb_header(len(program_chunk))) + program_chunk
+
+
+def numbered_preset(number: int) -> Preset:
+    preset = Preset(f'Preset {number}', CURRENT_VERSION)
+    preset.values[0] = number / 128
+    return preset
+
+
+def padded_slot(preset: Preset, padding: int) -> bytes:
+    """
+    A program slot with a param chunk that's padding bytes longer than usual (readers ignore the extra)
+    """
+    slot = return_program_slot(preset)
+    name, param_chunk_size = BANK_PROGRAM_HEADER.unpack_from(slot)
+    BANK_PROGRAM_HEADER.pack_into(slot, 0, name, param_chunk_size + padding)
+    return bytes(slot) + b'\xaa' * padding
+
+
+class TruncatedBankTest(unittest.TestCase):
+    def test_short_program_chunk(self):
+        for program_chunk in (b'', b'\x00\x00'):
+            data = bank_with_program_chunk(program_chunk)
+            with self.subTest(len(program_chunk)):
+                errors = []
+                self.assertIsNone(process_fxb(data, errors=errors))
+                self.assertEqual(errors, ['bank_truncated'])
+
+                for bank_type in (LazyBank, BankEditor):
+                    errors = []
+                    with self.assertRaises(ValueError):
+                        bank_type(bytearray(data), errors=errors)
+                    self.assertEqual(errors, ['bank_truncated'])
+
+    @unittest.skipIf(np is None, 'Columnar banks require numpy')
+    def test_short_program_chunk_columnar(self):
+        errors = []
+        self.assertIsNone(process_fxb(bank_with_program_chunk(b'\x00'), columnar=True, errors=errors))
+        self.assertEqual(errors, ['bank_truncated'])
+
+
+class NameTest(unittest.TestCase):
+    LONG_NAME = 'a' + '\u00e9' * 23  # 24 characters, 47 bytes
+
+    def test_long_name_bank(self):
+        bank = process_fxb(Bank([Preset(self.LONG_NAME, CURRENT_VERSION)]).return_bank_data())
+        self.assertEqual(bank.presets[0].name, self.LONG_NAME[:12])
+
+    def test_long_name_fxp(self):
+        preset = process_fxp(Preset(self.LONG_NAME, CURRENT_VERSION).return_fxp_data())
+        self.assertEqual(preset.name, self.LONG_NAME[:14])
+
+    def test_rename_long_name(self):
+        with BankEditor(Bank([Preset('Short', CURRENT_VERSION)]).return_bank_data()) as bank:
+            bank.rename(0, self.LONG_NAME)
+            self.assertEqual(bank.name(0), self.LONG_NAME[:12])
+
+    def test_ascii_names_unchanged(self):
+        bank = process_fxb(Bank([Preset('A name much longer than twenty four', CURRENT_VERSION)]).return_bank_data())
+        self.assertEqual(bank.presets[0].name, 'A name much longer than ')
+
+    def test_undecodable_name(self):
+        data = Bank([Preset('Name', CURRENT_VERSION)]).return_bank_data()
+        data[FXB_HEADER.size + 4] = 0xff  # First byte of the first program's name
+        self.assertEqual(process_fxb(data).presets[0].name, '\ufffdame')
+        with LazyBank(data) as bank:
+            self.assertEqual(bank.name(0), '\ufffdame')
+
+
+class BankEditorTest(unittest.TestCase):
+    def setUp(self):
+        self.original = bytes(Bank([numbered_preset(i) for i in range(100)]).return_bank_data())
+
+    def edit(self, edits) -> bytes:
+        """
+        Make the same edits to the bank as a bytearray and as a file, which have to come out the same
+        :param edits: Called with the BankEditor
+        :return: The edited bank
+        """
+        in_memory = bytearray(self.original)
+        with BankEditor(in_memory) as bank:
+            edits(bank)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp).joinpath('bank.fxb')
+            path.write_bytes(self.original)
+            with BankEditor(path) as bank:
+                edits(bank)
+            on_disk = path.read_bytes()
+
+        self.assertEqual(bytes(in_memory), on_disk)
+        return on_disk
+
+    def assertBank(self, data: bytes, presets):
+        _, size, *_, num_programs, program_chunk_size = FXB_HEADER.unpack_from(data)
+        self.assertEqual(size, len(data) - 8)
+        self.assertEqual(program_chunk_size, len(data) - FXB_HEADER.size)
+        self.assertEqual(num_programs, 100)
+
+        bank = process_fxb(data)
+        self.assertEqual([p.name for p in bank.presets], [p.name for p in presets])
+        self.assertEqual([p.values[0] for p in bank.presets], [p.values[0] for p in presets])
+        with LazyBank(data) as lazy:
+            self.assertEqual(lazy.names(), [p.name for p in presets])
+
+    def test_same_size(self):
+        def edits(bank):
+            bank[5] = numbered_preset(500)
+
+        data = self.edit(edits)
+        self.assertEqual(len(data), len(self.original))
+        expected = [numbered_preset(i) for i in range(100)]
+        expected[5] = numbered_preset(500)
+        self.assertBank(data, expected)
+        # Only that slot changed
+        start = FXB_HEADER.size + BANK_CHUNK_HEADER.size + 5 * PROGRAM_SLOT_SIZE
+        self.assertEqual(data[:start], self.original[:start])
+        self.assertEqual(data[start + PROGRAM_SLOT_SIZE:], self.original[start + PROGRAM_SLOT_SIZE:])
+
+    def test_size_changes(self):
+        def edits(bank):
+            bank.replace_slot(3, padded_slot(numbered_preset(300), 40))
+            bank[50] = numbered_preset(5000)  # After the move
+            bank.replace_slot(3, padded_slot(numbered_preset(301), 8))  # Shrinks
+            bank.rename(99, 'Last')
+            self.assertEqual(bank.name(50), 'Preset 5000')
+
+        data = self.edit(edits)
+        self.assertEqual(len(data), len(self.original) + 8)
+        expected = [numbered_preset(i) for i in range(100)]
+        expected[3] = numbered_preset(301)
+        expected[50] = numbered_preset(5000)
+        expected[99].name = 'Last'
+        self.assertBank(data, expected)
+
+    def test_back_to_original(self):
+        def edits(bank):
+            bank.replace_slot(0, padded_slot(numbered_preset(0), 100))
+            bank[0] = numbered_preset(0)
+
+        self.assertEqual(self.edit(edits), self.original)
+
+    def test_bad_slot(self):
+        slot = padded_slot(numbered_preset(1), 4)[:-1]
+        with BankEditor(bytearray(self.original)) as bank:
+            with self.assertRaises(ValueError):
+                bank.replace_slot(1, slot)
+
+
+if __name__ == '__main__':
+    unittest.main()
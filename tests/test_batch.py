@@ -0,0 +1,44 @@
+"""
+Converting lots of files at once, into a zip
+"""
+from io import BytesIO
+from oneconverter.batch import MANIFEST_NAME, convert_archive
+from pathlib import Path
+import json
+import unittest
+import zipfile
+
+FXP = Path(__file__).parent.joinpath('fixtures', 'render', 'random_0.fxp').read_bytes()
+REPATCH = Path(__file__).parent.joinpath('fixtures', 'render', 'random_0.repatch').read_bytes()
+
+
+def archive(*member_names: str) -> bytes:
+    data = BytesIO()
+    with zipfile.ZipFile(data, 'w') as zip_file:
+        for member_name in member_names:
+            zip_file.writestr(member_name, FXP)
+    return data.getvalue()
+
+
+class ConvertArchiveTest(unittest.TestCase):
+    def convert(self, *member_names: str) -> zipfile.ZipFile:
+        return zipfile.ZipFile(BytesIO(b''.join(convert_archive(BytesIO(archive(*member_names)), 'res'))))
+
+    def test_keeps_directories(self):
+        converted = self.convert('a.fxp', 'sub/dir/b.fxp')
+        # Outputs are named after their presets
+        self.assertEqual(sorted(converted.namelist()), ['Random 0.repatch', MANIFEST_NAME, 'sub/dir/Random 0.repatch'])
+        self.assertEqual(converted.read('sub/dir/Random 0.repatch'), REPATCH)
+
+    def test_stays_inside(self):
+        member_names = ['../../a.fxp', '/b.fxp', 'sub/../../../c.fxp', 'sub/./d.fxp']
+        converted = self.convert(*member_names)
+        self.assertEqual(sorted(converted.namelist()),
+                         ['Random 0 (2).repatch', 'Random 0 (3).repatch', 'Random 0.repatch', MANIFEST_NAME,
+                          'sub/Random 0.repatch'])
+        manifest = json.loads(converted.read(MANIFEST_NAME))
+        self.assertEqual([entry['file'] for entry in manifest], member_names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+The content addressed conversion cache, in memory and on disk
+"""
+from oneconverter.cache import KEY_PATTERN, ConversionCache, cache_key
+from pathlib import Path
+import os
+import tempfile
+import unittest
+
+
+def numbered_key(number: int) -> str:
+    return cache_key(number.to_bytes(4, 'big'), 'fxp', 'aup')
+
+
+class CacheKeyTest(unittest.TestCase):
+    def test_key(self):
+        key = cache_key(b'data', 'fxp', 'aup')
+        self.assertRegex(key, KEY_PATTERN)
+        self.assertTrue(key.endswith('.aup'))
+        self.assertEqual(key, cache_key(bytearray(b'data'), 'fxp', 'aup'))
+
+    def test_everything_counts(self):
+        keys = {
+            cache_key(b'data', 'fxp', 'aup'),
+            cache_key(b'datb', 'fxp', 'aup'),
+            cache_key(b'data', 'res', 'aup'),
+            cache_key(b'data', 'fxp', 'res'),
+            cache_key(b'data', 'fxp', 'aup', 'a.fxp'),
+            cache_key(b'data', 'fxp', 'aup', 'b.fxp'),
+        }
+        self.assertEqual(len(keys), 6)
+
+
+class MemoryTierTest(unittest.TestCase):
+    def test_lru(self):
+        cache = ConversionCache(max_bytes=3 * 101)
+        for number in range(3):
+            self.assertFalse(cache.put(numbered_key(number), b'x' * 100, 'n'))  # No disk tier
+        cache.get(numbered_key(0))  # So 1 is the least recently used
+        cache.put(numbered_key(3), b'x' * 100, 'n')
+
+        self.assertIsNone(cache.get(numbered_key(1)))
+        for number in (0, 2, 3):
+            self.assertEqual(cache.get(numbered_key(number)), (b'x' * 100, 'n'))
+        self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+        self.assertEqual(cache.stats()['entries'], 3)
+
+    def test_too_big(self):
+        cache = ConversionCache(max_bytes=10)
+        cache.put(numbered_key(0), b'x' * 100, 'n')
+        self.assertIsNone(cache.get(numbered_key(0)))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+
+class DiskTierTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = Path(tmp.name)
+
+    def disk_files(self):
+        return [path for path in self.cache_dir.rglob('*') if path.is_file()]
+
+    def test_shared(self):
+        writer = ConversionCache(cache_dir=self.cache_dir)
+        self.assertTrue(writer.put(numbered_key(0), b'converted', 'Name é.aupreset'))
+        self.assertTrue(writer.on_disk(numbered_key(0)))
+        self.assertFalse(writer.on_disk(numbered_key(1)))
+
+        # Another worker only has the disk tier to go on
+        reader = ConversionCache(cache_dir=self.cache_dir)
+        self.assertEqual(reader.get(numbered_key(0)), (b'converted', 'Name é.aupreset'))
+        self.assertIsNone(reader.get(numbered_key(1)))
+        self.assertFalse(any(path.name.startswith('.tmp-') for path in self.disk_files()))
+
+    def test_write_failure(self):
+        cache = ConversionCache(cache_dir=self.cache_dir)
+        key = numbered_key(0)
+        self.cache_dir.joinpath(key[:2]).write_bytes(b'')  # Where its directory should be
+        self.assertFalse(cache.put(key, b'converted', 'n'))
+        self.assertEqual(cache.stats()['disk_write_failures'], 1)
+        self.assertFalse(cache.on_disk(key))
+        self.assertEqual(cache.get(key), (b'converted', 'n'))  # Still in memory
+
+    def test_prune(self):
+        cache = ConversionCache(max_bytes=0, cache_dir=self.cache_dir, max_disk_bytes=None)
+        for number in range(10):
+            cache.put(numbered_key(number), b'x' * 995, 'n')
+            path = cache._disk_path(numbered_key(number))
+            os.utime(path, ns=(number * 10 ** 9, number * 10 ** 9))
+        self.assertEqual(sum(path.stat().st_size for path in self.disk_files()), 10 * 1000)
+
+        cache.get(numbered_key(0))  # Recently used now
+        cache.max_disk_bytes = 5000
+        self.assertEqual(cache.prune(), 6000)
+        kept = [number for number in range(10) if cache.on_disk(numbered_key(number))]
+        self.assertEqual(kept, [0, 7, 8, 9])
+
+    def test_stays_in_budget(self):
+        cache = ConversionCache(max_bytes=0, cache_dir=self.cache_dir, max_disk_bytes=10000)
+        for number in range(50):
+            self.assertTrue(cache.put(numbered_key(number), b'x' * 995, 'n'))
+            self.assertLessEqual(sum(path.stat().st_size for path in self.disk_files()), 10000 + 2000)
+        self.assertTrue(cache.on_disk(numbered_key(49)))
+
+
+if __name__ == '__main__':
+    unittest.main()
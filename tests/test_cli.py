@@ -0,0 +1,150 @@
+"""
+python -m oneconverter convert: incremental re-runs, output collisions, stale outputs, --force and --prune
+"""
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from oneconverter.bank import Bank
+from oneconverter.cli import MANIFEST_NAME, main
+from oneconverter.preset import Preset
+from oneconverter.utils import CURRENT_VERSION
+from pathlib import Path
+import json
+import os
+import tempfile
+import unittest
+
+FIXTURES = Path(__file__).parent.joinpath('fixtures', 'render')
+
+
+def fixture(name: str) -> bytes:
+    return FIXTURES.joinpath(name).read_bytes()
+
+
+def bank_data(*names: str) -> bytes:
+    return bytes(Bank([Preset(name, CURRENT_VERSION) for name in names]).return_bank_data())
+
+
+class ConvertTreeTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.src = Path(tmp.name, 'src')
+        self.dst = Path(tmp.name, 'dst')
+        self.src.mkdir()
+
+    def write(self, rel_path: str, data: bytes) -> None:
+        path = self.src.joinpath(rel_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    def run_convert(self, *options: str) -> str:
+        """
+        :return: The summary line
+        """
+        out, err = StringIO(), StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            self.exit_code = main(['convert', str(self.src), str(self.dst), '--to', 'repatch', '-j', '1', *options])
+        self.errors = err.getvalue()
+        return out.getvalue().strip().split(' in ')[0]
+
+    def outputs(self):
+        return sorted(path.relative_to(self.dst).as_posix() for path in self.dst.rglob('*')
+                      if path.is_file() and path.name != MANIFEST_NAME)
+
+    def manifest(self):
+        return json.loads(self.dst.joinpath(MANIFEST_NAME).read_text('utf-8'))['files']
+
+    def test_incremental(self):
+        self.write('a.fxp', fixture('random_0.fxp'))
+        self.write('sub/b.aupreset', fixture('random_1.aupreset'))
+        self.assertEqual(self.run_convert(), 'Converted 2, unchanged 0, failed 0, removed 0')
+        self.assertEqual(self.exit_code, 0)
+        self.assertEqual(self.outputs(), ['a.repatch', 'sub/b.repatch'])
+        self.assertEqual(self.dst.joinpath('a.repatch').read_bytes(), fixture('random_0.repatch'))
+        self.assertEqual(self.dst.joinpath('sub/b.repatch').read_bytes(), fixture('random_1.repatch'))
+
+        self.assertEqual(self.run_convert(), 'Converted 0, unchanged 2, failed 0, removed 0')
+
+        # Touched, but the same inside: hashed, and left alone
+        output = self.dst.joinpath('a.repatch')
+        os.utime(output, ns=(0, 0))
+        os.utime(self.src.joinpath('a.fxp'), ns=(10 ** 9, 10 ** 9))
+        self.assertEqual(self.run_convert(), 'Converted 0, unchanged 2, failed 0, removed 0')
+        self.assertEqual(output.stat().st_mtime_ns, 0)
+        self.assertEqual(self.manifest()['a.fxp']['mtime_ns'], 10 ** 9)
+
+        self.write('a.fxp', fixture('random_2.fxp'))
+        self.assertEqual(self.run_convert(), 'Converted 1, unchanged 1, failed 0, removed 0')
+        self.assertEqual(output.read_bytes(), fixture('random_2.repatch'))
+
+    def test_force(self):
+        self.write('a.fxp', fixture('random_0.fxp'))
+        self.write('b.fxp', fixture('random_1.fxp'))
+        self.run_convert()
+        self.src.joinpath('b.fxp').unlink()
+
+        self.assertEqual(self.run_convert('--force'), 'Converted 1, unchanged 0, failed 0, removed 0')
+        # Forcing doesn't forget what was converted before, so it can still be pruned
+        self.assertEqual(sorted(self.manifest()), ['a.fxp', 'b.fxp'])
+        self.assertEqual(self.outputs(), ['a.repatch', 'b.repatch'])
+        self.assertEqual(self.run_convert('--force', '--prune'), 'Converted 1, unchanged 0, failed 0, removed 1')
+        self.assertEqual(self.outputs(), ['a.repatch'])
+
+    def test_prune(self):
+        self.write('a.fxp', fixture('random_0.fxp'))
+        self.write('bank.fxb', bank_data('One', 'Two'))
+        self.run_convert()
+        self.assertEqual(len(self.outputs()), 101)
+
+        self.src.joinpath('bank.fxb').unlink()
+        self.assertEqual(self.run_convert(), 'Converted 0, unchanged 1, failed 0, removed 0')
+        self.assertEqual(len(self.outputs()), 101)  # Without --prune, outputs stay
+        self.assertEqual(self.run_convert('--prune'), 'Converted 0, unchanged 1, failed 0, removed 1')
+        self.assertEqual(self.outputs(), ['a.repatch'])
+
+    def test_collisions(self):
+        self.write('a.fxp', fixture('random_0.fxp'))
+        self.write('a.aupreset', fixture('random_1.aupreset'))
+        self.assertEqual(self.run_convert(), 'Converted 2, unchanged 0, failed 0, removed 0')
+        self.assertEqual(self.outputs(), ['a.aupreset.repatch', 'a.fxp.repatch'])
+        self.assertEqual(self.dst.joinpath('a.fxp.repatch').read_bytes(), fixture('random_0.repatch'))
+
+        # On its own again, a.fxp goes back to its usual name and the old outputs go
+        self.src.joinpath('a.aupreset').unlink()
+        self.assertEqual(self.run_convert('--prune'), 'Converted 1, unchanged 0, failed 0, removed 1')
+        self.assertEqual(self.outputs(), ['a.repatch'])
+        self.assertEqual(self.dst.joinpath('a.repatch').read_bytes(), fixture('random_0.repatch'))
+
+    def test_unresolvable_collision(self):
+        self.write('a.fxp', fixture('random_0.fxp'))
+        self.write('a.aupreset', fixture('random_1.aupreset'))
+        self.write('a.fxp.fxp', fixture('random_2.fxp'))  # Already called what a.fxp's output gets renamed to
+        self.assertEqual(self.run_convert(), 'Converted 2, unchanged 0, failed 1, removed 0')
+        self.assertEqual(self.exit_code, 1)
+        self.assertIn('a.fxp: Its output would overwrite another file\'s', self.errors)
+        self.assertEqual(self.outputs(), ['a.aupreset.repatch', 'a.fxp.repatch'])
+        self.assertEqual(self.dst.joinpath('a.fxp.repatch').read_bytes(), fixture('random_2.repatch'))
+
+    def test_bank_directory_collision(self):
+        self.write('bank.fxb', bank_data('One'))
+        self.write('bank/one.fxp', fixture('random_0.fxp'))
+        self.run_convert()
+        # The bank moves out of the way, the preset already in that directory doesn't
+        self.assertIn('bank/one.repatch', self.outputs())
+        self.assertIn('bank.fxb/One.repatch', self.outputs())
+        self.assertFalse(any(path.startswith('bank/') and path != 'bank/one.repatch' for path in self.outputs()))
+
+    def test_stale_outputs(self):
+        self.write('bank.fxb', bank_data('One', 'Two'))
+        self.run_convert()
+        self.assertIn('bank/Two.repatch', self.outputs())
+
+        self.write('bank.fxb', bank_data('One', 'Three'))
+        self.assertEqual(self.run_convert(), 'Converted 1, unchanged 0, failed 0, removed 0')
+        self.assertIn('bank/Three.repatch', self.outputs())
+        self.assertNotIn('bank/Two.repatch', self.outputs())
+        self.assertEqual(len(self.outputs()), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+BoundedPool: turning work away when full, timeouts and workers dying
+"""
+from concurrent.futures.process import BrokenProcessPool
+from oneconverter.pool import BoundedPool, ConversionTimeout, PoolFull
+import os
+import time
+import unittest
+
+
+# Jobs have to be module level to get to the workers
+def sleep_for(seconds: float) -> float:
+    time.sleep(seconds)
+    return seconds
+
+
+def crash_after(seconds: float) -> None:
+    time.sleep(seconds)
+    os._exit(1)
+
+
+def wait_until(condition, timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+class BoundedPoolTest(unittest.TestCase):
+    def make_pool(self, **kwargs) -> BoundedPool:
+        pool = BoundedPool(**kwargs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_run(self):
+        pool = self.make_pool(workers=1)
+        self.assertEqual(pool.run(sleep_for, 0), 0)
+
+    def test_full(self):
+        pool = self.make_pool(workers=1, queue_depth=1)
+        running = [pool.submit(sleep_for, 0.5) for _ in range(pool.capacity)]
+        with self.assertRaises(PoolFull):
+            pool.run(sleep_for, 0)
+        self.assertEqual(pool.rejected, 1)
+
+        self.assertEqual([future.result() for future in running], [0.5, 0.5])
+        self.assertTrue(wait_until(lambda: pool.run(sleep_for, 0) == 0))
+
+    def test_timeout_frees_slot(self):
+        pool = self.make_pool(workers=1, timeout=0.3)
+        started = time.monotonic()
+        with self.assertRaises(ConversionTimeout):
+            pool.run(sleep_for, 30)
+        self.assertEqual(pool.timed_out, 1)
+
+        # The stuck worker still has its job, but the slot's free and a new pool takes over
+        self.assertEqual(pool.run(sleep_for, 0), 0)
+        self.assertLess(time.monotonic() - started, 10)
+
+    def test_retire_spares_healthy_jobs(self):
+        pool = self.make_pool(workers=2)
+        healthy = pool.submit(sleep_for, 1)
+        stuck_pool = pool._get_executor()
+        with self.assertRaises(ConversionTimeout):
+            pool.run(sleep_for, 30, timeout=0.3)
+        processes = list(stuck_pool._processes.values())  # Still around while the healthy job is
+        self.assertEqual(len(processes), 2)
+
+        self.assertIsNot(pool._get_executor(), stuck_pool)
+        self.assertEqual(healthy.result(), 1)
+        # Once the healthy job's done, the stuck worker gets killed
+        self.assertTrue(wait_until(lambda: not any(process.is_alive() for process in processes)))
+
+    def test_broken_pool_retried(self):
+        pool = self.make_pool(workers=2)
+        pool.submit(crash_after, 0.2)
+        # Running when the other job takes the pool down, so it gets run again on a fresh one
+        self.assertEqual(pool.run(sleep_for, 0.5), 0.5)
+
+    def test_crashing_job(self):
+        pool = self.make_pool(workers=1)
+        with self.assertRaises(BrokenProcessPool):
+            pool.run(crash_after, 0)
+        self.assertEqual(pool.run(sleep_for, 0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
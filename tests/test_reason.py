@@ -0,0 +1,38 @@
+"""
+Reason patches read back in have to be written out the way the original code did, values and all. The golden files
+under fixtures/reason were made by it (see fixtures/reason/generate.py)
+"""
+from oneconverter.preset import process_re
+from pathlib import Path
+import re
+import unittest
+
+FIXTURES = Path(__file__).parent.joinpath('fixtures', 'reason')
+CASES = sorted(path.name[:-len('.repatch')] for path in FIXTURES.glob('*.repatch')
+               if not path.name.endswith('.expected.repatch'))
+
+
+class ReasonRoundTripTest(unittest.TestCase):
+    def test_has_cases(self):
+        self.assertGreaterEqual(len(CASES), 2)
+
+    def test_round_trip(self):
+        for case in CASES:
+            reason_data = FIXTURES.joinpath(f'{case}.repatch').read_bytes()
+            expected = FIXTURES.joinpath(f'{case}.expected.repatch').read_bytes()
+            # A comment sends it through lxml instead of the byte scan
+            commented = reason_data.replace(b'<JukeboxPatch', b'<!-- Commented --><JukeboxPatch', 1)
+            for variant, data in (('scanned', reason_data), ('parsed', commented)):
+                with self.subTest(case=case, variant=variant):
+                    self.assertEqual(process_re(data, file_name=f'{case}.repatch').return_reason_data(), expected)
+
+    def test_no_float32_drift(self):
+        # 0.3 goes back out as 0.3, not as the nearest float32 (0.30000001192092896)
+        reason_data = FIXTURES.joinpath(f'{CASES[0]}.repatch').read_bytes()
+        reason_data = re.sub(rb'(property="OSC_1_GAIN" type="number">)[^<]*', rb'\g<1>0.3', reason_data)
+        rendered = process_re(reason_data, file_name='gain.repatch').return_reason_data()
+        self.assertIn(b'<Value property="OSC_1_GAIN" type="number">0.3</Value>', rendered)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Template rendering has to give exactly what the lxml renderer it replaced did. The golden files under
+fixtures/render were made by that renderer (see fixtures/render/generate.py). Cases without an .aupreset are ones
+it refused to make one for
+"""
+from oneconverter.bank import Bank
+from oneconverter.convert import ConversionError, convert_file, transcode_preset
+from oneconverter.preset import process_fxp
+from pathlib import Path
+import unittest
+
+try:
+    import numpy as np
+    from oneconverter.columnar import render_reason_batch
+except ImportError:  # No numpy, no batch rendering
+    np = None
+
+FIXTURES = Path(__file__).parent.joinpath('fixtures', 'render')
+CASES = sorted(path.stem for path in FIXTURES.glob('*.fxp'))
+
+
+def golden(case: str, extension: str) -> bytes:
+    return FIXTURES.joinpath(f'{case}.{extension}').read_bytes()
+
+
+def has_golden(case: str, extension: str) -> bool:
+    return FIXTURES.joinpath(f'{case}.{extension}').exists()
+
+
+class RenderGoldenTest(unittest.TestCase):
+    def test_has_cases(self):
+        self.assertGreaterEqual(len(CASES), 10)
+
+    def test_reason(self):
+        for case in CASES:
+            with self.subTest(case):
+                preset = process_fxp(golden(case, 'fxp'))
+                self.assertEqual(preset.return_reason_data(), golden(case, 'repatch'))
+
+    def test_au(self):
+        for case in CASES:
+            with self.subTest(case):
+                preset = process_fxp(golden(case, 'fxp'))
+                if has_golden(case, 'aupreset'):
+                    self.assertEqual(preset.return_au_data(), golden(case, 'aupreset'))
+                else:
+                    with self.assertRaises(ValueError):
+                        preset.return_au_data()
+
+    def test_au_transcode(self):
+        # FXP to AU skips decoding the preset, and still has to come out the same
+        for case in CASES:
+            with self.subTest(case):
+                if has_golden(case, 'aupreset'):
+                    transcoded = transcode_preset(golden(case, 'fxp'), 'fxp', 'aup')
+                    self.assertEqual(transcoded[0], golden(case, 'aupreset'))
+                else:
+                    with self.assertRaises(ConversionError) as raised:
+                        transcode_preset(golden(case, 'fxp'), 'fxp', 'aup')
+                    self.assertEqual(raised.exception.reason, 'invalid_name')
+
+    def test_au_refused(self):
+        refused = [case for case in CASES if not has_golden(case, 'aupreset')]
+        self.assertTrue(refused)
+        for case in refused:
+            with self.subTest(case):
+                # Exploding a bank exports every preset, rather than transcoding
+                bank_data = Bank([process_fxp(golden(case, 'fxp'))]).return_bank_data()
+                with self.assertRaises(ConversionError) as raised:
+                    convert_file(bank_data, 'fxb', 'aup')
+                self.assertEqual(raised.exception.reason, 'invalid_name')
+
+    @unittest.skipIf(np is None, 'Batch rendering requires numpy')
+    def test_reason_batch(self):
+        presets = [process_fxp(golden(case, 'fxp')) for case in CASES]
+        matrix = np.stack([np.frombuffer(preset.values, dtype=np.float32, count=108) for preset in presets])
+        for case, rendered in zip(CASES, render_reason_batch(matrix)):
+            with self.subTest(case):
+                self.assertEqual(rendered, golden(case, 'repatch'))
+
+
+if __name__ == '__main__':
+    unittest.main()
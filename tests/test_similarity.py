@@ -0,0 +1,53 @@
+"""
+Similarity search: the fast candidate search and the exact rerank have to agree on what a distance is
+"""
+from oneconverter.utils import PARAM_COUNT
+import unittest
+
+try:
+    import numpy as np
+    from oneconverter.similarity import ONE_HOT_QUERIES, PresetIndex
+except ImportError:  # No numpy, no similarity search
+    np = None
+
+
+@unittest.skipIf(np is None, 'Similarity search requires numpy')
+class OutOfRangeTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.values = rng.random((200, PARAM_COUNT), dtype=np.float32)
+        self.index = PresetIndex()
+        self.column = int(self.index._cat_index[np.argmax(self.index._cat_top)])
+        self.values[:ONE_HOT_QUERIES, self.column] = 1.0  # The last step
+        self.index.add_values(self.values, [str(i) for i in range(len(self.values))])
+
+    def queries(self, count: int) -> np.ndarray:
+        """
+        Copies of the first rows, with a categorical parameter pushed past its last step
+        """
+        queries = self.values[:count].copy()
+        queries[:, self.column] = 1.5
+        return queries
+
+    def test_past_last_step(self):
+        # One query compares codes column by column, lots of them go through the one hot matrix product
+        for count in (1, ONE_HOT_QUERIES):
+            with self.subTest(count=count):
+                distances, indices = self.index.search(self.queries(count), k=1)
+                self.assertEqual(indices[:, 0].tolist(), list(range(count)))
+                self.assertEqual(distances[:, 0].tolist(), [0.0] * count)
+
+                distances, indices = self.index.within(self.queries(count), radius=0.0)
+                self.assertEqual([i.tolist() for i in indices], [[i] for i in range(count)])
+
+    def test_negative(self):
+        queries = self.values[:1].copy()
+        queries[0, self.column] = 0.0
+        self.index.add_values(queries, ['zero'])
+        queries[0, self.column] = -0.5
+        distances, indices = self.index.search(queries, k=1)
+        self.assertEqual((indices[0, 0], distances[0, 0]), (len(self.values), 0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()